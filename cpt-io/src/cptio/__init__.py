@@ -1,8 +1,11 @@
 from .fileio import (
     open_cptdataset,
     open_cptdataarray,
+    index_cptfile,
     to_cptv10,
     convert_np64_datetime,
+    CPTv10Cache,
+    open_gradsdataset,
 )
 from .utilities import (
     rmrf,
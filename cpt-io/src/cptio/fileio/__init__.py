@@ -1 +1,4 @@
 from .cpt import *
+from .backend import CPTv10BackendEntrypoint
+from .cache import CPTv10Cache
+from .grads import open_gradsdataset
@@ -0,0 +1,151 @@
+import numpy as np
+import os
+import xarray as xr
+from xarray.backends import BackendArray, BackendEntrypoint
+from xarray.core import indexing
+
+from .cpt import (
+    CPT_NAMESPACE,
+    decode_date_ranges,
+    load_index,
+    read_cpt_date,
+    read_selection,
+    select_blocks,
+)
+
+
+# Dimensions along which a field is split into blocks, and which can
+# therefore be read a few blocks at a time.
+KEYED_DIMS = ["T", "C", "M"]
+
+
+class CPTv10BackendArray(BackendArray):
+    '''One field of a CPTv10 file, read from disk a few blocks at a time
+    as it is indexed.'''
+
+    def __init__(self, filename, index, field, dims, shape, keyed):
+        self.filename = filename
+        self.index = index
+        self.field = field
+        self.dims = dims
+        self.shape = shape
+        self.keyed = keyed
+        self.dtype = np.dtype(float)
+
+    def __getitem__(self, key):
+        return indexing.explicit_indexing_adapter(
+            key, self.shape, indexing.IndexingSupport.OUTER, self._raw_indexing_method
+        )
+
+    def _raw_indexing_method(self, key):
+        # Turn the key along each keyed dimension into the sorted positions
+        # of the blocks to read, and the key into the array read from them.
+        selection, local_key = {}, []
+        for dim, size, k in zip(self.dims, self.shape, key):
+            if dim not in self.keyed:
+                local_key.append(k)
+                continue
+            positions = np.arange(size)[k]
+            wanted = np.unique(positions)
+            if wanted.size == 0:
+                return np.empty(np.empty(self.shape, dtype=bool)[key].shape)
+            selection[dim] = list(wanted)
+            local_key.append(np.searchsorted(wanted, positions))
+        chosen, _ = select_blocks(self.index, self.field, selection)
+        ds = read_selection(self.filename, chosen)
+        array = ds[self.field.replace(" ", "_")].values
+        # Index one axis at a time, from the last, so that integer keys,
+        # which drop their axis, don't shift the axes still to come.
+        for axis in reversed(range(len(local_key))):
+            array = array[(slice(None),) * axis + (local_key[axis],)]
+        return array
+
+
+def keyed_coords(chosen, dim):
+    '''Builds the coordinates along the keyed dimension dim of the field
+    made up of the chosen blocks, in the same way as open_cptdataset.'''
+    keys = list(dict.fromkeys(record[dim] for record, _ in chosen))
+    if dim != "T":
+        return {dim: (dim, keys)}
+    ranges = decode_date_ranges(keys)
+    # distinct strings can still denote the same period
+    _, first = np.unique(ranges[:, 1], return_index=True)
+    ranges = ranges[np.sort(first)]
+    coords = {
+        "T": ("T", ranges[:, 1]),
+        "Ti": ("T", ranges[:, 0]),
+        "Tf": ("T", ranges[:, 2]),
+    }
+    starts = list(dict.fromkeys(tags["S"] for _, tags in chosen if "S" in tags))
+    if len(starts) > 0:
+        coords["S"] = ("T", [read_cpt_date(s) for s in starts])
+    return coords
+
+
+def open_cptv10_lazy(filename):
+    '''Opens a CPTv10 file as a Dataset whose variables are read from disk
+    only as they are indexed, a few blocks at a time.
+
+    Each field's coordinates along row and col, and its non-dimension
+    coordinates, are taken from its first block; its coordinates along T,
+    C and M from the block index.'''
+    index = load_index(filename)
+    attrs = {}
+    for record in index:
+        attrs.update({k: v for k, v in record["header"].items() if k not in ["T", "S"]})
+
+    data_vars = {}
+    for field in dict.fromkeys(record["field"] for record in index):
+        chosen, _ = select_blocks(index, field, {})
+        tags = chosen[0][1]
+        keyed = [
+            dim for dim in KEYED_DIMS
+            if dim not in [tags["row"], tags["col"]]
+            and any(record[dim] is not None for record, _ in chosen)
+        ]
+        first, _ = select_blocks(index, field, {dim: [0] for dim in keyed})
+        name = field.replace(" ", "_")
+        template = read_selection(filename, first)[name]
+
+        coords = {
+            k: (c.dims, c.values)
+            for k, c in template.coords.items()
+            if not any(dim in keyed for dim in c.dims)
+        }
+        for dim in keyed:
+            coords.update(keyed_coords(chosen, dim))
+        shape = tuple(
+            len(coords[dim][1]) if dim in keyed else template.sizes[dim]
+            for dim in template.dims
+        )
+        array = CPTv10BackendArray(filename, index, field, template.dims, shape, keyed)
+        data_vars[name] = xr.DataArray(
+            indexing.LazilyIndexedArray(array),
+            dims=template.dims,
+            coords=coords,
+            attrs=attrs,
+        )
+    return xr.Dataset(data_vars)
+
+
+class CPTv10BackendEntrypoint(BackendEntrypoint):
+    '''Lets xarray open CPTv10 files lazily, with
+    xr.open_dataset(path, engine="cptv10"). Passing chunks gives dask
+    arrays, each chunk of which reads only its own blocks of the file.'''
+
+    description = "Open CPTv10 files in xarray"
+    url = "https://iri-pycpt.github.io/"
+    open_dataset_parameters = ("filename_or_obj", "drop_variables")
+
+    def open_dataset(self, filename_or_obj, *, drop_variables=None):
+        ds = open_cptv10_lazy(os.fspath(filename_or_obj))
+        if drop_variables is not None:
+            ds = ds.drop_vars(drop_variables)
+        return ds
+
+    def guess_can_open(self, filename_or_obj):
+        try:
+            with open(filename_or_obj, "r") as f:
+                return CPT_NAMESPACE in f.read(1024)
+        except Exception:
+            return False
@@ -0,0 +1,100 @@
+import hashlib
+import os
+from pathlib import Path
+import shutil
+import uuid
+
+import numpy as np
+
+from .cpt import to_cptv10
+
+
+def dataarray_digest(da, **kwargs):
+    '''A hash of everything that to_cptv10 writes out for da: its name,
+    dims, data, coordinates and attrs, plus the keyword arguments that
+    will be passed to to_cptv10.'''
+    h = hashlib.blake2b(digest_size=20)
+
+    def update(*items):
+        for item in items:
+            h.update(repr(item).encode())
+            h.update(b"\0")
+
+    def update_values(values):
+        values = np.asarray(values)
+        update(values.dtype.str, values.shape)
+        if values.dtype.kind in "OUS":
+            h.update("\0".join(map(str, values.ravel())).encode())
+        else:
+            h.update(np.ascontiguousarray(values).reshape(-1).view(np.uint8).data)
+
+    update(sorted(kwargs.items()), da.name, da.dims, sorted(da.attrs.items()))
+    if da.chunks is not None:
+        # Hash the dask graph rather than computing the whole array, which
+        # to_cptv10 only ever computes a block at a time.
+        from dask.base import tokenize
+        update(tokenize(da.data))
+    else:
+        update_values(da.values)
+    for name in sorted(da.coords):
+        update(name, da.coords[name].dims)
+        update_values(da.coords[name].values)
+    return h.hexdigest()
+
+
+class CPTv10Cache:
+    '''A directory of CPTv10 files named by the hash of the DataArray that
+    was written to each, so that writing the same DataArray again just
+    links to the file already there.
+
+    Files are evicted least recently used first once the directory holds
+    more than max_bytes.'''
+
+    def __init__(self, directory, max_bytes=2**30):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.directory.mkdir(exist_ok=True, parents=True)
+
+    def to_cptv10(self, da, opfile="cptv10.tsv", **kwargs):
+        '''Like cptio.to_cptv10, but hardlinks opfile to the cached file for
+        da if there is one (or copies it, if opfile is on another file
+        system), and otherwise writes da to the cache first.'''
+        cached = self.directory / f"{dataarray_digest(da, **kwargs)}.tsv"
+        try:
+            self.link(cached, opfile)
+        except FileNotFoundError:
+            tmp = self.directory / f".{uuid.uuid4()}.tmp"
+            to_cptv10(da, opfile=tmp, **kwargs)
+            os.replace(tmp, cached)
+            self.link(cached, opfile)
+            self.evict()
+        return opfile
+
+    def link(self, cached, opfile):
+        # Touch the cached file first, both to mark it as recently used
+        # and to fail early if it isn't there.
+        os.utime(cached)
+        Path(opfile).unlink(missing_ok=True)
+        try:
+            os.link(cached, opfile)
+        except FileNotFoundError:
+            raise
+        except OSError:
+            shutil.copyfile(cached, opfile)
+
+    def evict(self):
+        '''Deletes the least recently used files until the cache holds no
+        more than max_bytes.'''
+        files = []
+        for path in self.directory.glob("*.tsv"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
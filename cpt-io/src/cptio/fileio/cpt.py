@@ -1,328 +1,601 @@
 from ..utilities import is_valid_cptv10
 
+import collections
+import concurrent.futures
 import datetime as dt
-from io import StringIO
+import functools
+import itertools
+import json
+import locale
 import numpy as np
+import os
 import pandas as pd
 from pathlib import Path
 import re
 import xarray as xr
 
 
+CPT_NAMESPACE = "xmlns:cpt=http://iri.columbia.edu/CPT/v10/"
+
+
 def cpt_headers(header):
     m = re.compile("(?P<tag>cpt:.*?|cf:.*?)=(?P<value>.*?,|.*$)")
     matches = m.findall(header)
     return len(matches), {i.split(":")[1]: j.replace(",", "") for i, j in matches}
 
 
-def open_cptdataset(filename):
-    assert Path(filename).absolute().is_file(), "Cannot find {}".format(
-        Path(filename).absolute()
-    )
-    with open(str(Path(filename).absolute()), "r") as f:
-        content1 = f.read()
-    content = [line.strip() for line in content1.split("\n") if "xmlns" not in line]
-    xmlnns_lines = [line.strip() for line in content1.split("\n") if "xmlns" in line]
-    assert "xmlns:cpt=http://iri.columbia.edu/CPT/v10/" in " ".join(
-        xmlnns_lines
-    ), "CPT XML Namespace: {} Not detected".format(
-        "xmlns:cpt=http://iri.columbia.edu/CPT/v10/"
+def is_block_header(line):
+    '''True if line is a cpt: header that precedes a data block, as opposed
+    to a file-level tag like cpt:nfields or a coordinate row like cpt:T.'''
+    return (
+        "cpt:" in line and "=" in line
+        and "ncats" not in line and "nfields" not in line
     )
-    headers = [
-        (linenum, *cpt_headers(line))
-        if "=" in line and "ncats" not in line and "nfields" not in line
-        else (linenum, line)
-        for linenum, line in enumerate(content)
-        if "cpt:" in line
-    ]
-    attrs, data_vars = {}, {}
-    for i, header in enumerate(headers):
-        if (
-            len(header) == 3
-        ):  # we are only looking at the CPT headers that preceed a data block
-            attrs_at_row = {
-                k: header[2][k] for k in header[2].keys() if k not in ["T", "S"]
-            }
-            attrs.update(attrs_at_row)
 
-            column_labels = np.genfromtxt(
-                StringIO(content[header[0] + 1]), delimiter="\t", dtype=str
-            )
 
-            column_labels = (
-                np.expand_dims(column_labels, 0)
-                if len(column_labels.shape) < 1
-                else np.squeeze(column_labels)
-            )
+def content_lines(f, xmlns_lines):
+    '''Yields the stripped lines of the open file f one at a time, diverting
+    xmlns declarations into the list xmlns_lines.'''
+    for line in f:
+        line = line.strip()
+        if "xmlns" in line:
+            xmlns_lines.append(line)
+        else:
+            yield line
 
-            # Non-dimension coordinates that vary with column. These are typically present
-            # with station data, where column = station.
-            linenum = header[0] + 2
-            non_dim_coords = {}
-            # linenum >= len(content) shouldn't be possible, but it happens at the end of a subseasonal
-            # file when Ingrid crashes because of the fake T grid.
-            while linenum < len(content) and content[linenum].startswith('cpt:'):
-                vals = content[linenum].split('\t')
-                varname = vals[0][4:] # strip 'cpt:'
-                vals = np.array(vals[1:])
-                # If elev is all NaNs, the .strip() above removes all
-                # the tab delimiters. We ought to remove the strip(), but that's more
-                # work than it's worth just to save a variable with no values in it.
-                if len(vals) == 0:
-                    pass
-                else:
-                    # TODO these nested try/excepts give confusing stack traces when
-                    # something goes wrong, and they're too error-prone. We actually know
-                    # what type each variable is supposed to be, so stop guessing.
-                    try:
-                        vals = vals.astype(float)
-                    except ValueError:
-                        try:
-                            vals = np.asarray([read_cpt_date_range(ii) for ii in vals])
-                        except Exception:
-                            pass
-                    non_dim_coords[varname] = (attrs["col"], vals)
-                linenum += 1
-            
-            block = "\n".join(
-                content[linenum : linenum + int(attrs["nrow"])]
-            )
-            if block == "":
-                # ignore final header without a block, generated by ingrid just before
-                # it crashes because the fake T grid doesn't match the data.
+
+def check_namespace(xmlns_lines):
+    assert CPT_NAMESPACE in " ".join(
+        xmlns_lines
+    ), "CPT XML Namespace: {} Not detected".format(CPT_NAMESPACE)
+
+
+def iter_blocks(lines):
+    '''Walks the lines of a CPTv10 file once, yielding (header, block) for
+    each data block, where header is the dict of cpt: tags preceding the
+    block and block is the (column_labels, non_dim_coords, row_labels,
+    data) tuple returned by read_block. Only the current block is held
+    in memory.'''
+    attrs, types = {}, dict(COORD_TYPES)
+    for line in lines:
+        if not is_block_header(line):
+            continue
+        header = cpt_headers(line)[1]
+        attrs.update(header)
+        block = read_block(lines, attrs, types)
+        if block is None:
+            # ignore final header without a block, generated by ingrid just before
+            # it crashes because the fake T grid doesn't match the data.
+            return
+        yield header, block
+
+
+class OffsetLines:
+    '''Iterates over the lines of the binary file f like content_lines,
+    keeping track of the byte offset at which the line most recently
+    returned starts.'''
+
+    def __init__(self, f, xmlns_lines):
+        self.f = f
+        self.xmlns_lines = xmlns_lines
+        self.encoding = locale.getpreferredencoding(False)
+        self.offset = self.next_offset = f.tell()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        while True:
+            raw = next(self.f)
+            self.offset = self.next_offset
+            self.next_offset += len(raw)
+            line = raw.decode(self.encoding).strip()
+            if "xmlns" not in line:
+                return line
+            self.xmlns_lines.append(line)
+
+
+# Tags that place a block along a dimension other than row and col. A
+# header that names a field starts these afresh; other headers inherit
+# them from the one before, as in CPT's output files, where e.g. only the
+# first category of each year repeats cpt:T.
+BLOCK_DIMS = ["T", "S", "Mode", "C", "M"]
+
+INDEX_VERSION = 1
+
+
+def block_tags(headers):
+    '''Yields the full set of tags in effect for each of headers, including
+    those inherited from earlier headers.'''
+    tags = {}
+    for header in headers:
+        if "field" in header.keys():
+            tags = {k: v for k, v in tags.items() if k not in BLOCK_DIMS}
+        tags.update(header)
+        yield dict(tags)
+
+
+def scan_index(path):
+    '''Builds the block index of the CPTv10 file at path, skipping over the
+    blocks themselves without parsing them. See index_cptfile.'''
+    xmlns_lines, index = [], []
+    with open(path, "rb") as f:
+        lines = OffsetLines(f, xmlns_lines)
+        tags = {}
+        for line in lines:
+            if not is_block_header(line):
+                continue
+            offset = lines.offset
+            header = cpt_headers(line)[1]
+            if "field" in header.keys():
+                tags = {k: v for k, v in tags.items() if k not in BLOCK_DIMS}
+            tags.update(header)
+            if split_block(lines, tags) is None:
+                # header without a block, as in iter_blocks
                 break
-            array = np.genfromtxt(
-                StringIO(block),
-                delimiter="\t",
-                dtype=str,
-            )
+            index.append({
+                "offset": offset,
+                "field": tags["field"],
+                "T": tags.get("T"),
+                "C": tags.get("C"),
+                "M": tags.get("M"),
+                "shape": [int(tags["nrow"]), int(tags["ncol"])],
+                "header": header,
+            })
+    check_namespace(xmlns_lines)
+    return index
 
-            if len(array.shape) < 2:
-                array = array.reshape(1, -1)
-
-            # Separate row labels from data var values
-            row_labels = np.squeeze(array[:, 0])
-            row_labels = np.expand_dims(row_labels, 0) if len(row_labels.shape) < 1 else np.squeeze(row_labels)
-
-            # Keep station IDs as strings even if they look like numbers.
-            # Avoids unintended floating point rounding.
-            if attrs['row'] != 'station':
-                try:
-                    row_labels = row_labels.astype(float)
-                except ValueError:
-                    try:
-                        row_labels = np.asarray([read_cpt_date_range(ii) for ii in row_labels])
-                    except Exception:
-                        pass
-            array = array[:, 1:]
-
-            # In files generated by CPT, for lat/lon data there's no column label
-            # on the first column (the latitudes column), but for station data the
-            # first column has the label "Station".
-            if len(column_labels) > array.shape[1]:
-                assert column_labels[0] == 'Station'
-                assert column_labels[1] == 'Latitude'
-                assert column_labels[2] == 'Longitude'
-                column_labels = column_labels[3:]
-                lat_vals = np.squeeze(array[:, 0])
-                lon_vals = np.squeeze(array[:, 1])
-                non_dim_coords['Y'] = ('station', lat_vals)
-                non_dim_coords['X'] = ('station', lon_vals)
-                array = array[:, 2:]
-
-            data = array.astype(float)
-
-            for k, (dim, vals) in non_dim_coords.items():
-                try:
-                    non_dim_coords[k] = (dim, vals.astype(float))
-                except ValueError:
-                    try:
-                        non_dim_coords[k] = (dim, np.asarray([read_cpt_date_range(ii) for ii in vals]))
-                    # ValueError as above, or TypeError when columns isn't iterable
-                    except Exception:
-                        pass
-
-            # Keep station IDs as strings even if they look like numbers.
-            # Avoids unintended floating point rounding.
-            if attrs['col'] != 'station':
-                try:
-                    column_labels = column_labels.astype(float)
-                except ValueError:
-                    try:
-                        column_labels = np.asarray([read_cpt_date_range(ii) for ii in column_labels])
-                    # ValueError as above, or TypeError when columns isn't iterable
-                    except Exception:
-                        pass
-
-            # The first CPT header always has a 'field' field
-            # indicating the variable stored. It is assumed to be the
-            # same thereafter if not explicitly changed
-            field = (
-                header[2]["field"] if "field" in header[2].keys() else attrs["field"]
-            )
 
-            if field not in data_vars.keys():
-                # now identify dimensions: 'T', 'Mode', 'C' - same
-                # deal , the same thereafter unless changed.
-                rowdim = header[2]["row"] if "row" in header[2].keys() else attrs["row"]
-                coldim = header[2]["col"] if "col" in header[2].keys() else attrs["col"]
-                somedims = [
-                    "T"
-                    if "T" in header[2].keys() and "T" not in [rowdim, coldim]
-                    else None,
-                    "Mode"
-                    if "Mode" in header[2].keys() and "Mode" not in [rowdim, coldim]
-                    else None,
-                    "C"
-                    if "C" in header[2].keys() and "C" not in [rowdim, coldim]
-                    else None,
-                    "M"
-                    if "M" in header[2].keys() and "M" not in [rowdim, coldim]
-                    else None,
-                ]
-                somedims = [
-                    jj for jj in somedims if jj is not None
-                ]  # keep only dims present
-                alldims = [rowdim, coldim]
-                somedims.extend(alldims)
-                alldims = somedims
-                coords = {}
-                for jj in alldims:
-                    if jj not in [rowdim, coldim]:
-                        if jj == "T":
-                            date_coord = read_cpt_date_range(header[2][jj])
-                            coords["T"] = [date_coord[1]]
-                            coords["Ti"] = [date_coord[0]]
-                            coords["Tf"] = [date_coord[2]]
-                        else:
-                            coords[jj] = [header[2][jj]]
-                temp = {rowdim: row_labels, coldim: column_labels}
-                if "T" in [rowdim, coldim]:
-                    date_coords = temp["T"]
-                    if len(date_coords[0]) == 1:
-                        temp["T"] = [date_coords[ii][0] for ii in range(len(date_coords))]
+def index_sidecar(path):
+    return Path(str(path) + ".idx")
+
+
+def read_index(path):
+    '''Returns the index stored in the sidecar file of the CPTv10 file at
+    path, or None if there isn't one or the file has changed since.'''
+    try:
+        with open(index_sidecar(path), "r") as f:
+            stored = json.load(f)
+        stat = Path(path).stat()
+    except (OSError, ValueError):
+        return None
+    if (
+        not isinstance(stored, dict)
+        or stored.get("version") != INDEX_VERSION
+        or stored.get("size") != stat.st_size
+        or stored.get("mtime_ns") != stat.st_mtime_ns
+    ):
+        return None
+    return stored["blocks"]
+
+
+def index_cptfile(path, sidecar=True):
+    '''Records the byte offset, field, T, C and M keys, and [nrow, ncol]
+    shape of every data block of the CPTv10 file at path. Returns a list
+    with one dict per block, in file order.
+
+    Unless sidecar is False, the index is saved next to the data file,
+    under the same name with .idx appended, and reused by later calls and
+    by open_cptdataset for as long as the data file is unchanged.'''
+    path = Path(path)
+    index = read_index(path)
+    if index is None:
+        index = scan_index(path)
+        if sidecar:
+            stat = path.stat()
+            stored = {
+                "version": INDEX_VERSION,
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+                "blocks": index,
+            }
+            # write then rename, so that a reader never sees half an index
+            tmp = Path(str(index_sidecar(path)) + ".tmp")
+            with open(tmp, "w") as f:
+                json.dump(stored, f)
+            os.replace(tmp, index_sidecar(path))
+    return index
+
+
+def select_blocks(index, field, selection):
+    '''Picks the blocks of index that belong to field (a name or list of
+    names, or None for all) and lie at the positions given by selection,
+    a dict mapping T, C and M to an int, slice or list of positions, or to
+    None for all. Positions count the distinct keys of each field in file
+    order, as with xarray's isel.
+
+    An int picks the same blocks as a list of that one position; dropping
+    its dimension is left to the caller. Returns the chosen (record, tags)
+    pairs, and the (dim, positions) items of selection that don't key any
+    chosen block, which are left for the caller to apply to the assembled
+    Dataset.'''
+    if isinstance(field, str):
+        field = [field]
+    chosen = [
+        (record, tags)
+        for record, tags in zip(index, block_tags(r["header"] for r in index))
+        if field is None
+        or record["field"] in field
+        or record["field"].replace(" ", "_") in field
+    ]
+    unkeyed = []
+    for dim, positions in selection.items():
+        if positions is None:
+            continue
+        if isinstance(positions, (int, np.integer)):
+            positions = [positions]
+        keys = {}
+        for record, _ in chosen:
+            if record[dim] is not None:
+                keys.setdefault(record["field"], {}).setdefault(record[dim], None)
+        if len(keys) == 0:
+            unkeyed.append((dim, positions))
+            continue
+        keep = {
+            f: set(np.array(list(k), dtype=object)[positions])
+            for f, k in keys.items()
+        }
+        chosen = [
+            (record, tags) for record, tags in chosen
+            if record[dim] is None or record[dim] in keep[record["field"]]
+        ]
+    return chosen, unkeyed
+
+
+def read_indexed_blocks(f, chosen):
+    '''Like iter_blocks, but seeks straight to each of the chosen blocks
+    of the binary file f instead of reading the whole file.'''
+    types = dict(COORD_TYPES)
+    for record, tags in chosen:
+        f.seek(record["offset"])
+        lines = OffsetLines(f, [])
+        next(lines) # the header itself
+        yield tags, read_block(lines, tags, types)
+
+
+def load_index(path):
+    '''Returns the block index of the CPTv10 file at path, from its sidecar
+    if it has an up-to-date one, otherwise by scanning the file.'''
+    index = read_index(path)
+    if index is None:
+        index = scan_index(path)
+    return index
+
+
+def read_blocks(path, chosen):
+    '''Reads and parses the chosen blocks of the CPTv10 file at path,
+    returning a list of (tags, block) pairs.'''
+    with open(path, "rb") as f:
+        return list(read_indexed_blocks(f, chosen))
+
+
+def read_selection(path, chosen, workers=None):
+    '''Reads the chosen (record, tags) blocks of the CPTv10 file at path, as
+    picked by select_blocks, into a Dataset.
+
+    With workers > 1, the blocks are split into contiguous batches that
+    are parsed in a pool of that many processes, and assembled in file
+    order as the batches come back.'''
+    block_counts = count_blocks(tags for _, tags in chosen)
+    if workers is None or workers <= 1 or len(chosen) < 2:
+        with open(path, "rb") as f:
+            return assemble_dataset(read_indexed_blocks(f, chosen), block_counts)
+    # a few batches per worker, so that a slow one doesn't hold up the rest
+    nbatches = min(len(chosen), 4 * workers)
+    bounds = np.linspace(0, len(chosen), nbatches + 1).astype(int)
+    batches = [chosen[i:j] for i, j in zip(bounds[:-1], bounds[1:])]
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        blocks = pool.map(read_blocks, itertools.repeat(path), batches)
+        return assemble_dataset(itertools.chain.from_iterable(blocks), block_counts)
+
+
+def count_blocks(headers):
+    '''Counts the blocks of each field, by C or M category, so that each
+    field's array can be allocated once at its final shape.'''
+    attrs, counts = {}, {}
+    for header in headers:
+        attrs.update(header)
+        category = header.get("C", header.get("M"))
+        counts.setdefault(attrs["field"], collections.Counter())[category] += 1
+    return counts
+
+
+def split_block(lines, attrs):
+    '''Takes the lines of the block that follows a header from the iterator
+    lines, without parsing them.
+
+    attrs holds the cpt: tags in effect for the block (nrow, ncol, row,
+    col). Returns (column_labels, coord_lines, rows), or None if the file
+    ends before any rows of data.'''
+    column_labels = next(lines, None)
+    if column_labels is None:
+        return None
+
+    # Non-dimension coordinates that vary with column. These are typically present
+    # with station data, where column = station.
+    coord_lines = []
+    line = next(lines, None)
+    while line is not None and line.startswith('cpt:'):
+        coord_lines.append(line)
+        line = next(lines, None)
+
+    rows = [] if line is None else [line]
+    rows.extend(itertools.islice(lines, int(attrs["nrow"]) - len(rows)))
+    rows = [row for row in rows if row != ""]
+    if len(rows) == 0:
+        return None
+    return column_labels, coord_lines, rows
+
+
+def read_block(lines, attrs, types=None):
+    '''Reads and parses the block that follows a header from the iterator
+    lines. Returns None if the file ends before any rows of data.
+
+    types maps coordinate names to the kinds of LABEL_DECODERS, as in
+    COORD_TYPES, and learns the kinds of other coordinates from the
+    first block in which they appear; see decode_labels.'''
+    if types is None:
+        types = dict(COORD_TYPES)
+    split = split_block(lines, attrs)
+    if split is None:
+        return None
+    column_labels, coord_lines, rows = split
+    column_labels = np.array(column_labels.split("\t"))
+
+    non_dim_coords = {}
+    for line in coord_lines:
+        vals = line.split('\t')
+        varname = vals[0][4:] # strip 'cpt:'
+        vals = np.array(vals[1:])
+        # If elev is all NaNs, the .strip() above removes all
+        # the tab delimiters. We ought to remove the strip(), but that's more
+        # work than it's worth just to save a variable with no values in it.
+        if len(vals) > 0:
+            non_dim_coords[varname] = (attrs["col"], decode_labels(vals, varname, types))
+
+    # In files generated by CPT, for lat/lon data there's no column label
+    # on the first column (the latitudes column), but for station data the
+    # first column has the label "Station", followed by Latitude and
+    # Longitude columns.
+    nlabels = 1
+    if len(column_labels) > int(attrs["ncol"]):
+        assert column_labels[0] == 'Station'
+        assert column_labels[1] == 'Latitude'
+        assert column_labels[2] == 'Longitude'
+        column_labels = column_labels[3:]
+        nlabels = 3
+
+    labels, values = [], []
+    for row in rows:
+        fields = row.split("\t", nlabels)
+        labels.append(fields[:nlabels])
+        values.append(fields[nlabels])
+    labels = np.array(labels)
+    data = parse_values(values)
+
+    row_labels = decode_labels(labels[:, 0], attrs['row'], types)
+    if nlabels == 3:
+        non_dim_coords['Y'] = ('station', decode_labels(labels[:, 1], 'Y', types))
+        non_dim_coords['X'] = ('station', decode_labels(labels[:, 2], 'X', types))
+    column_labels = decode_labels(column_labels, attrs['col'], types)
+
+    return column_labels, non_dim_coords, row_labels, data
+
+
+def parse_values(values):
+    '''Parses a list of tab-separated rows of numbers into a 2D float array
+    using numpy's C tokenizer, without an intermediate array of strings.'''
+    data = np.loadtxt(values, delimiter="\t", dtype=float, ndmin=2, comments=None)
+    return data.reshape(len(values), -1)
+
+
+# How the labels and cpt: coordinate rows of the coordinates CPT uses are
+# decoded. Station IDs and names are kept as strings even if they look
+# like numbers, which avoids unintended floating point rounding.
+COORD_TYPES = {
+    "X": "float",
+    "Y": "float",
+    "elev": "float",
+    "T": "date_range",
+    "station": "str",
+    "Name": "str",
+}
+
+
+LABEL_DECODERS = {
+    "float": lambda labels: labels.astype(float),
+    "date_range": lambda labels: decode_date_ranges(labels),
+    "str": lambda labels: labels,
+}
+
+
+def guess_label_type(labels):
+    '''Works out the kind of labels that aren't in COORD_TYPES: float if
+    they all parse as numbers, otherwise date_range if they all parse as
+    CPT dates, otherwise str.'''
+    for kind in ["float", "date_range"]:
+        try:
+            LABEL_DECODERS[kind](labels)
+            return kind
+        # ValueError, or TypeError when labels isn't iterable
+        except Exception:
+            pass
+    return "str"
+
+
+def decode_labels(labels, name=None, types=None):
+    '''Converts an array of label strings of the coordinate called name to
+    floats, [start, center, end] datetime64 ranges, or strings, according
+    to types (by default COORD_TYPES). Labels of a coordinate that isn't
+    in types, or that can't be decoded as types says, are guessed at, and
+    the guess is recorded in types so that later blocks decode that
+    coordinate the same way straight away.'''
+    if types is None:
+        types = dict(COORD_TYPES)
+    kind = types.get(name)
+    if kind is None:
+        kind = types[name] = guess_label_type(labels)
+    try:
+        return LABEL_DECODERS[kind](labels)
+    # labels that aren't what their coordinate usually is, e.g. T labels
+    # of single days, which aren't date ranges, are guessed at instead
+    except Exception:
+        kind = types[name] = guess_label_type(labels)
+        return LABEL_DECODERS[kind](labels)
+
+
+def fill_block(data_var, header, data):
+    '''Copies the data of one block into its slot in the preallocated
+    array of its field.'''
+    array, filled = data_var["data"], data_var["filled"]
+    ndims = len(data_var["dims"])
+    if ndims == 3:
+        array[filled[None]] = data
+        filled[None] += 1
+    elif ndims == 4:
+        assert "C" in header.keys() or "M" in header.keys(), (
+            "Only accomodating 4D data with a C (or M) dimension as the"
+            " highest dimension right now - its coord must change in every"
+            " header"
+        )
+        # Blocks of 4D data are sorted into the C (or M) dimension in
+        # the order in which that coordinate's values first appear.
+        category = header["C"] if "C" in header.keys() else header["M"]
+        slot = data_var["slots"].setdefault(category, len(data_var["slots"]))
+        array[slot, filled[category]] = data
+        filled[category] += 1
+
+
+def assemble_dataset(blocks, block_counts):
+    '''Assembles the (header, block) pairs of a CPTv10 file into a Dataset,
+    copying each block into arrays preallocated from block_counts.'''
+    attrs, data_vars = {}, {}
+    non_dim_coords = {}
+    for header, block in blocks:
+        column_labels, non_dim_coords, row_labels, data = block
+        attrs.update({k: header[k] for k in header.keys() if k not in ["T", "S"]})
+
+        # The first CPT header always has a 'field' field
+        # indicating the variable stored. It is assumed to be the
+        # same thereafter if not explicitly changed
+        field = (
+            header["field"] if "field" in header.keys() else attrs["field"]
+        )
+
+        if field not in data_vars.keys():
+            # now identify dimensions: 'T', 'Mode', 'C' - same
+            # deal , the same thereafter unless changed.
+            rowdim = header["row"] if "row" in header.keys() else attrs["row"]
+            coldim = header["col"] if "col" in header.keys() else attrs["col"]
+            somedims = [
+                "T"
+                if "T" in header.keys() and "T" not in [rowdim, coldim]
+                else None,
+                "Mode"
+                if "Mode" in header.keys() and "Mode" not in [rowdim, coldim]
+                else None,
+                "C"
+                if "C" in header.keys() and "C" not in [rowdim, coldim]
+                else None,
+                "M"
+                if "M" in header.keys() and "M" not in [rowdim, coldim]
+                else None,
+            ]
+            somedims = [
+                jj for jj in somedims if jj is not None
+            ]  # keep only dims present
+            alldims = [rowdim, coldim]
+            somedims.extend(alldims)
+            alldims = somedims
+            coords, t_keys = {}, None
+            for jj in alldims:
+                if jj not in [rowdim, coldim]:
+                    if jj == "T":
+                        # collected as strings, decoded all at once below
+                        t_keys = {header[jj]: None}
                     else:
-                        temp["T"] = [date_coords[ii][1] for ii in range(len(date_coords))]
-                        temp["Ti"] = [date_coords[ii][0] for ii in range(len(date_coords))]
-                        temp["Tf"] = [date_coords[ii][2] for ii in range(len(date_coords))]
-                coords.update(temp)
-                if "S" in header[2].keys():  # S is always a length-1 situation
-                    coords.update({"S": [read_cpt_date(header[2]["S"])]})
-                ndims = len(alldims)
-                if (
-                    "C" in alldims and ndims == 4
-                ):  # to accomodate 4D data, we sort C to the first
-                    # dimension, do all the C's separately, then shove
-                    # them together in the end.
-                    alldims.pop(alldims.index("C"))
-                    alldims.insert(0, "C")
-                if (
-                    "M" in alldims and ndims == 4
-                ):  # to accomodate 4D data, we sort C to the first
-                    # dimension, do all the C's separately, then shove
-                    # them together in the end.
-                    alldims.pop(alldims.index("M"))
-                    alldims.insert(0, "M")
-                data_vars[field] = {
-                    "dims": alldims,
-                    "coords": coords,
-                    "data": data
-                    if ndims == 2
-                    else np.expand_dims(data, 0)
-                    if ndims == 3
-                    else [np.expand_dims(data, 0)]
-                    if ndims == 4
-                    else None,
-                    "attrs": attrs,
-                }
-            # print('found {}-dimensional variable {}'.format(len(alldims), field))
+                        coords[jj] = [header[jj]]
+            temp = {rowdim: row_labels, coldim: column_labels}
+            if "T" in [rowdim, coldim]:
+                date_coords = temp["T"]
+                if date_coords.ndim == 1:
+                    # labels that aren't date ranges, such as single days,
+                    # are kept as decode_labels left them, with no Ti or Tf
+                    temp["T"] = date_coords
+                else:
+                    temp["T"] = date_coords[:, 1]
+                    temp["Ti"] = date_coords[:, 0]
+                    temp["Tf"] = date_coords[:, 2]
+            coords.update(temp)
+            if "S" in header.keys():  # S is always a length-1 situation
+                coords.update({"S": [read_cpt_date(header["S"])]})
+            ndims = len(alldims)
+            if (
+                "C" in alldims and ndims == 4
+            ):  # to accomodate 4D data, we sort C to the first
+                # dimension and fill each C's slice as its blocks
+                # come in.
+                alldims.pop(alldims.index("C"))
+                alldims.insert(0, "C")
+            if (
+                "M" in alldims and ndims == 4
+            ):  # likewise for M
+                alldims.pop(alldims.index("M"))
+                alldims.insert(0, "M")
+            if ndims == 2:
+                array = data
             else:
-                # detect new coordinates in T, C, or Mode:
-                for dim in data_vars[field]["coords"].keys():
-                    if dim in header[2].keys():
-                        if dim == "T":
-                            date_coord = read_cpt_date_range(header[2][dim])
-                            if date_coord[1] not in data_vars[field]["coords"][dim]:
-                                data_vars[field]["coords"]["T"].append(
-                                    date_coord[1]
-                                )
-                                data_vars[field]["coords"]["Ti"].append(
-                                    date_coord[0]
-                                )
-                                data_vars[field]["coords"]["Tf"].append(
-                                    date_coord[2]
-                                    )
-                        elif dim == "S":
-                            date_coord = read_cpt_date(header[2][dim])
-                            if date_coord not in data_vars[field]["coords"][dim]:
-                                data_vars[field]["coords"][dim].append(date_coord)
-                        else:
-                            if header[2][dim] not in data_vars[field]["coords"][dim]:
-                                data_vars[field]["coords"][dim].append(header[2][dim])
+                counts = block_counts[field]
                 if ndims == 3:
-                    data_vars[field]["data"] = np.concatenate(
-                        (data_vars[field]["data"], np.expand_dims(data, axis=0)), axis=0
-                    )
-                elif ndims == 4:
-                    assert "C" in header[2].keys() or "M" in header[2].keys(), (
-                        "Only accomodating 4D data with a C (or M) dimension as the"
-                        " highest dimension right now - its coord must change in every"
-                        " header"
-                    )
-                    if "C" in header[2].keys():
-                        if (
-                            len(data_vars[field]["data"])
-                            <= int(float(header[2]["C"])) - 1
-                        ):
-                            data_vars[field]["data"].append(
-                                np.expand_dims(data, axis=0)
-                            )
-                        else:
-                            data_vars[field]["data"][
-                                int(float(header[2]["C"])) - 1
-                            ] = np.concatenate(
-                                (
-                                    data_vars[field]["data"][
-                                        int(float(header[2]["C"])) - 1
-                                    ],
-                                    np.expand_dims(data, axis=0),
-                                ),
-                                axis=0,
-                            )
-                    if "M" in header[2].keys():
-                        if (
-                            len(data_vars[field]["data"])
-                            <= int(float(header[2]["M"])) - 1
-                        ):
-                            data_vars[field]["data"].append(
-                                np.expand_dims(data, axis=0)
-                            )
-                        else:
-                            data_vars[field]["data"][
-                                int(float(header[2]["M"])) - 1
-                            ] = np.concatenate(
-                                (
-                                    data_vars[field]["data"][
-                                        int(float(header[2]["M"])) - 1
-                                    ],
-                                    np.expand_dims(data, axis=0),
-                                ),
-                                axis=0,
-                            )
-
-                data_vars[field]["attrs"].update(attrs)
+                    shape = (sum(counts.values()),)
+                else:
+                    shape = (len(counts), max(counts.values()))
+                array = np.empty(shape + data.shape)
+            data_vars[field] = {
+                "dims": alldims,
+                "coords": coords,
+                "t_keys": t_keys,
+                "data": array,
+                "filled": collections.Counter(),
+                "slots": {},
+                "attrs": attrs,
+            }
+        # print('found {}-dimensional variable {}'.format(len(alldims), field))
+        else:
+            # detect new coordinates in T, C, or Mode:
+            if data_vars[field]["t_keys"] is not None and "T" in header.keys():
+                data_vars[field]["t_keys"].setdefault(header["T"])
+            for dim in data_vars[field]["coords"].keys():
+                if dim in header.keys():
+                    if dim == "S":
+                        date_coord = read_cpt_date(header[dim])
+                        if date_coord not in data_vars[field]["coords"][dim]:
+                            data_vars[field]["coords"][dim].append(date_coord)
+                    else:
+                        if header[dim] not in data_vars[field]["coords"][dim]:
+                            data_vars[field]["coords"][dim].append(header[dim])
+            data_vars[field]["attrs"].update(attrs)
+        fill_block(data_vars[field], header, data)
+
     # print(data_vars['attributes']['coords'])
 
     for field in data_vars.keys():
-        if len(data_vars[field]["dims"]) == 4:
-            data_vars[field]["data"] = np.concatenate(
-                [
-                    np.expand_dims(data_vars[field]["data"][k], axis=0)
-                    for k in range(len(data_vars[field]["data"]))
-                ],
-                axis=0,
-            )
+        array, filled = data_vars[field]["data"], data_vars[field]["filled"]
+        if len(data_vars[field]["dims"]) == 3:
+            assert filled[None] == array.shape[0], f"Missing blocks for {field}"
+        elif len(data_vars[field]["dims"]) == 4:
+            assert all(
+                n == array.shape[1] for n in filled.values()
+            ), f"Missing blocks for {field}"
     for f in data_vars.keys():
+        if data_vars[f]["t_keys"] is not None:
+            date_coords = decode_date_ranges(list(data_vars[f]["t_keys"]))
+            # distinct strings can still denote the same period
+            _, first = np.unique(date_coords[:, 1], return_index=True)
+            date_coords = date_coords[np.sort(first)]
+            data_vars[f]["coords"]["T"] = date_coords[:, 1]
+            data_vars[f]["coords"]["Ti"] = date_coords[:, 0]
+            data_vars[f]["coords"]["Tf"] = date_coords[:, 2]
         data_vars[f]["coords"] = {
             m: ("T" if m in ["S", "Ti", "Tf"] else m, data_vars[f]["coords"][m])
             for m in data_vars[f]["coords"].keys()
@@ -343,12 +616,49 @@ def open_cptdataset(filename):
     for k in dataarrays.keys():
         is_valid_cptv10(dataarrays[k], assert_units=False, assertmissing=False)
         if "missing" in dataarrays[k].attrs.keys():
-            dataarrays[k] = dataarrays[k].where(
-                dataarrays[k] != float(dataarrays[k].attrs["missing"]), other=np.nan
-            )
+            # Mask in place rather than with .where, which would copy
+            # the whole array.
+            array = dataarrays[k].values
+            array[array == float(dataarrays[k].attrs["missing"])] = np.nan
     return xr.Dataset(dataarrays)
 
 
+def open_cptdataset(filename, field=None, T=None, C=None, M=None, workers=None):
+    '''Opens a CPTv10 file as an xarray Dataset.
+
+    By default the whole file is read. Passing field (a name or list of
+    names) or positions along T, C or M (an int, slice or list, as with
+    xarray's isel, so an int drops its dimension) reads only the blocks
+    that make up that selection, seeking past the rest. The block index that makes this possible is
+    taken from the file's sidecar if index_cptfile has saved one, and is
+    otherwise built on the fly.
+
+    Passing workers > 1 parses the blocks in a pool of that many
+    processes, which pays off for files with many large blocks, such as
+    ensemble members or probabilities over a long period.'''
+    index = load_index(filename)
+    selection = {"T": T, "C": C, "M": M}
+    if (workers is None or workers <= 1) and field is None and all(
+        v is None for v in selection.values()
+    ):
+        block_counts = count_blocks(record["header"] for record in index)
+        with open(filename, "r") as f:
+            ds = assemble_dataset(iter_blocks(content_lines(f, [])), block_counts)
+        return ds
+
+    chosen, unkeyed = select_blocks(index, field, selection)
+    ds = read_selection(filename, chosen, workers=workers)
+    for dim, positions in unkeyed:
+        if dim in ds.dims:
+            ds = ds.isel({dim: positions})
+    # an int drops its dimension, as with isel, once the blocks are read
+    squeezed = {
+        dim: 0 for dim, positions in selection.items()
+        if isinstance(positions, (int, np.integer)) and dim in ds.dims
+    }
+    return ds.isel(squeezed)
+
+
 def open_cptdataarray(path):
     'Like cptio.open_cptdataset but returns a DataArray instead of a Dataset'
     ds = open_cptdataset(path)
@@ -388,6 +698,7 @@ def datetime_timestamp_end(date):
     return dt.datetime(y, m, d)
 
 
+@functools.lru_cache(maxsize=4096)
 def read_cpt_date(date_original):
     if "/" in date_original:
         raise Exception('Date must not contain /')
@@ -426,6 +737,25 @@ def read_cpt_date_range(date_original):
     return [ret1, ret1 + (ret2 - ret1) / 2, ret2]
 
 
+@functools.lru_cache(maxsize=4096)
+def cached_date_range(date_original):
+    '''read_cpt_date_range, as an immutable tuple that is worked out only
+    once for each distinct string.'''
+    return tuple(read_cpt_date_range(date_original))
+
+
+def decode_date_ranges(dates):
+    '''Decodes an array of CPT date range strings into an (n, 3) datetime64
+    array whose columns are the start, center and end of each range, as
+    used for the Ti, T and Tf coordinates. Each distinct string, such as
+    a season repeated in every block, is parsed only once.'''
+    unique, inverse = np.unique(np.asarray(dates, dtype=str), return_inverse=True)
+    decoded = np.array(
+        [cached_date_range(date) for date in unique], dtype="datetime64[ns]"
+    ).reshape(-1, 3)
+    return decoded[inverse.ravel()]
+
+
 convert_np64_datetime = pd.Timestamp
 
 
@@ -502,83 +832,115 @@ def to_cptv10(
         else ""
     )
     unitsblurb = f", cpt:units={da.attrs['units']}" if assert_units else ""
+
+    # Everything that is the same for every block is worked out once, then
+    # each block is formatted whole and written in one go. The data are
+    # only read one block at a time, so that a dask-backed (or lazily
+    # loaded) DataArray is never held in memory all at once.
+    da = da.transpose(*dims)
+    nrow, ncol = da.shape[-2:]
+    missing = float(da.attrs["missing"]) if assertmissing else None
+
+    if row == "T" or col == "T":
+        if 'Ti' in da.coords or T is not None:
+            tcoords_temp = [
+                format_date_range(ti, tf)
+                for ti, tf in zip(
+                    da.coords["Ti"].values,
+                    da.coords["Tf"].values
+                )
+            ]
+        else:
+            tcoords_temp = [
+                format_date(ti)
+                for ti in da.coords["T"].values
+            ]
+        tcoords = np.asarray(tcoords_temp, dtype="object")
+
+    # column dimension coordinate values
+    if col != "T":
+        vals = da.coords[col].values
+    else:
+        vals = tcoords
+    col_labels = "\t" + "\t".join(format_coord_values(vals)) + "\n"
+
+    # column non-dimension coordinate values, which go in the blocks of
+    # files without a T dimension
+    coord_rows = ""
+    if T is None:
+        non_dim_coords = [c for c in da.coords if c not in da.dims]
+        # For station data, X and Y must come first
+        if C is None and 'X' in non_dim_coords:
+            assert 'Y' in non_dim_coords
+            non_dim_coords = ['X', 'Y'] + list(set(non_dim_coords) - set(['X', 'Y']))
+        for c in non_dim_coords:
+            coord = da.coords[c]
+            assert len(coord.dims) == 1
+            if coord.dims == (col,):
+                coord_rows += (
+                    f"cpt:{c}\t"
+                    + "\t".join(format_coord_values(da.coords[c].values))
+                    + "\n"
+                )
+
+    # row dimension coordinate values, and how each block is formatted
+    if len(extra_dims) == 0:
+        # everything as strings, the values cast to str by numpy
+        if row != "T":
+            row_labels = np.array([f"{x:#g}" for x in da[row].values])
+        else:
+            row_labels = np.array([str(x) for x in tcoords])
+        dtype, fmt = None, "%s"
+    elif row != "T":
+        row_labels = da.coords[row].values
+        dtype, fmt = None, "%#g"
+    else:
+        row_labels = tcoords
+        dtype, fmt = "object", "%s"
+
+    # Replace rather than overwrite an existing file, which may be a
+    # hardlink into a CPTv10Cache.
+    Path(opfile).unlink(missing_ok=True)
     with open(opfile, "w") as f:
         f.write("xmlns:cpt=http://iri.columbia.edu/CPT/v10/" + "\n")
         f.write("cpt:nfields=1" + "\n")
         if C is not None:
             f.write(f"cpt:ncats={da.shape[list(da.dims).index(C)]}\n")
         if len(extra_dims) == 2:
-            da = da.transpose(T, C, row, col)
-            for i in range(da.shape[list(da.dims).index(T)]):
-                for j in range(da.shape[list(da.dims).index(C)]):
-                    if 'Ti' in da.coords:
-                        dates = format_date_range(
-                            da.coords['Ti'].values[i],
-                            da.coords['Tf'].values[i]
-                        )
-                    else:
-                        dates = format_date(da.coords[T].values[i])
-                    if 'S' in da.coords:
-                        s = convert_np64_datetime(da.coords['S'].values[i])
-                        s_part = f", cpt:S={s.strftime('%Y-%m-%dT%H:%M')}"
-                    else:
-                        s_part = ""
-                    if C == 'C':
-                        prob_part = ", cpt:clim_prob=0.33333"
-                    else:
-                        prob_part = ""
+            for i in range(da.shape[0]):
+                if 'Ti' in da.coords:
+                    dates = format_date_range(
+                        da.coords['Ti'].values[i],
+                        da.coords['Tf'].values[i]
+                    )
+                else:
+                    dates = format_date(da.coords[T].values[i])
+                if 'S' in da.coords:
+                    s = convert_np64_datetime(da.coords['S'].values[i])
+                    s_part = f", cpt:S={s.strftime('%Y-%m-%dT%H:%M')}"
+                else:
+                    s_part = ""
+                if C == 'C':
+                    prob_part = ", cpt:clim_prob=0.33333"
+                else:
+                    prob_part = ""
+                for j in range(da.shape[1]):
                     header = (
                         f"cpt:field={da.name}"
                         f", cpt:{T}={dates}"
                         f"{s_part}"
                         f", cpt:{C}={da.coords[C].values[j]}"
                         f"{prob_part}"
-                        f", cpt:nrow={da.shape[list(da.dims).index(row)]}"
-                        f", cpt:ncol={da.shape[list(da.dims).index(col)]}"
+                        f", cpt:nrow={nrow}"
+                        f", cpt:ncol={ncol}"
                         f", cpt:row={row}, cpt:col={col}"
                         f"{unitsblurb}{missingblurb}\n"
                     )
-                    if assertmissing:
-                        temp = (
-                            da.isel({T: i, C: j})
-                            .fillna(float(da.attrs["missing"]))
-                            .values
-                        )
-                    else:
-                        temp = da.isel({T: i, C: j}).values
-
-                    f.write(header)
-                    if row == "T" or col == "T":
-                        tcoords_temp = [
-                            format_date_range(ti, tf)
-                            for ti, tf in zip(
-                                da.coords["Ti"].values,
-                                da.coords["Tf"].values
-                            )
-                        ]
-                        tcoords = np.asarray(tcoords_temp, dtype="object")
-                    if col != "T":
-                        vals = da.coords[col].values
-                    else:
-                        vals = tcoords
-                    f.write(
-                        "\t"
-                        + "\t".join(format_coord_values(vals))
-                        + "\n"
-                    )
-                    if row != "T":
-                        temp = np.hstack([da.coords[row].values.reshape(-1, 1), temp])
-                    else:
-                        temp = np.hstack(
-                            [tcoords.reshape(-1, 1), temp.astype("object")]
-                        )
-                    if row != "T":
-                        np.savetxt(f, temp, fmt="%#g", delimiter="\t")
-                    else:
-                        np.savetxt(f, temp, fmt="%s", delimiter="\t")
+                    block = block_values(da.variable, (i, j), missing)
+                    rows = format_rows(row_labels, block, dtype, fmt)
+                    f.write(header + col_labels + rows)
         elif len(extra_dims) == 1 and T is not None:
-            da = da.transpose(T, row, col)
-            for i in range(da.shape[list(da.dims).index(T)]):
+            for i in range(da.shape[0]):
                 if 'Ti' in da.coords:
                     dates = format_date_range(
                         da.coords['Ti'].values[i],
@@ -595,167 +957,64 @@ def to_cptv10(
                     f"cpt:field={da.name}"
                     f", cpt:{T}={dates}"
                     f"{s_part}"
-                    f", cpt:nrow={da.shape[list(da.dims).index(row)]}"
-                    f", cpt:ncol={da.shape[list(da.dims).index(col)]}"
+                    f", cpt:nrow={nrow}"
+                    f", cpt:ncol={ncol}"
                     f", cpt:row={row}, cpt:col={col}"
                     f"{unitsblurb}{missingblurb}\n"
                 )
-                if assertmissing:
-                    temp = da.isel({T: i}).fillna(float(da.attrs["missing"])).values
-                else:
-                    temp = da.isel({T: i}).values
-                f.write(header)
-                if row == "T" or col == "T":
-                    tcoords_temp = [
-                        format_date_range(ti, tf)
-                        for ti, tf in zip(
-                            da.coords["Ti"].values,
-                            da.coords["Tf"].values
-                        )
-                    ]
-                    tcoords = np.asarray(tcoords_temp, dtype="object")
-                if col != "T":
-                    vals = da.coords[col].values
-                else:
-                    vals = tcoords
-                f.write(
-                    "\t"
-                    + "\t".join(format_coord_values(vals))
-                    + "\n"
-                )
-                if row != "T":
-                    temp = np.hstack([da.coords[row].values.reshape(-1, 1), temp])
-                else:
-                    temp = np.hstack([tcoords.reshape(-1, 1), temp.astype("object")])
-                if row != "T":
-                    np.savetxt(f, temp, fmt="%#g", delimiter="\t")
-                else:
-                    np.savetxt(f, temp, fmt="%s", delimiter="\t")
-
+                block = block_values(da.variable, i, missing)
+                rows = format_rows(row_labels, block, dtype, fmt)
+                f.write(header + col_labels + rows)
         elif len(extra_dims) == 1 and C is not None:
-            da = da.transpose(C, row, col)
-            for j in range(da.shape[list(da.dims).index(C)]):
+            for j in range(da.shape[0]):
                 header = (
                     f"cpt:field={da.name},"
                     f" cpt:{C}={da.coords[C].values[j]}{', cpt:clim_prob=0.33333' if C=='C' else ''},"
-                    f" cpt:nrow={da.shape[list(da.dims).index(row)]},"
-                    f" cpt:ncol={da.shape[list(da.dims).index(col)]}, cpt:row={row},"
+                    f" cpt:nrow={nrow},"
+                    f" cpt:ncol={ncol}, cpt:row={row},"
                     f" cpt:col={col}{unitsblurb}{missingblurb}\n"
                 )
-                if assertmissing:
-                    temp = da.isel({C: j}).fillna(float(da.attrs["missing"])).values
-                else:
-                    temp = da.isel({C: j}).values
-                temp = np.vectorize(str)(temp)
-                f.write(header)
-                if row == "T" or col == "T":
-                    if 'Ti' in da.coords:
-                        tcoords_temp = [
-                            format_date_range(ti, tf)
-                            for ti, tf in zip(
-                                da.coords["Ti"].values,
-                                da.coords["Tf"].values
-                            )
-                        ]
-                    else:
-                        tcoords_temp = [
-                            format_date(ti)
-                            for ti in da.coords["T"].values
-                        ]
-                    tcoords = np.asarray(tcoords_temp, dtype="object")
-                if col != "T":
-                    vals = da.coords[col].values
-                else:
-                    vals = tcoords
-                f.write(
-                    "\t"
-                    + "\t".join(format_coord_values(vals))
-                    + "\n"
-                )
-
-                # column non-dimension coordinate values
-                non_dim_coords = [c for c in da.coords if c not in da.dims]
-                for c in non_dim_coords:
-                    coord = da.coords[c]
-                    assert len(coord.dims) == 1
-                    if coord.dims == (col,):
-                        f.write(f"cpt:{c}\t")
-                        f.write("\t".join(format_coord_values(da.coords[c].values)))
-                        f.write("\n")
-
-                if row != "T":
-                    temp = np.hstack([da.coords[row].values.reshape(-1, 1), temp])
-                else:
-                    temp = np.hstack([tcoords.reshape(-1, 1), temp.astype("object")])
-                if row != "T":
-                    np.savetxt(f, temp, fmt="%#g", delimiter="\t")
-                else:
-                    np.savetxt(f, temp, fmt="%s", delimiter="\t")
+                block = block_values(da.variable, j, missing)
+                rows = format_rows(row_labels, block, dtype, fmt)
+                f.write(header + col_labels + coord_rows + rows)
         else:
-            # preprocessing
-            da = da.transpose(row, col)
-            if row == "T" or col == "T":
-                if 'Ti' in da.coords:
-                    tcoords_temp = [
-                        format_date_range(ti, tf)
-                        for ti, tf in zip(
-                            da.coords["Ti"].values,
-                            da.coords["Tf"].values
-                        )
-                    ]
-                else:
-                    tcoords_temp = [
-                        format_date(ti)
-                        for ti in da.coords["T"].values
-                    ]
-                tcoords = np.asarray(tcoords_temp, dtype="object")
-
-
-            # header
             header = (
-                f"cpt:field={da.name}, cpt:nrow={da.shape[list(da.dims).index(row)]},"
-                f" cpt:ncol={da.shape[list(da.dims).index(col)]}, cpt:row={row},"
+                f"cpt:field={da.name}, cpt:nrow={nrow},"
+                f" cpt:ncol={ncol}, cpt:row={row},"
                 f" cpt:col={col}{unitsblurb}{missingblurb}\n"
             )
-            f.write(header)
+            block = block_values(da.variable, (), missing)
+            rows = format_rows(row_labels, block, dtype, fmt)
+            f.write(header + col_labels + coord_rows + rows)
+    return opfile
 
-            # column dimension coordinate values
-            if col != "T":
-                vals = da.coords[col].values
-            else:
-                vals = tcoords
-            f.write("\t" + "\t".join(format_coord_values(vals)) + "\n")
-
-            # column non-dimension coordinate values
-            non_dim_coords = [c for c in da.coords if c not in da.dims]
-            # For station data, X and Y must come first
-            if 'X' in non_dim_coords:
-                assert 'Y' in non_dim_coords
-                non_dim_coords = ['X', 'Y'] + list(set(non_dim_coords) - set(['X', 'Y']))
-            for c in non_dim_coords:
-                coord = da.coords[c]
-                assert len(coord.dims) == 1
-                if coord.dims == (col,):
-                    f.write(f"cpt:{c}\t")
-                    f.write("\t".join(format_coord_values(da.coords[c].values)))
-                    f.write("\n")
-
-            if assertmissing:
-                temp = da.fillna(float(da.attrs["missing"])).values
-            else:
-                temp = da.values
-            
-            # row dimension coordinate values
-            if row != "T":
-                row_labels = np.array([f"{x:#g}" for x in da[row].values]).reshape(-1, 1)
-            else:
-                row_labels = np.array([str(x) for x in tcoords]).reshape(-1, 1)
 
-            # concatenate coord and data var representations
-            temp = np.hstack([row_labels, temp])
+def block_values(variable, key, missing=None):
+    '''Reads one block of variable into memory, computing it if it is a
+    dask array, and replaces NaNs with missing unless that is None.'''
+    block = np.asarray(variable[key].values)
+    if missing is not None:
+        block = np.where(np.isnan(block), missing, block)
+    return block
 
-            np.savetxt(f, temp, fmt="%s", delimiter="\t")
-    return opfile
+
+def format_rows(row_labels, block, dtype, fmt):
+    '''Formats a block of data as the rows of a CPTv10 file, each row label
+    followed by its row of values, separated by tabs.
+
+    The labels and values are copied into one buffer of the given dtype
+    (by default the common type of the labels and values), which is
+    formatted all at once by repeating the printf-style fmt for every
+    cell. This gives the same text as gluing the labels on with np.hstack
+    and writing with np.savetxt, without a Python loop.'''
+    nrow, ncol = block.shape
+    if dtype is None:
+        dtype = np.result_type(row_labels, block)
+    buffer = np.empty((nrow, ncol + 1), dtype=dtype)
+    buffer[:, 0] = row_labels
+    buffer[:, 1:] = block
+    row_fmt = "\t".join([fmt] * (ncol + 1)) + "\n"
+    return (row_fmt * nrow) % tuple(buffer.ravel().tolist())
 
 
 def format_float_value(f):
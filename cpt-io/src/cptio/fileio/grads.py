@@ -0,0 +1,181 @@
+import datetime as dt
+import numpy as np
+from pathlib import Path
+import re
+import xarray as xr
+from xarray.backends import BackendArray
+from xarray.core import indexing
+
+
+GRADS_MONTHS = [
+    "jan", "feb", "mar", "apr", "may", "jun",
+    "jul", "aug", "sep", "oct", "nov", "dec",
+]
+
+
+def read_grads_time(s):
+    '''Parses a GrADS absolute time, [hh[:mm]Z][dd]mmmyyyy, e.g. 00Z01JAN1982
+    or JUN1991.'''
+    m = re.fullmatch(
+        r"(?:(\d{1,2})(?::(\d{2}))?z)?(\d{1,2})?([a-z]{3})(\d{4})", s.lower()
+    )
+    assert m is not None, f"Can't parse GrADS time {s}"
+    hour, minute, day, month, year = m.groups()
+    return dt.datetime(
+        int(year),
+        GRADS_MONTHS.index(month) + 1,
+        int(day or 1),
+        int(hour or 0),
+        int(minute or 0),
+    )
+
+
+def grads_times(start, n, increment):
+    '''The n times of a TDEF LINEAR axis, as datetime64.'''
+    m = re.fullmatch(r"(\d+)(mn|hr|dy|mo|yr)", increment.lower())
+    assert m is not None, f"Can't parse GrADS time increment {increment}"
+    step, unit = int(m.group(1)), m.group(2)
+    start = read_grads_time(start)
+    if unit in ["mo", "yr"]:
+        months = step * (12 if unit == "yr" else 1)
+        times = []
+        for i in range(n):
+            month = start.month - 1 + i * months
+            times.append(start.replace(year=start.year + month // 12, month=month % 12 + 1))
+        return np.array(times, dtype="datetime64[ns]")
+    delta = {
+        "mn": dt.timedelta(minutes=step),
+        "hr": dt.timedelta(hours=step),
+        "dy": dt.timedelta(days=step),
+    }[unit]
+    return np.array([start + i * delta for i in range(n)], dtype="datetime64[ns]")
+
+
+class GradsBackendArray(BackendArray):
+    '''One variable of a memory-mapped GrADS binary file, copied out of
+    the map, with undef values replaced by NaN, only as it is indexed.'''
+
+    def __init__(self, values, undef):
+        self.values = values
+        self.undef = undef
+        self.shape = values.shape
+        self.dtype = values.dtype
+
+    def __getitem__(self, key):
+        return indexing.explicit_indexing_adapter(
+            key, self.shape, indexing.IndexingSupport.BASIC, self._raw_indexing_method
+        )
+
+    def _raw_indexing_method(self, key):
+        array = np.array(self.values[key])
+        if self.undef is not None:
+            array[array == self.undef] = np.nan
+        return array
+
+
+def read_grads_ctl(ctl_path):
+    '''Parses a GrADS data descriptor file into a dict with the data file
+    path, undef value, options, the coordinates of each of x, y, z and t,
+    and a list of (name, nlevels, description) for each variable.'''
+    ctl_path = Path(ctl_path)
+    tokens = []
+    with open(ctl_path, "r") as f:
+        for line in f:
+            line = line.strip()
+            if line == "" or line.startswith("*"):
+                continue
+            tokens.append(line.split())
+
+    ctl = {"options": [], "vars": [], "fileheader": 0}
+    i = 0
+    while i < len(tokens):
+        words = tokens[i]
+        key = words[0].lower()
+        if key == "dset":
+            dset = words[1]
+            if dset.startswith("^"):
+                dset = ctl_path.parent / dset[1:]
+            ctl["dset"] = Path(dset)
+        elif key == "undef":
+            ctl["undef"] = float(words[1])
+        elif key == "options":
+            ctl["options"].extend(w.lower() for w in words[1:])
+        elif key == "fileheader":
+            ctl["fileheader"] = int(words[1])
+        elif key in ["xdef", "ydef", "zdef", "tdef"]:
+            n, kind = int(words[1]), words[2].lower()
+            if key == "tdef":
+                assert kind == "linear", f"Unsupported TDEF mapping {kind}"
+                ctl["t"] = grads_times(words[3], n, words[4])
+            elif kind == "linear":
+                start, step = float(words[3]), float(words[4])
+                ctl[key[0]] = start + step * np.arange(n)
+            elif kind == "levels":
+                # the levels may continue over the following lines
+                levels = words[3:]
+                while len(levels) < n:
+                    i += 1
+                    levels.extend(tokens[i])
+                ctl[key[0]] = np.array(levels[:n], dtype=float)
+            else:
+                assert False, f"Unsupported {key.upper()} mapping {kind}"
+        elif key == "vars":
+            for j in range(int(words[1])):
+                i += 1
+                name, nlevs = tokens[i][0], int(tokens[i][1])
+                ctl["vars"].append((name, nlevs, " ".join(tokens[i][3:])))
+        i += 1
+    for option in ctl["options"]:
+        assert option in [
+            "big_endian", "little_endian", "byteswapped", "sequential", "yrev"
+        ], f"Unsupported GrADS option {option}"
+    return ctl
+
+
+def open_gradsdataset(ctl_path):
+    '''Opens a GrADS binary file, as described by its .ctl descriptor, as an
+    xarray Dataset with one data variable per GrADS variable, on (T, Z, Y,
+    X) dimensions, leaving out Z for variables with a single level.
+
+    The data are memory-mapped, and nothing is read until it is used: the
+    part of a variable that is indexed, or all of it once its values are
+    asked for, is copied out of the map then, with undef values replaced
+    with NaN.'''
+    ctl = read_grads_ctl(ctl_path)
+    options = ctl["options"]
+    byteorder = ">" if "big_endian" in options or "byteswapped" in options else "<"
+    x, y = ctl["x"], ctl["y"]
+    z = ctl.get("z", np.array([0.0]))
+    t = ctl["t"]
+    nxy = len(x) * len(y)
+    # Fortran sequential records wrap each x-y grid in two 4-byte markers.
+    pad = 1 if "sequential" in options else 0
+    nlevs = [max(nlevs, 1) for _, nlevs, _ in ctl["vars"]]
+
+    data = np.memmap(
+        ctl["dset"],
+        dtype=f"{byteorder}f4",
+        mode="r",
+        offset=ctl["fileheader"],
+        shape=(len(t), sum(nlevs), nxy + 2 * pad),
+    )
+    if "yrev" in options:
+        y = y[::-1]
+
+    data_vars = {}
+    first = 0
+    for (name, _, description), n in zip(ctl["vars"], nlevs):
+        values = data[:, first:first + n, pad:pad + nxy].reshape(len(t), n, len(y), len(x))
+        first += n
+        dims = ["T", "Z", "Y", "X"]
+        coords = {"T": t, "Y": y, "X": x}
+        if n == 1:
+            values = values[:, 0]
+            dims.remove("Z")
+        else:
+            coords["Z"] = z[:n]
+        array = GradsBackendArray(values, ctl.get("undef"))
+        data_vars[name] = xr.DataArray(
+            indexing.LazilyIndexedArray(array), dims=dims, coords=coords, attrs={"description": description}
+        )
+    return xr.Dataset(data_vars)
@@ -160,3 +160,148 @@ def test_read_cpt_date_range_wrap():
         dt.datetime(2016, 1, 15),
         dt.datetime(2016, 2, 29)
     ]
+
+def test_trailing_header_without_block(tmp_path):
+    # Ingrid writes a final header with no block after it when it crashes on
+    # the fake T grid of a subseasonal file. The reader ignores it.
+    original = (datadir / "forecast_values.txt").read_text()
+    header = original.splitlines()[1]
+    path = tmp_path / "truncated.txt"
+    path.write_text(original + header + "\n")
+    expected = open_cptdataset(datadir / "forecast_values.txt")
+    assert open_cptdataset(path).identical(expected)
+
+def test_index_cptfile(tmp_path):
+    path = tmp_path / "hindcast_probabilities.txt"
+    path.write_bytes((datadir / "hindcast_probabilities.txt").read_bytes())
+    index = cptio.index_cptfile(path)
+    assert Path(str(path) + ".idx").is_file()
+    assert cptio.index_cptfile(path) == index
+    assert len(index) == 41 * 3
+    assert [r["C"] for r in index[:4]] == ["1", "2", "3", "1"]
+    assert all(r["field"] == "prate" and r["shape"] == [33, 30] for r in index)
+
+def test_open_cptdataset_selection():
+    full = open_cptdataset(datadir / "hindcast_probabilities.txt")
+    ds = open_cptdataset(datadir / "hindcast_probabilities.txt", T=slice(-3, None), C=[0, 2])
+    assert ds.equals(full.isel(T=slice(-3, None), C=[0, 2]))
+    full = open_cptdataset(datadir / "hindcast_values.txt")
+    ds = open_cptdataset(datadir / "hindcast_values.txt", T=-1)
+    assert ds.identical(full.isel(T=-1))
+    full = open_cptdataset(datadir / "hindcast_probabilities.txt")
+    ds = open_cptdataset(datadir / "hindcast_probabilities.txt", T=[-1], C=1)
+    assert ds.equals(full.isel(T=[-1], C=1))
+
+def test_backend_entrypoint():
+    from cptio.fileio import CPTv10BackendEntrypoint
+    path = datadir / "hindcast_probabilities.txt"
+    expected = open_cptdataset(path)
+    ds = xr.open_dataset(path, engine=CPTv10BackendEntrypoint, chunks={"T": 10})
+    assert ds["prate"].chunks[1] == (10, 10, 10, 10, 1)
+    assert ds.compute().identical(expected)
+    assert ds.isel(T=-1, C=1).compute().identical(expected.isel(T=-1, C=1))
+
+def test_open_cptdataset_workers():
+    path = datadir / "hindcast_probabilities.txt"
+    assert open_cptdataset(path, workers=2).identical(open_cptdataset(path))
+
+def test_decode_date_ranges():
+    d = cptio.fileio.cpt.decode_date_ranges(['2015-12/2016-02', '2015-03', '2015-12/2016-02'])
+    assert d.dtype == np.dtype('datetime64[ns]')
+    assert d.shape == (3, 3)
+    assert (d[0] == d[2]).all()
+    assert list(d[1]) == [
+        np.datetime64(x) for x in cptio.fileio.cpt.read_cpt_date_range('2015-03')
+    ]
+
+def test_decode_labels_schema():
+    decode_labels = cptio.fileio.cpt.decode_labels
+    types = dict(cptio.fileio.cpt.COORD_TYPES)
+    assert decode_labels(np.array(['1', '2']), 'Name', types).dtype.kind == 'U'
+    assert decode_labels(np.array(['1', '2']), 'elev', types).dtype == float
+    assert 'index' not in types
+    assert decode_labels(np.array(['1', '2']), 'index', types).dtype == float
+    assert types['index'] == 'float'
+    # single days aren't date ranges, so those T labels stay strings
+    assert decode_labels(np.array(['2015-03-01', '2015-03-02']), 'T', types).dtype.kind == 'U'
+    assert types['T'] == 'str'
+
+def test_open_cptdataset_single_day_rows(tmp_path):
+    path = tmp_path / "days.txt"
+    path.write_text(
+        "xmlns:cpt=http://iri.columbia.edu/CPT/v10/\n"
+        "cpt:field=X scores, cpt:nrow=2, cpt:ncol=2, cpt:row=T, cpt:col=index\n"
+        "\t1\t2\n"
+        "2015-03-01\t1.0\t2.0\n"
+        "2015-03-02\t3.0\t4.0\n"
+    )
+    ds = open_cptdataset(path)
+    assert list(ds["T"].values) == ['2015-03-01', '2015-03-02']
+    assert "Ti" not in ds.coords and "Tf" not in ds.coords
+    assert ds["X_scores"].values.tolist() == [[1.0, 2.0], [3.0, 4.0]]
+
+def test_write_categories_without_t(tmp_path):
+    da = open_cptdataarray(datadir / "forecast_probabilities.txt").isel(T=0, drop=True)
+    da = da.drop_vars([c for c in da.coords if c not in da.dims])
+    path = to_cptv10(da, opfile=tmp_path / "probs.tsv")
+    xr.testing.assert_allclose(open_cptdataarray(path), da, rtol=1e-5)
+
+def test_cptv10_cache(tmp_path):
+    da = open_cptdataarray(datadir / "lesotho_ond.tsv")
+    cache = cptio.CPTv10Cache(tmp_path / "cache")
+    first = cache.to_cptv10(da, tmp_path / "a.tsv")
+    second = cache.to_cptv10(da.copy(deep=True), tmp_path / "b.tsv")
+    assert len(list((tmp_path / "cache").glob("*.tsv"))) == 1
+    assert Path(first).read_bytes() == Path(second).read_bytes()
+    assert Path(second).read_bytes() == Path(to_cptv10(da, tmp_path / "c.tsv")).read_bytes()
+    # rewriting a linked file must not change the cached copy
+    to_cptv10(da.copy(data=da.values + 1), opfile=first)
+    cache.to_cptv10(da, tmp_path / "d.tsv")
+    assert Path(tmp_path / "d.tsv").read_bytes() == Path(second).read_bytes()
+
+    cache.max_bytes = Path(first).stat().st_size
+    cache.to_cptv10(da.copy(data=da.values + 2), tmp_path / "e.tsv")
+    assert len(list((tmp_path / "cache").glob("*.tsv"))) == 1
+
+def test_write_dask_blocks(tmp_path):
+    path = datadir / "hindcast_probabilities.txt"
+    da = open_cptdataarray(path)
+    expected = Path(to_cptv10(da, opfile=tmp_path / "eager.tsv")).read_bytes()
+    lazy = xr.open_dataset(path, engine=cptio.fileio.CPTv10BackendEntrypoint, chunks={"T": 1})["prate"]
+    lazy.attrs = da.attrs
+    assert Path(to_cptv10(lazy, opfile=tmp_path / "lazy.tsv")).read_bytes() == expected
+    assert lazy.chunks is not None
+
+def test_open_gradsdataset(tmp_path):
+    rng = np.random.default_rng(0)
+    skill = rng.random((3, 4, 5)).astype(np.float32)
+    skill[0, 0, 0] = -999.0
+    # Fortran sequential records, big-endian, north to south
+    with open(tmp_path / "skill.dat", "wb") as f:
+        for grid in skill:
+            marker = np.array([grid.nbytes], dtype=">i4").tobytes()
+            f.write(marker + grid.astype(">f4").tobytes() + marker)
+    (tmp_path / "skill.ctl").write_text(
+        "DSET ^skill.dat\n"
+        "TITLE test\n"
+        "UNDEF -999.0\n"
+        "OPTIONS sequential big_endian yrev\n"
+        "XDEF 5 LINEAR 10.0 1.0\n"
+        "YDEF 4 LEVELS -1.5 -0.5\n"
+        "  0.5 1.5\n"
+        "ZDEF 1 LINEAR 1 1\n"
+        "TDEF 3 LINEAR 00Z01JUN1991 1yr\n"
+        "VARS 1\n"
+        "pearson 0 99 Pearson's correlation\n"
+        "ENDVARS\n"
+    )
+    ds = cptio.open_gradsdataset(tmp_path / "skill.ctl")
+    da = ds["pearson"]
+    assert da.dims == ("T", "Y", "X")
+    assert list(da["Y"].values) == [1.5, 0.5, -0.5, -1.5]
+    assert list(da["X"].values) == [10.0, 11.0, 12.0, 13.0, 14.0]
+    assert list(da["T"].values) == [np.datetime64(f"{y}-06-01") for y in [1991, 1992, 1993]]
+    # undef is masked in whatever part of the map is read
+    assert np.isnan(da.isel(T=0, Y=slice(0, 1)).values[0, 0])
+    assert np.isnan(da.values[0, 0, 0])
+    np.testing.assert_array_equal(da.values.ravel()[1:], skill.ravel()[1:])
@@ -1,3 +1,5 @@
 from .base import CPT 
+from .pool import CPTPool
+from .results import CPTResults
 from .functional import canonical_correlation_analysis, principal_components_regression, probabilistic_forecast_verification, deterministic_skill, multiple_regression
 from .bash import rmrf, ls_files_recursive, rmstar
@@ -1,10 +1,10 @@
-import collections
 from pathlib import Path
 from subprocess import Popen, PIPE
-import platform, os , io, uuid, psutil, time
+import platform, os, uuid, psutil, threading, time
 from .utilities import *
 from .bash import rmrf 
 import copy 
+from cptio import CPTv10Cache, to_cptv10, open_cptdataset, open_gradsdataset
 
 class CPTError(Exception):
     def __init__(self, message):            
@@ -65,11 +65,37 @@ default_output_files = {
 }
 
 
+# Input files written for CPT are kept here, keyed by the content of the
+# DataArray, so that e.g. the same predictand isn't serialized again for
+# every model.
+input_cache_dir = Path.home() / '.pycpt_workspace' / 'input_cache'
+input_cache_max_bytes = 2 * 2**30
+
+
+# Gridded outputs that CPT can write as GrADS binary, which is read back
+# memory-mapped instead of being parsed as text. Everything else is always
+# written as text.
+BINARY_SKILL_OUTPUTS = {
+    'pearson', 'spearman', 'two_alternative_forced_choice',
+    'roc_area_below_normal', 'roc_area_above_normal', 'root_mean_squared_error',
+}
+BINARY_OUTPUTS = BINARY_SKILL_OUTPUTS | {
+    'hindcast_values', 'hindcast_prediction_error_variance',
+    'forecast_values', 'forecast_prediction_error_variance',
+}
+
+
 class CPT:
-    def __init__(self, interactive=False,  log=None, project_file=None,  record=None, output_files=default_output_files, outputdir=None, **kwargs):
+    def __init__(self, interactive=False,  log=None, project_file=None,  record=None, output_files=default_output_files, outputdir=None, input_cache=True, output_format='ASCII', **kwargs):
         # TODO why is **kwargs here? It's not used, but removing it
         # could be a breaking change for anyone who's currently
         # passing in kwargs that are being ignored.
+
+        # commands sent to CPT, bytes read back, the number of and total
+        # time spent in calls to read, i.e. waiting for CPT's answers, and
+        # the time spent waiting for its output files, this session. Set
+        # first, since __del__ adds to it even if CPT never started.
+        self.io_stats = {'commands': 0, 'bytes_read': 0, 'reads': 0, 'read_seconds': 0.0, 'wait_seconds': 0.0}
         self.interactive = interactive
         self.last_message = 'has not started yet'
 
@@ -81,17 +107,10 @@ class CPT:
         self.cpt = str(Path(os.getenv('CPT_BIN_DIR')) / exe_name)
         assert Path(self.cpt).is_file(), 'CPT executable not found'
         
+        self.output_files = output_files
         if outputdir is None:
             self.set_outputdir = False
-            if not (Path.home() / '.pycpt_workspace').is_dir():
-                (Path.home() / '.pycpt_workspace').mkdir(exist_ok=True, parents=True)
-            
-            self.id = str(uuid.uuid4())
-            self.outputdir = Path.home() / '.pycpt_workspace' /  self.id
-            self.outputdir.mkdir(exist_ok=True, parents=True)
-            self.outputs = copy.deepcopy(output_files)
-            for key in self.outputs.keys():
-                self.outputs[key] = self.outputdir / self.outputs[key]
+            self.new_workspace()
         else:
             self.set_outputdir = True
             self.outputdir = Path(outputdir)
@@ -100,11 +119,28 @@ class CPT:
             for key in self.outputs.keys():
                 self.outputs[key] = self.outputdir / self.outputs[key]
 
+        if input_cache is True:
+            input_cache = CPTv10Cache(input_cache_dir, input_cache_max_bytes)
+        self.input_cache = input_cache if input_cache else None
+
+        assert output_format in ['ASCII', 'GRADS'], "output_format must be 'ASCII' or 'GRADS'"
+        # the format sessions ask for; a session may switch to ASCII, e.g.
+        # for station data, and CPTPool.checkin switches it back
+        self.default_output_format = output_format
+        self.output_format = output_format
+        # the format CPT is currently set to write
+        self.current_output_format = None
+
+        # set by CPTPool.checkout for sessions from a pool
+        self.pool = None
+
         self.record = str(Path(record).absolute()) if record else None 
         self.log = str(Path(log)) if log else None 
         self.project_file = str(Path(project_file)) if project_file else None 
         self.cpt_process = Popen([Path(self.cpt).absolute()], stdin=PIPE, stderr=PIPE, stdout=PIPE)
-        self.reader = io.TextIOWrapper(self.cpt_process.stdout, encoding='utf8')
+        self.stdout_fd = self.cpt_process.stdout.fileno()
+        self.secret = CPT_SECRET.encode('utf8')
+        self.pending = b''
         x = self.read()
         self.last_message = x
         if self.interactive:
@@ -112,37 +148,98 @@ class CPT:
         self.write(571)
         self.write(3)
         
+    def new_workspace(self):
+        """Puts this session's files in a new directory under
+        ~/.pycpt_workspace."""
+        if not (Path.home() / '.pycpt_workspace').is_dir():
+            (Path.home() / '.pycpt_workspace').mkdir(exist_ok=True, parents=True)
+
+        self.id = str(uuid.uuid4())
+        self.outputdir = Path.home() / '.pycpt_workspace' /  self.id
+        self.outputdir.mkdir(exist_ok=True, parents=True)
+        self.outputs = copy.deepcopy(self.output_files)
+        for key in self.outputs.keys():
+            self.outputs[key] = self.outputdir / self.outputs[key]
+
     def read(self):
-        output = io.StringIO()
-        buf = collections.deque(maxlen=len(CPT_SECRET))
+        """Reads CPT's output up to and including the next CPT_SECRET, which
+        CPT prints whenever it's waiting for input, or up to the end of the
+        output if CPT has exited. Reads whatever is available in one go,
+        rather than a character at a time, and keeps anything past the
+        sentinel for the next read."""
+        start = time.perf_counter()
+        data = self.pending
+        searched = 0
         while True:
-            char = self.reader.read(1)
-            if char == "":
+            end = data.find(self.secret, searched)
+            if end != -1:
+                end += len(self.secret)
                 break
-            output.write(char)
-            buf.append(char)
-            if ''.join(buf) == CPT_SECRET or self.cpt_process.poll() is not None:
+            searched = max(0, len(data) - len(self.secret) + 1)
+            chunk = os.read(self.stdout_fd, 65536)
+            if chunk == b"":
+                end = len(data)
                 break
-        return output.getvalue()
-
+            data += chunk
+            self.io_stats['bytes_read'] += len(chunk)
+        self.pending = data[end:]
+        self.io_stats['reads'] += 1
+        self.io_stats['read_seconds'] += time.perf_counter() - start
+        return data[:end].decode('utf8', errors='replace')
 
     def status(self ):
         return self.cpt_process.poll() is None
 
     def write(self, cpt_cmd):
-        if self.interactive: 
-            print(str(cpt_cmd))
-        cpt_cmd = str(cpt_cmd)
+        cpt_cmd = self.send(cpt_cmd)
+        self.receive(cpt_cmd)
+        return self.status()
+
+    def run_script(self, commands):
+        """Sends a whole sequence of commands to CPT up front, rather than
+        waiting for CPT to answer each one before sending the next, then
+        reads CPT's answers back in order. An ERROR: in any answer raises a
+        CPTError naming the command it answered."""
+        commands = [self.format_command(cmd) for cmd in commands]
+        failed = []
+
+        def send_all():
+            # Runs in its own thread, so that CPT never blocks writing
+            # output that nobody is reading while we block sending input.
+            try:
+                for cmd in commands:
+                    self.send(cmd)
+            except CPTError as e:
+                failed.append(e)
+
+        sender = threading.Thread(target=send_all, daemon=True)
+        sender.start()
+        try:
+            for i, cmd in enumerate(commands):
+                self.receive(cmd, position=(i, len(commands)))
+                if failed:
+                    break
+        finally:
+            sender.join()
+        if failed:
+            raise failed[0]
+        return self.status()
 
+    def format_command(self, cpt_cmd):
+        cpt_cmd = str(cpt_cmd)
         if cpt_cmd[-1] != os.linesep:
             cpt_cmd += os.linesep
+        return cpt_cmd
 
+    def send(self, cpt_cmd):
+        cpt_cmd = self.format_command(cpt_cmd)
         try:
             if self.project_file:
                 with open(self.project_file, 'a') as f: 
                     f.write(cpt_cmd)
             self.cpt_process.stdin.write(cpt_cmd.encode())
             self.cpt_process.stdin.flush() 
+            self.io_stats['commands'] += 1
         except Exception as e: 
             cptalive = self.cpt_process.poll() is None
             msg = "\nPROCESS STATUS: {}\n".format("ALIVE" if cptalive else "DEAD")
@@ -150,8 +247,12 @@ class CPT:
             msg += "  last message:'{}'\n".format(self.last_message.strip())
 
             raise CPTError(msg)
-            
-            
+        return cpt_cmd
+
+    def receive(self, cpt_cmd, position=None):
+        """Reads CPT's answer to cpt_cmd, which has already been sent."""
+        if self.interactive: 
+            print(cpt_cmd.strip())
         if self.log is not None:
             log = open(self.log, 'a')
             log.write(cpt_cmd + '\n')
@@ -159,10 +260,15 @@ class CPT:
         x = self.read()
         if 'Output Results\n  \n' in x:
             while "0. Exit" not in x:
-                x += self.read()
+                more = self.read()
+                if more == '':
+                    break
+                x += more
         if 'ERROR:' in x: 
             cptalive = self.cpt_process.poll() is None
             msg = "\nPROCESS STATUS: {}\n".format("ALIVE (WILL BE STOPPED)" if cptalive else "DEAD")
+            if position is not None:
+                msg += "  command {} of {} in script\n".format(position[0] + 1, position[1])
             msg += "  last command: '{}'\n".format(cpt_cmd.strip())
             msg += "  last message:'{}'\n".format(x.strip())
             self.kill()
@@ -175,7 +281,59 @@ class CPT:
             log.close()
         self.last_message = x
         self.last_cmd = cpt_cmd
-        return self.status()
+
+    def save_input(self, da, path):
+        """Writes da to path in CPTv10 format, reusing the file written
+        for an identical DataArray if it's still in the input cache."""
+        if self.input_cache is None:
+            return to_cptv10(da, path)
+        return self.input_cache.to_cptv10(da, path)
+
+    def binary_output(self, key):
+        return self.output_format == 'GRADS' and key in BINARY_OUTPUTS
+
+    def select_output(self, key):
+        """The commands that set CPT's output format for the output key:
+        GrADS if it's one of BINARY_OUTPUTS and output_format is 'GRADS',
+        and text otherwise. There are none if the format is already set."""
+        fmt = 'GRADS' if self.binary_output(key) else 'ASCII'
+        if fmt == self.current_output_format:
+            return []
+        self.current_output_format = fmt
+        return [131, CPT_OUTPUT_FMT_R[fmt]]
+
+    def output_commands(self, key, option):
+        """The commands that write the output key, as option option of
+        CPT's output menu (111), in the format select_output picks."""
+        return self.select_output(key) + [111, option, self.outputs[key].absolute(), 0]
+
+    def open_output(self, key, like=None):
+        """Opens the output key as a Dataset. GrADS files carry none of
+        CPT's metadata, so they're put on the X/Y grid of like, and given
+        its T coordinates, as the text outputs would have been."""
+        path = str(self.outputs[key].absolute())
+        if not self.binary_output(key):
+            return open_cptdataset(path + '.txt')
+        assert like is not None, 'GrADS outputs need a DataArray to take their coordinates from'
+        ds = open_gradsdataset(path + '.ctl')
+        ds = ds.sortby('Y', ascending=bool(like['Y'][0] <= like['Y'][-1]))
+        ds = snap_to(like, ds)
+        if key in BINARY_SKILL_OUTPUTS:
+            # the text skill maps have one map per mode, not per year
+            return ds.rename({'T': 'Mode'}).drop_vars('Mode')
+        assert len(ds['T']) == len(like['T']), f'{key} has {len(ds["T"])} steps, expected {len(like["T"])}'
+        tcoords = {k: like[k].variable for k in like.coords if like[k].dims == ('T',)}
+        return ds.drop_vars('T').assign_coords(tcoords)
+
+    def release(self):
+        """Ends this session, checking the process back in to the CPTPool
+        it came from, if any, and otherwise stopping CPT and removing its
+        workspace, as soon as its outputs have all been read."""
+        if self.pool is not None:
+            self.pool.checkin(self)
+        else:
+            self.wait_for_files(isdel=True)
+            self.clean()
 
     def execute_script(self, script):
         assert Path(script).is_file()
@@ -193,15 +351,36 @@ class CPT:
         self.kill()
 
     def wait_for_files(self, isdel=False):
+        """Waits for CPT to finish writing its output files. CPT only shows
+        its menu again once it's done with a command, so if it's alive and
+        its last answer ended at the menu, with nothing more to read, there
+        is nothing to wait for. Otherwise this watches CPT's open files,
+        backing off from 10 ms to half a second between checks."""
+        start = time.perf_counter()
         try:
+            if self.idle():
+                return
             proc = psutil.Process(pid=self.cpt_process.pid)
+            delay = 0.01
             while len(proc.open_files()) > 0: 
-                time.sleep(0.1)
+                time.sleep(delay)
+                delay = min(2 * delay, 0.5)
         except Exception as e:
             if isinstance(e, psutil.NoSuchProcess):
                 if not isdel:
                     print( "CPT ProcessID #{} does not exist - seems like CPT died early. cleaning data from {}.".format(self.cpt_process.pid, self.outputdir))
                 self.clean()
+        finally:
+            self.io_stats['wait_seconds'] += time.perf_counter() - start
+
+    def idle(self):
+        """Whether CPT is alive and waiting at a prompt for its next
+        command."""
+        return (
+            self.status()
+            and self.pending == b''
+            and self.last_message.endswith(CPT_SECRET)
+        )
 
     def __del__(self):
         self.wait_for_files(isdel=True)
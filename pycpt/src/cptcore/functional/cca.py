@@ -4,14 +4,22 @@ from ..utilities import (
     CPT_SKILL_R,
     CPT_TRANSFORMATIONS_R,
     CPT_PFV_R,
+    CPT_HINDCAST_OUTPUT,
+    CPT_PATTERN_OUTPUT,
+    requested_outputs,
     snap_to,
+    split_in_sample,
+    with_in_sample_predictor,
 )
-from ..base import CPT
-from cptio import open_cptdataset, to_cptv10, is_valid_cptv10_xyt, convert_np64_datetime
+from ..pool import start_session
+from ..results import CPTResults
+from .. import native
+from cptio import open_cptdataset, is_valid_cptv10_xyt, convert_np64_datetime
 import xarray as xr 
 import numpy as np 
 
 PFV_METRICS = ['generalized_roc', 'ignorance', 'rank_probability_skill_score']
+RESULTS = ['hindcasts', 'forecasts', 'skill', 'x_patterns', 'y_patterns']
 
 def canonical_correlation_analysis(
         X,  # Predictor Dataset in an Xarray DataArray with three coordinates, XYT
@@ -29,12 +37,16 @@ def canonical_correlation_analysis(
         drymask_threshold=None,
         skillmask_threshold=None,
         synchronous_predictors=False,
+        in_sample_forecasts=False, # also make forecasts for the years of X in the same session, returned as probabilistic hindcasts
+        outputs=None, # the results to have CPT write, e.g. {'hindcasts', 'skill'}; the rest are None. Default all
         cpt_kwargs=None, # a dict of kwargs that will be passed to CPT
+        engine='cpt', # 'cpt', or 'numpy' to run CCA in this process, without starting CPT
         **_
     ):
     if cpt_kwargs is None:
         cpt_kwargs = {}
 
+    assert engine in ['cpt', 'numpy'], "engine must be one of ['cpt', 'numpy']"
     assert validation.upper() in ['DOUBLE-CROSSVALIDATION', 'CROSSVALIDATION', 'RETROACTIVE'], "validation must be one of ['DOUBLE-CROSSVALIDATION', 'CROSSVALIDATION', 'RETROACTIVE']"
     assert isinstance(crossvalidation_window, int) and crossvalidation_window %2 == 1, "crossvalidation window must be odd integer"
     assert 0 < retroactive_initial_training_period < 100, 'retroactive_initial_training_period must be a percentage between 0 and 100'
@@ -45,356 +57,359 @@ def canonical_correlation_analysis(
     if F is not None:
         is_valid_cptv10_xyt(X)
 
+    if engine == 'numpy':
+        return native.canonical_correlation_analysis(
+            X, Y, F=F,
+            transform_predictand=transform_predictand,
+            tailoring=tailoring,
+            cca_modes=cca_modes,
+            x_eof_modes=x_eof_modes,
+            y_eof_modes=y_eof_modes,
+            crossvalidation_window=crossvalidation_window,
+            retroactive_initial_training_period=retroactive_initial_training_period,
+            retroactive_step=retroactive_step,
+            validation=validation,
+            drymask_threshold=drymask_threshold,
+            skillmask_threshold=skillmask_threshold,
+            in_sample_forecasts=in_sample_forecasts,
+            outputs=outputs,
+        )
+
+    outputs = requested_outputs(outputs, RESULTS)
+    if in_sample_forecasts:
+        # CPT makes forecasts for the years of F and, moved out of the
+        # training period, those of X, which are split apart again below
+        F_real, F = F, with_in_sample_predictor(X, F)
+
+    # in-sample forecasts are part of the hindcasts
+    make_forecasts = F is not None and ('forecasts' in outputs or (in_sample_forecasts and 'hindcasts' in outputs))
+
     retroactive_initial_training_period = int(retroactive_initial_training_period / 100 * X.shape[list(X.dims).index('T')])
     retroactive_step = int(retroactive_step / 100 * X.shape[list(X.dims).index('T')])
 
-    cpt = CPT(**cpt_kwargs)
-    cpt.write(611) # activate CCA MOS 
-
-    cpt.write(544) # missing value settings 
-    cpt.write(X.attrs['missing'])
-    cpt.write(10)
-    cpt.write(10)
-    cpt.write(1)
-    cpt.write(4 )
-    cpt.write(Y.attrs['missing'])
-    cpt.write(10)
-    cpt.write(10)
-    cpt.write(1)
-    cpt.write(4 )
-
-    if synchronous_predictors: 
-        cpt.write(545)
-    # apply tailoring 
-    tailoring = str(tailoring)
-    assert  (tailoring.upper() == 'SPI' and transform_predictand.upper()  == 'GAMMA')  or  tailoring != 'SPI', 'Standard Precipitation Index (SPI) tailoring is only available if transform_predictand=Gamma'
+    cpt = start_session(**cpt_kwargs)
+    try:
+        script = []
+        script.append(611) # activate CCA MOS 
+
+        script.append(544) # missing value settings 
+        script.append(X.attrs['missing'])
+        script.append(10)
+        script.append(10)
+        script.append(1)
+        script.append(4 )
+        script.append(Y.attrs['missing'])
+        script.append(10)
+        script.append(10)
+        script.append(1)
+        script.append(4 )
+
+        if synchronous_predictors: 
+            script.append(545)
+        # apply tailoring 
+        tailoring = str(tailoring)
+        assert  (tailoring.upper() == 'SPI' and transform_predictand.upper()  == 'GAMMA')  or  tailoring != 'SPI', 'Standard Precipitation Index (SPI) tailoring is only available if transform_predictand=Gamma'
     
-    cpt.write(533)
-    cpt.write(CPT_TAILORING_R[tailoring.upper()])
-    cpt.write(1) # climatologicial probability thresholds 
-    cpt.write(0.33) # size of AN category 
-    cpt.write(0.33) # size of BN category  
-    if drymask_threshold is not None:
-        cpt.write(5371)
-        cpt.write('Y')
-        cpt.write(drymask_threshold)
-
-    if skillmask_threshold is not None:
-        cpt.write(5372)
-        cpt.write('Y')
-        cpt.write(1)	# for Pearson
-        cpt.write(skillmask_threshold)
-
-    # set cross validation window
-    assert type(crossvalidation_window) == int and crossvalidation_window % 2 == 1 # xval window must be an odd integer 
-    cpt.write(534)
-    cpt.write(crossvalidation_window)
-
-    # apply transform_predictand 
-    if transform_predictand is not None: 
-        cpt.write(554) #set transform 
-        cpt.write(CPT_TRANSFORMATIONS_R[transform_predictand.upper()])
-        cpt.write(541) #activate transform 
+        script.append(533)
+        script.append(CPT_TAILORING_R[tailoring.upper()])
+        script.append(1) # climatologicial probability thresholds 
+        script.append(0.33) # size of AN category 
+        script.append(0.33) # size of BN category  
+        if drymask_threshold is not None:
+            script.append(5371)
+            script.append('Y')
+            script.append(drymask_threshold)
+
+        if skillmask_threshold is not None:
+            script.append(5372)
+            script.append('Y')
+            script.append(1)	# for Pearson
+            script.append(skillmask_threshold)
+
+        # set cross validation window
+        assert type(crossvalidation_window) == int and crossvalidation_window % 2 == 1 # xval window must be an odd integer 
+        script.append(534)
+        script.append(crossvalidation_window)
+
+        # apply transform_predictand 
+        if transform_predictand is not None: 
+            script.append(554) #set transform 
+            script.append(CPT_TRANSFORMATIONS_R[transform_predictand.upper()])
+            script.append(541) #activate transform 
     
-    # Load X dataset 
-    to_cptv10(X, cpt.outputs['original_predictor'])
-    cpt.write(1)
-    cpt.write(cpt.outputs['original_predictor'].absolute())
-    cpt.write( "{:#g}".format(max(X.coords['Y'].values))) # North
-    cpt.write( "{:#g}".format(min(X.coords['Y'].values))) # South
-    cpt.write( "{:#g}".format(min(X.coords['X'].values))) # West
-    cpt.write( "{:#g}".format(max(X.coords['X'].values))) # East
-    cpt.write(x_eof_modes[0])
-    cpt.write(x_eof_modes[1])
+        # Load X dataset 
+        cpt.save_input(X, cpt.outputs['original_predictor'])
+        script.append(1)
+        script.append(cpt.outputs['original_predictor'].absolute())
+        script.append( "{:#g}".format(max(X.coords['Y'].values))) # North
+        script.append( "{:#g}".format(min(X.coords['Y'].values))) # South
+        script.append( "{:#g}".format(min(X.coords['X'].values))) # West
+        script.append( "{:#g}".format(max(X.coords['X'].values))) # East
+        script.append(x_eof_modes[0])
+        script.append(x_eof_modes[1])
 
   
 
-    # load Y Dataset 
-    to_cptv10(Y, cpt.outputs['original_predictand'])
-    cpt.write(2)
-    cpt.write(cpt.outputs['original_predictand'].absolute())
-    cpt.write( "{:#g}".format(max(Y.coords['Y'].values))) # North
-    cpt.write( "{:#g}".format(min(Y.coords['Y'].values))) # South
-    cpt.write( "{:#g}".format(min(Y.coords['X'].values))) # West
-    cpt.write( "{:#g}".format(max(Y.coords['X'].values))) # East
-    cpt.write(y_eof_modes[0])
-    cpt.write(y_eof_modes[1])
-    cpt.write(cca_modes[0])
-    cpt.write(cca_modes[1])
-
-    # set up cpt missing values and goodness index 
-    cpt.write(131) # set output fmt to text for goodness index because grads doesnot makes sense
-    cpt.write(2)
-    # set sigfigs to 6
-    cpt.write(132)
-    cpt.write(6) 
-    cpt.write(531) # Kendalls Tau goodness index 
-    cpt.write(3)
-
-
-    cpt.write(112) 
-    cpt.write(cpt.outputs['goodness_index'].absolute())
-
-    val = validation.upper()
-
-    #initiate analysis 
-    if val == 'CROSSVALIDATION':
-        cpt.write(311)
-    elif val == 'DOUBLE-CROSSVALIDATION':
-        cpt.write(314)
-    elif val == 'RETROACTIVE':
-        cpt.write(312)
-        cpt.write(retroactive_initial_training_period)
-        cpt.write(retroactive_step)
-    else:
-        assert False, 'INVALID VALIDATION OPTION'
-
-    # save all deterministic skill scores 
-    for skill in ['pearson', 'spearman', 'two_alternative_forced_choice', 'roc_area_below_normal', 'roc_area_above_normal', 'root_mean_squared_error']: 
-        if val in ['CROSSVALIDATION', 'DOUBLE-CROSSVALIDATION']:
-            cpt.write(413)
+        # load Y Dataset 
+        cpt.save_input(Y, cpt.outputs['original_predictand'])
+        script.append(2)
+        script.append(cpt.outputs['original_predictand'].absolute())
+        script.append( "{:#g}".format(max(Y.coords['Y'].values))) # North
+        script.append( "{:#g}".format(min(Y.coords['Y'].values))) # South
+        script.append( "{:#g}".format(min(Y.coords['X'].values))) # West
+        script.append( "{:#g}".format(max(Y.coords['X'].values))) # East
+        script.append(y_eof_modes[0])
+        script.append(y_eof_modes[1])
+        script.append(cca_modes[0])
+        script.append(cca_modes[1])
+
+        # set up cpt missing values and goodness index 
+        # GrADS files can't describe station data, so those stay text
+        if 'station' in Y.dims:
+            cpt.output_format = 'ASCII'
+        script.extend(cpt.select_output('goodness_index')) # set output fmt to text for goodness index because grads doesnot makes sense
+        # set sigfigs to 6
+        script.append(132)
+        script.append(6) 
+        script.append(531) # Kendalls Tau goodness index 
+        script.append(3)
+
+
+        script.append(112) 
+        script.append(cpt.outputs['goodness_index'].absolute())
+
+        val = validation.upper()
+
+        #initiate analysis 
+        if val == 'CROSSVALIDATION':
+            script.append(311)
+        elif val == 'DOUBLE-CROSSVALIDATION':
+            script.append(314)
         elif val == 'RETROACTIVE':
-            cpt.write(423)
+            script.append(312)
+            script.append(retroactive_initial_training_period)
+            script.append(retroactive_step)
         else:
-            assert False
-        cpt.write(CPT_SKILL_R[skill.upper()])
-        cpt.write(cpt.outputs[skill].absolute())
-
-    # save all probabilistic skill scores, if applicable
-    if val in ['DOUBLE-CROSSVALIDATION', 'RETROACTIVE']:
-        for skill in PFV_METRICS:
-            cpt.write(437)
-            cpt.write(CPT_PFV_R[skill.upper()])
-            cpt.write(cpt.outputs[skill].absolute())
+            assert False, 'INVALID VALIDATION OPTION'
+
+        if 'skill' in outputs:
+            # save all deterministic skill scores 
+            for skill in ['pearson', 'spearman', 'two_alternative_forced_choice', 'roc_area_below_normal', 'roc_area_above_normal', 'root_mean_squared_error']: 
+                script.extend(cpt.select_output(skill))
+                if val in ['CROSSVALIDATION', 'DOUBLE-CROSSVALIDATION']:
+                    script.append(413)
+                elif val == 'RETROACTIVE':
+                    script.append(423)
+                else:
+                    assert False
+                script.append(CPT_SKILL_R[skill.upper()])
+                script.append(cpt.outputs[skill].absolute())
+
+            # save all probabilistic skill scores, if applicable
+            if val in ['DOUBLE-CROSSVALIDATION', 'RETROACTIVE']:
+                for skill in PFV_METRICS:
+                    script.extend(cpt.select_output(skill))
+                    script.append(437)
+                    script.append(CPT_PFV_R[skill.upper()])
+                    script.append(cpt.outputs[skill].absolute())
+
+        # output predictions, and probabilistic information if available
+        if 'hindcasts' in outputs:
+            for key, option in CPT_HINDCAST_OUTPUT[val].items():
+                script.extend(cpt.output_commands(key, option))
+
+        if make_forecasts: 
+            # load F dataset if present 
+            cpt.save_input(F, cpt.outputs['out_of_sample_predictor'])
+            script.append(3)
+            script.append(cpt.outputs['out_of_sample_predictor'].absolute())
+        
+            script.append(454) # deterministic forecasts 
+            for key in ['forecast_values', 'forecast_prediction_error_variance']:
+                script.extend(cpt.output_commands(key, CPT_OUTPUT_NEW[key]))
+
+            script.append(455) # probabilistic forecasts 
+            script.extend(cpt.output_commands('forecast_probabilities', CPT_OUTPUT_NEW['forecast_probabilities']))
+
+        for patterns, keys in CPT_PATTERN_OUTPUT['CCA'].items():
+            if patterns in outputs:
+                for key in keys:
+                    script.extend(cpt.output_commands(key, CPT_OUTPUT_NEW[key]))
+
+        #cpt.kill()
+        cpt.run_script(script)
         cpt.wait_for_files()
 
-    # output predictions
-    cpt.write(111)
-    if val == 'CROSSVALIDATION':
-        cpt.write(201)
-    elif val == 'DOUBLE-CROSSVALIDATION':
-        cpt.write('221')
-    elif val == 'RETROACTIVE':
-        cpt.write(211)
-    else:
-        assert False
-    cpt.write( cpt.outputs['hindcast_values'].absolute())
-    cpt.write('0') 
-
-    # output hindcast probabilistic information if available
-    if val == 'CROSSVALIDATION':
-        # not available
-        pass
-    elif val == 'DOUBLE-CROSSVALIDATION':
-        cpt.write('111')
-        cpt.write('226')
-        cpt.write( cpt.outputs['hindcast_prediction_error_variance'].absolute())
-        cpt.write('0') 
-
-        cpt.write('111')
-        cpt.write('224')
-        cpt.write( cpt.outputs['hindcast_probabilities'].absolute())
-        cpt.write('0')
-    elif val == 'RETROACTIVE':
-        cpt.write(111)
-        cpt.write(216)
-        cpt.write(cpt.outputs['hindcast_prediction_error_variance'].absolute())
-        cpt.write(0)
-
-        cpt.write('111')
-        cpt.write('214')
-        cpt.write( cpt.outputs['hindcast_probabilities'].absolute())
-        cpt.write('0')
-    else:
-        assert False
-
-    if F is not None: 
-        # load F dataset if present 
-        to_cptv10(F, cpt.outputs['out_of_sample_predictor'])
-        cpt.write(3)
-        cpt.write(cpt.outputs['out_of_sample_predictor'].absolute())
-        
-        cpt.write(454) # deterministic forecasts 
-
-        cpt.write(111)
-        cpt.write(511)
-        cpt.write(cpt.outputs['forecast_values'].absolute())
-        cpt.write(0)
-
-        cpt.write(111)
-        cpt.write(514)
-        cpt.write(cpt.outputs['forecast_prediction_error_variance'].absolute())
-        cpt.write(0)
-
-        cpt.write(455) # probabilistic forecasts 
-        cpt.write(111)
-        cpt.write(501)
-        cpt.write(cpt.outputs['forecast_probabilities'].absolute())
-        cpt.write(0)
-
-
-    for data in ['cca_x_timeseries', 'cca_y_timeseries', 'cca_canonical_correlation', 'eof_x_timeseries', 'eof_y_timeseries', 'eof_x_loadings', 'eof_y_loadings', 'cca_x_loadings', 'cca_y_loadings']:
-        cpt.write('111')
-        cpt.write(CPT_OUTPUT_NEW[data])
-        cpt.write(cpt.outputs[data].absolute())
-        cpt.write(0)
-    
-    cpt.write('111')
-    cpt.write(CPT_OUTPUT_NEW['eof_y_explained_variance'])
-    cpt.write(cpt.outputs['eof_y_explained_variance'].absolute())
-    cpt.write(0)
-
-    cpt.write('111')
-    cpt.write(CPT_OUTPUT_NEW['eof_x_explained_variance'])
-    cpt.write(cpt.outputs['eof_x_explained_variance'].absolute())
-    cpt.write(0)
-
-    #cpt.kill()
-    cpt.wait_for_files()
-    fcsts = None
-    if F is not None: 
-        prob_fcst = open_cptdataset(str(cpt.outputs['forecast_probabilities'].absolute()) + '.txt')
-        prob_fcst = getattr(prob_fcst, [i for i in prob_fcst.data_vars][0])
-        prob_fcst.name = 'probabilistic'
-
-        det_fcst = open_cptdataset(str(cpt.outputs['forecast_values'].absolute()) + '.txt')
-        det_fcst = getattr(det_fcst, [i for i in det_fcst.data_vars][0])
-        det_fcst.name = 'deterministic'
-
-        pev = open_cptdataset(str(cpt.outputs['forecast_prediction_error_variance'].absolute()) + '.txt')
-        pev = getattr(pev, [i for i in pev.data_vars][0])
-        pev.name = 'prediction_error_variance'
-        fcsts = xr.merge([det_fcst, prob_fcst, pev])
-        # CPT doesn't pass through the S coordinate, so put it back on
-        # if we have it.  (We don't have it yet in the subseasonal
-        # case. Have to get rid of the fake T grid hack first in order
-        # to fix that.)
-        if 'S' in F.coords:
-            assert len(F['S']) == len(fcsts.coords['T'])
-            fcsts = fcsts.assign_coords(S=('T', F['S'].data))
-
-    hcsts = open_cptdataset(str(cpt.outputs['hindcast_values'].absolute()) + '.txt' )
-    hcsts = getattr(hcsts, [i for i in hcsts.data_vars][0])
-    hcsts.name = 'deterministic' 
-
-    if val in ['DOUBLE-CROSSVALIDATION', 'RETROACTIVE']:
-        hcst_pr = open_cptdataset(str(cpt.outputs['hindcast_probabilities'].absolute()) + '.txt' )
-        hcst_pr = getattr(hcst_pr, [i for i in hcst_pr.data_vars][0])
-        hcst_pr.name = 'probabilistic'
-
-        hcst_pev = open_cptdataset(str(cpt.outputs['hindcast_prediction_error_variance'].absolute()) + '.txt' )
-        hcst_pev = getattr(hcst_pev, [i for i in hcst_pev.data_vars][0])
-        hcst_pev.name = 'prediction_error_variance' 
-        if 'T' in hcst_pev.coords:
-            hcst_pev = hcst_pev.drop_vars('T')
-        if 'S' in hcst_pev.coords: 
-            hcst_pev = hcst_pev.drop_vars('S')
-        if 'Ti' in hcst_pev.coords: 
-            hcst_pev = hcst_pev.drop_vars('Ti')
-        if 'Tf' in hcst_pev.coords: 
-            hcst_pev = hcst_pev.drop_vars('Tf')
-        hcst_pev = hcst_pev.assign_coords({'T': hcst_pr.coords['T']})
-
-        hcsts = xr.merge([hcsts, hcst_pr, hcst_pev])
-    else:
-        hcsts = xr.merge([hcsts])
-
-    # CPT doesn't pass through the S coordinate, so put it back on.
-    if 'S' in X.coords:
-        assert len(X['S']) == len(hcsts.coords['T']), f"Calibrated hindcast doesn't have the same number of years as the original: {X['S']}\n{hcsts['T']}"
-        hcsts = hcsts.assign_coords(S=('T', X['S'].data))
-
-    pearson = open_cptdataset(str(cpt.outputs['pearson'].absolute()) + '.txt')
-    pearson = getattr(pearson, [i for i in pearson.data_vars][0])
-    pearson.name = 'pearson'
-    spearman = open_cptdataset(str(cpt.outputs['spearman'].absolute()) + '.txt')
-    spearman = getattr(spearman, [i for i in spearman.data_vars][0])
-    spearman.name = 'spearman'
-    two_afc = open_cptdataset(str(cpt.outputs['two_alternative_forced_choice'].absolute()) + '.txt')
-    two_afc = getattr(two_afc, [i for i in two_afc.data_vars][0])
-    two_afc.name = 'two_alternative_forced_choice'
-    roc_below = open_cptdataset(str(cpt.outputs['roc_area_below_normal'].absolute()) + '.txt') 
-    roc_below = getattr(roc_below, [i for i in roc_below.data_vars][0])
-    roc_below.name = 'roc_area_below_normal'
-    roc_above = open_cptdataset(str(cpt.outputs['roc_area_above_normal'].absolute()) + '.txt')
-    roc_above = getattr(roc_above, [i for i in roc_above.data_vars][0])
-    roc_above.name = 'roc_area_above_normal'
-    rmse = open_cptdataset(str(cpt.outputs['root_mean_squared_error'].absolute()) + '.txt')
-    rmse = getattr(rmse, [i for i in rmse.data_vars][0])
-    rmse.name = 'root_mean_squared_error'
-    skill_values = [pearson, spearman, two_afc, roc_below, roc_above, rmse]
-
-    if val in ['DOUBLE-CROSSVALIDATION', 'RETROACTIVE']:
-        hcst_pr_skill = [
-            next(iter(
-                open_cptdataset(str(cpt.outputs[metric].absolute()) + '.txt').data_vars.values()
-            )).rename(metric)
-            for metric in PFV_METRICS
-        ]
-        skill_values += hcst_pr_skill
-
-    skill_values = xr.merge(skill_values).mean('Mode')
-
-
-    x_cca_scores = open_cptdataset(str(cpt.outputs['cca_x_timeseries'].absolute()) + '.txt')
-    x_cca_scores = getattr(x_cca_scores, [i for i in x_cca_scores.data_vars][0])
-    x_cca_scores.name = "x_cca_scores"
-    x_cca_scores = x_cca_scores.rename({'index':'Mode'})
-
-    y_cca_scores = open_cptdataset(str(cpt.outputs['cca_y_timeseries'].absolute()) + '.txt')
-    y_cca_scores = getattr(y_cca_scores, [i for i in y_cca_scores.data_vars][0])
-    y_cca_scores.name = "y_cca_scores"
-    y_cca_scores = y_cca_scores.rename({'index':'Mode'})
-
-    x_cca_loadings = open_cptdataset(str(cpt.outputs['cca_x_loadings'].absolute()) + '.txt')
-    x_cca_loadings = getattr(x_cca_loadings, [i for i in x_cca_loadings.data_vars][0])
-    x_cca_loadings.name = "x_cca_loadings"
-    x_cca_loadings.coords['Mode'] = x_cca_scores.coords['Mode'].values
-
-    y_cca_loadings = open_cptdataset(str(cpt.outputs['cca_y_loadings'].absolute()) + '.txt')
-    y_cca_loadings = getattr(y_cca_loadings, [i for i in y_cca_loadings.data_vars][0])
-    y_cca_loadings.name = "y_cca_loadings"
-    y_cca_loadings.coords['Mode'] = y_cca_scores.coords['Mode'].values
-
-    x_eof_scores = open_cptdataset(str(cpt.outputs['eof_x_timeseries'].absolute()) + '.txt')
-    x_eof_scores = getattr(x_eof_scores, [i for i in x_eof_scores.data_vars][0])
-    x_eof_scores.name = "x_eof_scores"
-    x_eof_scores = x_eof_scores.rename({'index':'Mode'})
-
-    y_eof_scores = open_cptdataset(str(cpt.outputs['eof_y_timeseries'].absolute()) + '.txt')
-    y_eof_scores = getattr(y_eof_scores, [i for i in y_eof_scores.data_vars][0])
-    y_eof_scores.name = "y_eof_scores"
-    y_eof_scores = y_eof_scores.rename({'index':'Mode'})
-
-    x_eof_loadings = open_cptdataset(str(cpt.outputs['eof_x_loadings'].absolute()) + '.txt')
-    x_eof_loadings = getattr(x_eof_loadings, [i for i in x_eof_loadings.data_vars][0])
-    x_eof_loadings.name = "x_eof_loadings"
-    x_eof_loadings.coords['Mode'] = x_eof_scores.coords['Mode'].values
-
-    y_eof_loadings = open_cptdataset(str(cpt.outputs['eof_y_loadings'].absolute()) + '.txt')
-    y_eof_loadings = getattr(y_eof_loadings, [i for i in y_eof_loadings.data_vars][0])
-    y_eof_loadings.name = "y_eof_loadings"
-    y_eof_loadings.coords['Mode'] = y_eof_scores.coords['Mode'].values
-    
-    x_varfile = np.genfromtxt(str(cpt.outputs['eof_x_explained_variance']) + '.txt', skip_header=3, delimiter='\t', dtype=float)
-    y_varfile = np.genfromtxt( str( cpt.outputs['eof_y_explained_variance']) +'.txt', skip_header=3, delimiter='\t', dtype=float)
-    x_explained_variance = xr.DataArray(name='x_explained_variance', data=x_varfile[:,-2].squeeze(), dims=('Mode'), coords={'Mode': x_varfile[:, 0].squeeze()})
-    y_explained_variance = xr.DataArray(name='y_explained_variance', data=y_varfile[:,-2].squeeze(), dims=('Mode'), coords={'Mode': y_varfile[:, 0].squeeze()})
-
-    x_pattern_values = [ x_cca_scores,  x_eof_scores, x_cca_loadings,  x_eof_loadings, x_explained_variance]
-    y_pattern_values = [y_cca_scores, y_eof_scores, y_cca_loadings,   y_eof_loadings, y_explained_variance ]
-
-    x_pattern_values = xr.merge(x_pattern_values)
-    x_pattern_values.coords['T'] = [convert_np64_datetime(i) for i in x_pattern_values.coords['T'].values]
-
-    y_pattern_values = xr.merge(y_pattern_values)
-    y_pattern_values.coords['T'] = [convert_np64_datetime(i) for i in y_pattern_values.coords['T'].values]
-
-    result = (
-        snap_to(Y, hcsts),
-        snap_to(Y, fcsts) if fcsts is not None else None,
-        snap_to(Y, skill_values),
-        snap_to(X, x_pattern_values),
-        snap_to(Y, y_pattern_values),
-    )
-    return result
+        def all_forecasts(r):
+            if not make_forecasts:
+                return None
+            prob_fcst = open_cptdataset(str(cpt.outputs['forecast_probabilities'].absolute()) + '.txt')
+            prob_fcst = getattr(prob_fcst, [i for i in prob_fcst.data_vars][0])
+            prob_fcst.name = 'probabilistic'
+
+            det_fcst = cpt.open_output('forecast_values', like=prob_fcst)
+            det_fcst = getattr(det_fcst, [i for i in det_fcst.data_vars][0])
+            det_fcst.name = 'deterministic'
+
+            pev = cpt.open_output('forecast_prediction_error_variance', like=prob_fcst)
+            pev = getattr(pev, [i for i in pev.data_vars][0])
+            pev.name = 'prediction_error_variance'
+            fcsts = xr.merge([det_fcst, prob_fcst, pev])
+            # CPT doesn't pass through the S coordinate, so put it back on
+            # if we have it.  (We don't have it yet in the subseasonal
+            # case. Have to get rid of the fake T grid hack first in order
+            # to fix that.)
+            if 'S' in F.coords:
+                assert len(F['S']) == len(fcsts.coords['T'])
+                fcsts = fcsts.assign_coords(S=('T', F['S'].data))
+            return fcsts
+
+        def forecasts(r):
+            fcsts = r.all_forecasts
+            if in_sample_forecasts:
+                fcsts, _ = split_in_sample(fcsts, F_real, X)
+            return snap_to(Y, fcsts) if fcsts is not None else None
+
+        def hindcasts(r):
+            hcsts = cpt.open_output('hindcast_values', like=Y)
+            hcsts = getattr(hcsts, [i for i in hcsts.data_vars][0])
+            hcsts.name = 'deterministic' 
+
+            if val in ['DOUBLE-CROSSVALIDATION', 'RETROACTIVE']:
+                hcst_pr = open_cptdataset(str(cpt.outputs['hindcast_probabilities'].absolute()) + '.txt' )
+                hcst_pr = getattr(hcst_pr, [i for i in hcst_pr.data_vars][0])
+                hcst_pr.name = 'probabilistic'
+
+                hcst_pev = cpt.open_output('hindcast_prediction_error_variance', like=Y)
+                hcst_pev = getattr(hcst_pev, [i for i in hcst_pev.data_vars][0])
+                hcst_pev.name = 'prediction_error_variance' 
+                if 'T' in hcst_pev.coords:
+                    hcst_pev = hcst_pev.drop_vars('T')
+                if 'S' in hcst_pev.coords: 
+                    hcst_pev = hcst_pev.drop_vars('S')
+                if 'Ti' in hcst_pev.coords: 
+                    hcst_pev = hcst_pev.drop_vars('Ti')
+                if 'Tf' in hcst_pev.coords: 
+                    hcst_pev = hcst_pev.drop_vars('Tf')
+                hcst_pev = hcst_pev.assign_coords({'T': hcst_pr.coords['T']})
+
+                hcsts = xr.merge([hcsts, hcst_pr, hcst_pev])
+            else:
+                hcsts = xr.merge([hcsts])
+
+            # CPT doesn't pass through the S coordinate, so put it back on.
+            if 'S' in X.coords:
+                assert len(X['S']) == len(hcsts.coords['T']), f"Calibrated hindcast doesn't have the same number of years as the original: {X['S']}\n{hcsts['T']}"
+                hcsts = hcsts.assign_coords(S=('T', X['S'].data))
+
+            if in_sample_forecasts:
+                _, in_sample = split_in_sample(r.all_forecasts, F_real, X)
+                hcsts = xr.merge([hcsts, in_sample.probabilistic, in_sample.prediction_error_variance])
+            return snap_to(Y, hcsts)
+
+        def skill(r):
+            pearson = cpt.open_output('pearson', like=Y)
+            pearson = getattr(pearson, [i for i in pearson.data_vars][0])
+            pearson.name = 'pearson'
+            spearman = cpt.open_output('spearman', like=Y)
+            spearman = getattr(spearman, [i for i in spearman.data_vars][0])
+            spearman.name = 'spearman'
+            two_afc = cpt.open_output('two_alternative_forced_choice', like=Y)
+            two_afc = getattr(two_afc, [i for i in two_afc.data_vars][0])
+            two_afc.name = 'two_alternative_forced_choice'
+            roc_below = cpt.open_output('roc_area_below_normal', like=Y) 
+            roc_below = getattr(roc_below, [i for i in roc_below.data_vars][0])
+            roc_below.name = 'roc_area_below_normal'
+            roc_above = cpt.open_output('roc_area_above_normal', like=Y)
+            roc_above = getattr(roc_above, [i for i in roc_above.data_vars][0])
+            roc_above.name = 'roc_area_above_normal'
+            rmse = cpt.open_output('root_mean_squared_error', like=Y)
+            rmse = getattr(rmse, [i for i in rmse.data_vars][0])
+            rmse.name = 'root_mean_squared_error'
+            skill_values = [pearson, spearman, two_afc, roc_below, roc_above, rmse]
+
+            if val in ['DOUBLE-CROSSVALIDATION', 'RETROACTIVE']:
+                hcst_pr_skill = [
+                    next(iter(
+                        open_cptdataset(str(cpt.outputs[metric].absolute()) + '.txt').data_vars.values()
+                    )).rename(metric)
+                    for metric in PFV_METRICS
+                ]
+                skill_values += hcst_pr_skill
+
+            skill_values = xr.merge(skill_values).mean('Mode')
+            return snap_to(Y, skill_values)
+
+        def x_patterns(r):
+            x_cca_scores = open_cptdataset(str(cpt.outputs['cca_x_timeseries'].absolute()) + '.txt')
+            x_cca_scores = getattr(x_cca_scores, [i for i in x_cca_scores.data_vars][0])
+            x_cca_scores.name = "x_cca_scores"
+            x_cca_scores = x_cca_scores.rename({'index':'Mode'})
+
+            x_cca_loadings = open_cptdataset(str(cpt.outputs['cca_x_loadings'].absolute()) + '.txt')
+            x_cca_loadings = getattr(x_cca_loadings, [i for i in x_cca_loadings.data_vars][0])
+            x_cca_loadings.name = "x_cca_loadings"
+            x_cca_loadings.coords['Mode'] = x_cca_scores.coords['Mode'].values
+
+            x_eof_scores = open_cptdataset(str(cpt.outputs['eof_x_timeseries'].absolute()) + '.txt')
+            x_eof_scores = getattr(x_eof_scores, [i for i in x_eof_scores.data_vars][0])
+            x_eof_scores.name = "x_eof_scores"
+            x_eof_scores = x_eof_scores.rename({'index':'Mode'})
+
+            x_eof_loadings = open_cptdataset(str(cpt.outputs['eof_x_loadings'].absolute()) + '.txt')
+            x_eof_loadings = getattr(x_eof_loadings, [i for i in x_eof_loadings.data_vars][0])
+            x_eof_loadings.name = "x_eof_loadings"
+            x_eof_loadings.coords['Mode'] = x_eof_scores.coords['Mode'].values
+
+            x_varfile = np.genfromtxt(str(cpt.outputs['eof_x_explained_variance']) + '.txt', skip_header=3, delimiter='\t', dtype=float)
+            x_explained_variance = xr.DataArray(name='x_explained_variance', data=x_varfile[:,-2].squeeze(), dims=('Mode'), coords={'Mode': x_varfile[:, 0].squeeze()})
+
+            x_pattern_values = [ x_cca_scores,  x_eof_scores, x_cca_loadings,  x_eof_loadings, x_explained_variance]
+            x_pattern_values = xr.merge(x_pattern_values)
+            x_pattern_values.coords['T'] = [convert_np64_datetime(i) for i in x_pattern_values.coords['T'].values]
+            return snap_to(X, x_pattern_values)
+
+        def y_patterns(r):
+            y_cca_scores = open_cptdataset(str(cpt.outputs['cca_y_timeseries'].absolute()) + '.txt')
+            y_cca_scores = getattr(y_cca_scores, [i for i in y_cca_scores.data_vars][0])
+            y_cca_scores.name = "y_cca_scores"
+            y_cca_scores = y_cca_scores.rename({'index':'Mode'})
+
+            y_cca_loadings = open_cptdataset(str(cpt.outputs['cca_y_loadings'].absolute()) + '.txt')
+            y_cca_loadings = getattr(y_cca_loadings, [i for i in y_cca_loadings.data_vars][0])
+            y_cca_loadings.name = "y_cca_loadings"
+            y_cca_loadings.coords['Mode'] = y_cca_scores.coords['Mode'].values
+
+            y_eof_scores = open_cptdataset(str(cpt.outputs['eof_y_timeseries'].absolute()) + '.txt')
+            y_eof_scores = getattr(y_eof_scores, [i for i in y_eof_scores.data_vars][0])
+            y_eof_scores.name = "y_eof_scores"
+            y_eof_scores = y_eof_scores.rename({'index':'Mode'})
+
+            y_eof_loadings = open_cptdataset(str(cpt.outputs['eof_y_loadings'].absolute()) + '.txt')
+            y_eof_loadings = getattr(y_eof_loadings, [i for i in y_eof_loadings.data_vars][0])
+            y_eof_loadings.name = "y_eof_loadings"
+            y_eof_loadings.coords['Mode'] = y_eof_scores.coords['Mode'].values
+
+            y_varfile = np.genfromtxt( str( cpt.outputs['eof_y_explained_variance']) +'.txt', skip_header=3, delimiter='\t', dtype=float)
+            y_explained_variance = xr.DataArray(name='y_explained_variance', data=y_varfile[:,-2].squeeze(), dims=('Mode'), coords={'Mode': y_varfile[:, 0].squeeze()})
+
+            y_pattern_values = [y_cca_scores, y_eof_scores, y_cca_loadings,   y_eof_loadings, y_explained_variance ]
+            y_pattern_values = xr.merge(y_pattern_values)
+            y_pattern_values.coords['T'] = [convert_np64_datetime(i) for i in y_pattern_values.coords['T'].values]
+            return snap_to(Y, y_pattern_values)
+
+        # Each output is only read from CPT's files when it's first used.
+        loaders = {
+            'hindcasts': hindcasts,
+            'forecasts': forecasts,
+            'skill': skill,
+            'x_patterns': x_patterns,
+            'y_patterns': y_patterns,
+        }
+        loaders = {name: loaders[name] for name in outputs}
+        loaders['all_forecasts'] = all_forecasts
+        return CPTResults(cpt, RESULTS, loaders)
+    except BaseException:
+        # the results never get to release the session, so give it back now
+        cpt.release()
+        raise
@@ -1,9 +1,10 @@
-from ..utilities import CPT_REGRESSIONS_R, CPT_LINKS_R, CPT_TAILORING_R,  CPT_SKILL_R, CPT_TRANSFORMATIONS_R, snap_to
-from ..base import CPT
-from cptio import open_cptdataset, to_cptv10, is_valid_cptv10_xyt
+from ..utilities import CPT_REGRESSIONS_R, CPT_LINKS_R, CPT_TAILORING_R,  CPT_SKILL_R, CPT_TRANSFORMATIONS_R, CPT_OUTPUT_NEW, CPT_HINDCAST_OUTPUT, requested_outputs, snap_to
+from ..pool import start_session
+from ..results import CPTResults
+from cptio import open_cptdataset, is_valid_cptv10_xyt
 import xarray as xr 
 
-
+RESULTS = ['hindcasts', 'forecasts', 'skill']
 
 def multiple_regression(
         X,  # Predictor Dataset in an Xarray DataArray with three coordinates, XYT
@@ -21,6 +22,7 @@ def multiple_regression(
         drymask_threshold=None,
         skillmask_threshold=None,
         synchronous_predictors=False,
+        outputs=None, # the results to have CPT write, e.g. {'hindcasts', 'skill'}; the rest are None. Default all
         **kwargs
     ):
     if cpt_kwargs is None:
@@ -36,227 +38,214 @@ def multiple_regression(
     if F is not None: 
         is_valid_cptv10_xyt(F)
 
+    outputs = requested_outputs(outputs, RESULTS)
+    make_forecasts = F is not None and 'forecasts' in outputs
+
     retroactive_initial_training_period = int(retroactive_initial_training_period / 100 * X.shape[list(X.dims).index('T')])
     retroactive_step = int(retroactive_step / 100 * X.shape[list(X.dims).index('T')])
 
 
-    cpt = CPT(**cpt_kwargs)
-    cpt.write(614) # activate GCM MOS 
-    if synchronous_predictors: 
-        cpt.write(545)
+    cpt = start_session(**cpt_kwargs)
+    try:
+        # every output is read back as text
+        cpt.output_format = 'ASCII'
+        script = []
+        script.append(614) # activate GCM MOS 
+        if synchronous_predictors: 
+            script.append(545)
     
-    cpt.write(544) # missing value settings 
-    cpt.write(X.attrs['missing'])
-    cpt.write(10)
-    cpt.write(10)
-    cpt.write(1)
-    cpt.write(4 )
-    cpt.write(Y.attrs['missing'])
-    cpt.write(10)
-    cpt.write(10)
-    cpt.write(1)
-    cpt.write(4 )
-
-
-    cpt.write(527) # GCM settings
-    cpt.write(1) # interpolate? 
-    cpt.write(3) # bias and variance corrected 
-    cpt.write(3) # bias and variance corrected 
-
-    cpt.write(535) # regression options 
-    cpt.write(CPT_REGRESSIONS_R[regression.upper()])
+        script.append(544) # missing value settings 
+        script.append(X.attrs['missing'])
+        script.append(10)
+        script.append(10)
+        script.append(1)
+        script.append(4 )
+        script.append(Y.attrs['missing'])
+        script.append(10)
+        script.append(10)
+        script.append(1)
+        script.append(4 )
+
+
+        script.append(527) # GCM settings
+        script.append(1) # interpolate? 
+        script.append(3) # bias and variance corrected 
+        script.append(3) # bias and variance corrected 
+
+        script.append(535) # regression options 
+        script.append(CPT_REGRESSIONS_R[regression.upper()])
     
-    if regression.lower() in ['poisson', 'gamma']:
-        cpt.write(CPT_LINKS_R[link.upper()])
-
-    # apply tailoring 
-    tailoring = str(tailoring)
-    assert  (tailoring.upper() == 'SPI' and transform_predictand.upper()  == 'GAMMA')  or  tailoring != 'SPI', 'Standard Precipitation Index (SPI) tailoring is only available if transform_predictand=Gamma'
-    cpt.write(533)
-    cpt.write(CPT_TAILORING_R[tailoring.upper()])
-    cpt.write(1) # climatologicial probability thresholds 
-    cpt.write(0.33) # size of AN category 
-    cpt.write(0.33) # size of BN category  
-    if drymask_threshold is not None:
-        cpt.write(5371)
-        cpt.write('Y')
-        cpt.write(drymask_threshold)
-    if skillmask_threshold is not None:
-        cpt.write(5372)
-        cpt.write('Y')
-        cpt.write(1)	# for Pearson
-        cpt.write(skillmask_threshold)
-    # set cross validation window
-    assert type(crossvalidation_window) == int and crossvalidation_window % 2 == 1 # xval window must be an odd integer 
-    cpt.write(534)
-    cpt.write(crossvalidation_window)
-
-    # apply transform_predictand 
-    if transform_predictand is not None: 
-        cpt.write(554) #set transform 
-        cpt.write(CPT_TRANSFORMATIONS_R[transform_predictand.upper()])
-        cpt.write(541) #activate transform 
+        if regression.lower() in ['poisson', 'gamma']:
+            script.append(CPT_LINKS_R[link.upper()])
+
+        # apply tailoring 
+        tailoring = str(tailoring)
+        assert  (tailoring.upper() == 'SPI' and transform_predictand.upper()  == 'GAMMA')  or  tailoring != 'SPI', 'Standard Precipitation Index (SPI) tailoring is only available if transform_predictand=Gamma'
+        script.append(533)
+        script.append(CPT_TAILORING_R[tailoring.upper()])
+        script.append(1) # climatologicial probability thresholds 
+        script.append(0.33) # size of AN category 
+        script.append(0.33) # size of BN category  
+        if drymask_threshold is not None:
+            script.append(5371)
+            script.append('Y')
+            script.append(drymask_threshold)
+        if skillmask_threshold is not None:
+            script.append(5372)
+            script.append('Y')
+            script.append(1)	# for Pearson
+            script.append(skillmask_threshold)
+        # set cross validation window
+        assert type(crossvalidation_window) == int and crossvalidation_window % 2 == 1 # xval window must be an odd integer 
+        script.append(534)
+        script.append(crossvalidation_window)
+
+        # apply transform_predictand 
+        if transform_predictand is not None: 
+            script.append(554) #set transform 
+            script.append(CPT_TRANSFORMATIONS_R[transform_predictand.upper()])
+            script.append(541) #activate transform 
     
-    # Load X dataset 
-    to_cptv10(X, cpt.outputs['original_predictor'])
-    cpt.write(1)
-    cpt.write(cpt.outputs['original_predictor'].absolute())
-    cpt.write( "{:#g}".format(max(X.coords['Y'].values))) # North
-    cpt.write( "{:#g}".format(min(X.coords['Y'].values))) # South
-    cpt.write( "{:#g}".format(min(X.coords['X'].values))) # West
-    cpt.write( "{:#g}".format(max(X.coords['X'].values))) # East
-
-    # load F dataset if present 
-    if F is not None: 
-        to_cptv10(F, cpt.outputs['out_of_sample_predictor'])
-        cpt.write(3)
-        cpt.write(cpt.outputs['out_of_sample_predictor'].absolute())
-
-    # load Y Dataset 
-    to_cptv10(Y, cpt.outputs['original_predictand'])
-    cpt.write(2)
-    cpt.write(cpt.outputs['original_predictand'].absolute())
-    cpt.write( "{:#g}".format(max(Y.coords['Y'].values))) # North
-    cpt.write( "{:#g}".format(min(Y.coords['Y'].values))) # South
-    cpt.write( "{:#g}".format(min(Y.coords['X'].values))) # West
-    cpt.write( "{:#g}".format(max(Y.coords['X'].values))) # East
-
-    # set up cpt missing values and goodness index 
-    cpt.write(131) # set output fmt to text for goodness index because grads doesnot makes sense
-    cpt.write(2)
-    # set sigfigs to 6
-    cpt.write(132)
-    cpt.write(6) 
-    cpt.write(531) # Kendalls Tau goodness index 
-    cpt.write(3)
-
-    cpt.write(112) 
-    cpt.write(cpt.outputs['goodness_index'].absolute())
-
-    #initiate analysis 
-    if validation.upper() == 'CROSSVALIDATION':
-        cpt.write(311)
-    elif validation.upper() == 'DOUBLE-CROSSVALIDATION':
-        cpt.write(314)
-    elif validation.upper() == 'RETROACTIVE':
-        cpt.write(312)
-        cpt.write(retroactive_initial_training_period)
-        cpt.write(retroactive_step)
-    else:
-        assert False, 'INVALID VALIDATION OPTION'
-
-    # save all deterministic skill scores 
-    for skill in ['pearson', 'spearman', 'two_alternative_forced_choice', 'roc_area_below_normal', 'roc_area_above_normal', 'root_mean_squared_error']: 
-        cpt.write(413)
-        cpt.write(CPT_SKILL_R[skill.upper()])
-        cpt.write(cpt.outputs[skill].absolute())
-
-    
-
-    cpt.write('111')
-    cpt.write('201')
-    cpt.write( cpt.outputs['hindcast_values'].absolute())
-    cpt.write('0') 
-
-    if validation.upper() == 'DOUBLE-CROSSVALIDATION':
-        cpt.write('111')
-        cpt.write('221')
-        cpt.write( cpt.outputs['hindcast_values'].absolute())
-        cpt.write('0') 
-
-        cpt.write('111')
-        cpt.write('226')
-        cpt.write( cpt.outputs['hindcast_prediction_error_variance'].absolute())
-        cpt.write('0') 
-
-        cpt.write('111')
-        cpt.write('224')
-        cpt.write( cpt.outputs['hindcast_probabilities'].absolute())
-        cpt.write('0') 
-
-
-    if F is not None: 
-        cpt.write(454) # deterministic forecasts 
-
-        cpt.write(111)
-        cpt.write(511)
-        cpt.write(cpt.outputs['forecast_values'].absolute())
-        cpt.write(0)
-
-        cpt.write(111)
-        cpt.write(514)
-        cpt.write(cpt.outputs['forecast_prediction_error_variance'].absolute())
-        cpt.write(0)
-
-        cpt.write(455) # probabilistic forecasts 
-        cpt.write(111)
-        cpt.write(501)
-        cpt.write(cpt.outputs['forecast_probabilities'].absolute())
-        cpt.write(0)
-    cpt.wait_for_files()
-
-    fcsts = None
-    if F is not None: 
-        prob_fcst = open_cptdataset(str(cpt.outputs['forecast_probabilities'].absolute()) + '.txt')
-        prob_fcst = getattr(prob_fcst, [i for i in prob_fcst.data_vars][0])
-        prob_fcst.name = 'probabilistic'
-
-        det_fcst = open_cptdataset(str(cpt.outputs['forecast_values'].absolute()) + '.txt')
-        det_fcst = getattr(det_fcst, [i for i in det_fcst.data_vars][0])
-        det_fcst.name = 'deterministic'
-
-        pev = open_cptdataset(str(cpt.outputs['forecast_prediction_error_variance'].absolute()) + '.txt')
-        pev = getattr(pev, [i for i in pev.data_vars][0])
-        pev.name = 'prediction_error_variance'
-        fcsts = xr.merge([det_fcst, prob_fcst, pev])
-
-    hcsts = open_cptdataset(str(cpt.outputs['hindcast_values'].absolute()) + '.txt' )
-    hcsts = getattr(hcsts, [i for i in hcsts.data_vars][0])
-    hcsts.name = 'deterministic' 
-
-    if validation.upper() == 'DOUBLE-CROSSVALIDATION':
-        hcst_pr = open_cptdataset(str(cpt.outputs['hindcast_probabilities'].absolute()) + '.txt' )
-        hcst_pr = getattr(hcst_pr, [i for i in hcst_pr.data_vars][0])
-        hcst_pr.name = 'probabilistic'
-
-        hcst_pev = open_cptdataset(str(cpt.outputs['hindcast_prediction_error_variance'].absolute()) + '.txt' )
-        hcst_pev = getattr(hcst_pev, [i for i in hcst_pev.data_vars][0])
-        hcst_pev.name = 'prediction_error_variance' 
-        if 'T' in hcst_pev.coords:
-            hcst_pev = hcst_pev.drop('T')
-        if 'S' in hcst_pev.coords: 
-            hcst_pev = hcst_pev.drop('S')
-        if 'Ti' in hcst_pev.coords: 
-            hcst_pev = hcst_pev.drop('Ti')
-        if 'Tf' in hcst_pev.coords: 
-            hcst_pev = hcst_pev.drop('Tf')
-        hcst_pev = hcst_pev.assign_coords({'T': hcst_pr.coords['T']})
-        hcsts = xr.merge([hcsts, hcst_pr, hcst_pev])
-    else:
-        hcsts = xr.merge([hcsts])
-        
-    pearson = open_cptdataset(str(cpt.outputs['pearson'].absolute()) + '.txt')
-    pearson = getattr(pearson, [i for i in pearson.data_vars][0])
-    pearson.name = 'pearson'
-    spearman = open_cptdataset(str(cpt.outputs['spearman'].absolute()) + '.txt')
-    spearman = getattr(spearman, [i for i in spearman.data_vars][0])
-    spearman.name = 'spearman'
-    two_afc = open_cptdataset(str(cpt.outputs['two_alternative_forced_choice'].absolute()) + '.txt')
-    two_afc = getattr(two_afc, [i for i in two_afc.data_vars][0])
-    two_afc.name = 'two_alternative_forced_choice'
-    roc_below = open_cptdataset(str(cpt.outputs['roc_area_below_normal'].absolute()) + '.txt') 
-    roc_below = getattr(roc_below, [i for i in roc_below.data_vars][0])
-    roc_below.name = 'roc_area_below_normal'
-    roc_above = open_cptdataset(str(cpt.outputs['roc_area_above_normal'].absolute()) + '.txt')
-    roc_above = getattr(roc_above, [i for i in roc_above.data_vars][0])
-    roc_above.name = 'roc_area_above_normal'
-    rmse = open_cptdataset(str(cpt.outputs['root_mean_squared_error'].absolute()) + '.txt')
-    rmse = getattr(rmse, [i for i in rmse.data_vars][0])
-    rmse.name = 'root_mean_squared_error'
-    skill_values = [pearson, spearman, two_afc, roc_below, roc_above, rmse]
-    skill_values = xr.merge(skill_values).mean('Mode')
-    return (
-        snap_to(Y, hcsts),
-        snap_to(Y, fcsts),
-        snap_to(Y, skill_values),
-    )
+        # Load X dataset 
+        cpt.save_input(X, cpt.outputs['original_predictor'])
+        script.append(1)
+        script.append(cpt.outputs['original_predictor'].absolute())
+        script.append( "{:#g}".format(max(X.coords['Y'].values))) # North
+        script.append( "{:#g}".format(min(X.coords['Y'].values))) # South
+        script.append( "{:#g}".format(min(X.coords['X'].values))) # West
+        script.append( "{:#g}".format(max(X.coords['X'].values))) # East
+
+        # load F dataset if present 
+        if make_forecasts: 
+            cpt.save_input(F, cpt.outputs['out_of_sample_predictor'])
+            script.append(3)
+            script.append(cpt.outputs['out_of_sample_predictor'].absolute())
+
+        # load Y Dataset 
+        cpt.save_input(Y, cpt.outputs['original_predictand'])
+        script.append(2)
+        script.append(cpt.outputs['original_predictand'].absolute())
+        script.append( "{:#g}".format(max(Y.coords['Y'].values))) # North
+        script.append( "{:#g}".format(min(Y.coords['Y'].values))) # South
+        script.append( "{:#g}".format(min(Y.coords['X'].values))) # West
+        script.append( "{:#g}".format(max(Y.coords['X'].values))) # East
+
+        # set up cpt missing values and goodness index 
+        script.extend(cpt.select_output('goodness_index')) # set output fmt to text for goodness index because grads doesnot makes sense
+        # set sigfigs to 6
+        script.append(132)
+        script.append(6) 
+        script.append(531) # Kendalls Tau goodness index 
+        script.append(3)
+
+        script.append(112) 
+        script.append(cpt.outputs['goodness_index'].absolute())
+
+        #initiate analysis 
+        if validation.upper() == 'CROSSVALIDATION':
+            script.append(311)
+        elif validation.upper() == 'DOUBLE-CROSSVALIDATION':
+            script.append(314)
+        elif validation.upper() == 'RETROACTIVE':
+            script.append(312)
+            script.append(retroactive_initial_training_period)
+            script.append(retroactive_step)
+        else:
+            assert False, 'INVALID VALIDATION OPTION'
+
+        if 'skill' in outputs:
+            # save all deterministic skill scores 
+            for skill in ['pearson', 'spearman', 'two_alternative_forced_choice', 'roc_area_below_normal', 'roc_area_above_normal', 'root_mean_squared_error']: 
+                script.append(413)
+                script.append(CPT_SKILL_R[skill.upper()])
+                script.append(cpt.outputs[skill].absolute())
+
+        if 'hindcasts' in outputs:
+            hindcast_output = CPT_HINDCAST_OUTPUT['DOUBLE-CROSSVALIDATION' if validation.upper() == 'DOUBLE-CROSSVALIDATION' else 'CROSSVALIDATION']
+            for key, option in hindcast_output.items():
+                script.extend(cpt.output_commands(key, option))
+
+        if make_forecasts: 
+            script.append(454) # deterministic forecasts 
+            for key in ['forecast_values', 'forecast_prediction_error_variance']:
+                script.extend(cpt.output_commands(key, CPT_OUTPUT_NEW[key]))
+
+            script.append(455) # probabilistic forecasts 
+            script.extend(cpt.output_commands('forecast_probabilities', CPT_OUTPUT_NEW['forecast_probabilities']))
+        cpt.run_script(script)
+        cpt.wait_for_files()
+
+        def forecasts(r):
+            prob_fcst = open_cptdataset(str(cpt.outputs['forecast_probabilities'].absolute()) + '.txt')
+            prob_fcst = getattr(prob_fcst, [i for i in prob_fcst.data_vars][0])
+            prob_fcst.name = 'probabilistic'
+
+            det_fcst = open_cptdataset(str(cpt.outputs['forecast_values'].absolute()) + '.txt')
+            det_fcst = getattr(det_fcst, [i for i in det_fcst.data_vars][0])
+            det_fcst.name = 'deterministic'
+
+            pev = open_cptdataset(str(cpt.outputs['forecast_prediction_error_variance'].absolute()) + '.txt')
+            pev = getattr(pev, [i for i in pev.data_vars][0])
+            pev.name = 'prediction_error_variance'
+            fcsts = xr.merge([det_fcst, prob_fcst, pev])
+            return snap_to(Y, fcsts)
+
+        def hindcasts(r):
+            hcsts = open_cptdataset(str(cpt.outputs['hindcast_values'].absolute()) + '.txt' )
+            hcsts = getattr(hcsts, [i for i in hcsts.data_vars][0])
+            hcsts.name = 'deterministic' 
+
+            if validation.upper() == 'DOUBLE-CROSSVALIDATION':
+                hcst_pr = open_cptdataset(str(cpt.outputs['hindcast_probabilities'].absolute()) + '.txt' )
+                hcst_pr = getattr(hcst_pr, [i for i in hcst_pr.data_vars][0])
+                hcst_pr.name = 'probabilistic'
+
+                hcst_pev = open_cptdataset(str(cpt.outputs['hindcast_prediction_error_variance'].absolute()) + '.txt' )
+                hcst_pev = getattr(hcst_pev, [i for i in hcst_pev.data_vars][0])
+                hcst_pev.name = 'prediction_error_variance' 
+                if 'T' in hcst_pev.coords:
+                    hcst_pev = hcst_pev.drop('T')
+                if 'S' in hcst_pev.coords: 
+                    hcst_pev = hcst_pev.drop('S')
+                if 'Ti' in hcst_pev.coords: 
+                    hcst_pev = hcst_pev.drop('Ti')
+                if 'Tf' in hcst_pev.coords: 
+                    hcst_pev = hcst_pev.drop('Tf')
+                hcst_pev = hcst_pev.assign_coords({'T': hcst_pr.coords['T']})
+                hcsts = xr.merge([hcsts, hcst_pr, hcst_pev])
+            else:
+                hcsts = xr.merge([hcsts])
+            return snap_to(Y, hcsts)
+
+        def skill(r):
+            pearson = open_cptdataset(str(cpt.outputs['pearson'].absolute()) + '.txt')
+            pearson = getattr(pearson, [i for i in pearson.data_vars][0])
+            pearson.name = 'pearson'
+            spearman = open_cptdataset(str(cpt.outputs['spearman'].absolute()) + '.txt')
+            spearman = getattr(spearman, [i for i in spearman.data_vars][0])
+            spearman.name = 'spearman'
+            two_afc = open_cptdataset(str(cpt.outputs['two_alternative_forced_choice'].absolute()) + '.txt')
+            two_afc = getattr(two_afc, [i for i in two_afc.data_vars][0])
+            two_afc.name = 'two_alternative_forced_choice'
+            roc_below = open_cptdataset(str(cpt.outputs['roc_area_below_normal'].absolute()) + '.txt') 
+            roc_below = getattr(roc_below, [i for i in roc_below.data_vars][0])
+            roc_below.name = 'roc_area_below_normal'
+            roc_above = open_cptdataset(str(cpt.outputs['roc_area_above_normal'].absolute()) + '.txt')
+            roc_above = getattr(roc_above, [i for i in roc_above.data_vars][0])
+            roc_above.name = 'roc_area_above_normal'
+            rmse = open_cptdataset(str(cpt.outputs['root_mean_squared_error'].absolute()) + '.txt')
+            rmse = getattr(rmse, [i for i in rmse.data_vars][0])
+            rmse.name = 'root_mean_squared_error'
+            skill_values = [pearson, spearman, two_afc, roc_below, roc_above, rmse]
+            skill_values = xr.merge(skill_values).mean('Mode')
+            return snap_to(Y, skill_values)
+
+        # Each output is only read from CPT's files when it's first used.
+        loaders = {'hindcasts': hindcasts, 'skill': skill}
+        if make_forecasts:
+            loaders['forecasts'] = forecasts
+        return CPTResults(cpt, RESULTS, {name: loaders[name] for name in outputs if name in loaders})
+    except BaseException:
+        # the results never get to release the session, so give it back now
+        cpt.release()
+        raise
@@ -0,0 +1,242 @@
+import numpy as np
+import xarray as xr
+
+from ..results import CPTResults
+from ..utilities import requested_outputs
+from .deterministic_skill import deterministic_skill, kendall_tau
+from .utilities import (
+    align_years,
+    eofs,
+    from_matrix,
+    on_points,
+    prediction_error_variance,
+    screen_missing,
+    tercile_probabilities,
+    to_matrix,
+    validation_folds,
+)
+
+RESULTS = ['hindcasts', 'forecasts', 'skill', 'x_patterns', 'y_patterns']
+
+
+class CCAModel:
+    '''CCA between the leading EOFs of (T, points) training data x and y,
+    each standardized, for any number of modes up to max_nx and max_ny.
+
+    The principal components are kept with unit norm, so the product of
+    the x and y ones is their correlation matrix, whose singular value
+    decomposition gives the canonical correlations.'''
+
+    def __init__(self, x, y, max_nx, max_ny):
+        self.n = x.shape[0]
+        self.x_mean, self.x_std, self.ux, self.sx, self.vx = eofs(x, max_nx)
+        self.y_mean, self.y_std, self.uy, self.sy, self.vy = eofs(y, max_ny)
+        self.correlations = self.ux.T @ self.uy
+        self._canonical = {}
+
+    def x_scores(self, x):
+        '''The principal components of rows x, in the units of ux.'''
+        return ((x - self.x_mean) / self.x_std) @ self.vx.T / self.sx
+
+    def canonical(self, nx, ny):
+        '''The canonical x and y weights on the first nx and ny principal
+        components, and the canonical correlations.'''
+        if (nx, ny) not in self._canonical:
+            a, r, bt = np.linalg.svd(self.correlations[:nx, :ny], full_matrices=False)
+            self._canonical[nx, ny] = a, r, bt.T
+        return self._canonical[nx, ny]
+
+    def predict(self, px, nx, ny, ncca):
+        '''Predictions of y for rows with principal components px, and the
+        rows' canonical x variates, with unit norm over the training years.'''
+        a, r, b = self.canonical(nx, ny)
+        u = px[:, :nx] @ a[:, :ncca]
+        uy = (u * r[:ncca]) @ b[:, :ncca].T
+        return (uy * self.sy[:ny]) @ self.vy[:ny] * self.y_std + self.y_mean, u
+
+
+def square_roots(a):
+    '''The square root, and its inverse, of a.T @ a for the (T, modes) a.'''
+    values, vectors = np.linalg.eigh(a.T @ a)
+    return (vectors * np.sqrt(values)) @ vectors.T, (vectors / np.sqrt(values)) @ vectors.T
+
+
+def refitted_predictions(px, py, px_new, ncca):
+    '''CCA predictions of the principal components py, from ncca modes,
+    for rows px_new, fitted to the training rows px and py alone, over
+    which the components needn't be uncorrelated or have unit norm.'''
+    px_mean, py_mean = px.mean(axis=0), py.mean(axis=0)
+    px, py = px - px_mean, py - py_mean
+    _, x_whitening = square_roots(px)
+    y_scale, y_whitening = square_roots(py)
+    a, r, bt = np.linalg.svd(x_whitening @ px.T @ py @ y_whitening, full_matrices=False)
+    u = (px_new - px_mean) @ x_whitening @ a[:, :ncca]
+    return (u * r[:ncca]) @ bt[:ncca] @ y_scale + py_mean
+
+
+def fold_eofs(scores):
+    '''The mean of the (T, modes) training scores, in the units of their
+    data, and the EOFs of those scores, as left and right singular vectors
+    and singular values, which are those of the data projected on modes.'''
+    mean = scores.mean(axis=0)
+    u, s, vt = np.linalg.svd(scores - mean, full_matrices=False)
+    return mean, u, s, vt
+
+
+def mode_combinations(x_eof_modes, y_eof_modes, cca_modes, max_nx, max_ny):
+    '''Every (nx, ny, ncca) CPT tries, with no more CCA modes than EOFs.'''
+    combinations = [
+        (nx, ny, ncca)
+        for nx in range(x_eof_modes[0], min(x_eof_modes[1], max_nx) + 1)
+        for ny in range(y_eof_modes[0], min(y_eof_modes[1], max_ny) + 1)
+        for ncca in range(cca_modes[0], min(cca_modes[1], nx, ny) + 1)
+    ]
+    assert len(combinations) > 0, 'no combination of modes is possible with this much data'
+    return combinations
+
+
+def canonical_correlation_analysis(
+        X,
+        Y,
+        F=None,
+        transform_predictand=None,
+        tailoring=None,
+        cca_modes=(1, 5),
+        x_eof_modes=(1, 5),
+        y_eof_modes=(1, 5),
+        crossvalidation_window=5,
+        retroactive_initial_training_period=45,
+        retroactive_step=10,
+        validation='crossvalidation',
+        drymask_threshold=None,
+        skillmask_threshold=None,
+        in_sample_forecasts=False,
+        outputs=None,
+        **_
+    ):
+    '''CCA as CPT does it, but in this process: the leading EOFs of X and
+    Y, each standardized, are related by CCA, with the numbers of modes
+    chosen by the goodness index (Kendall's tau averaged over Y) of
+    cross-validated or retroactive hindcasts. For those, the EOFs of X
+    from every year are kept as the predictors, while the EOFs of Y and
+    CCA are refitted for each fold within the span of Y's years, so no
+    fold costs more than the number of years squared. Forecast
+    probabilities come from the prediction error variance. Returns the
+    same results as cptcore.canonical_correlation_analysis.'''
+    assert validation.upper() in ['CROSSVALIDATION', 'RETROACTIVE'], "the numpy engine only supports validation='crossvalidation' or 'retroactive'"
+    for name, value in [
+        ('transform_predictand', transform_predictand),
+        ('tailoring', tailoring),
+        ('drymask_threshold', drymask_threshold),
+        ('skillmask_threshold', skillmask_threshold),
+    ]:
+        assert value is None, f'the numpy engine does not support {name}'
+    outputs = requested_outputs(outputs, RESULTS)
+
+    X, Y = align_years(X, Y)
+    (x, y), keep = screen_missing(to_matrix(X), to_matrix(Y))
+    X, Y = X.isel(T=keep), Y.isel(T=keep)
+    n = x.shape[0]
+    x_points = ~np.isnan(x).any(axis=0)
+    y_points = ~np.isnan(y).any(axis=0)
+    x, y = x[:, x_points], y[:, y_points]
+
+    folds = validation_folds(n, validation, crossvalidation_window, retroactive_initial_training_period, retroactive_step)
+    tested = np.concatenate([test for _, test in folds])
+    # each fold's training years must determine a coefficient per mode,
+    # and an intercept
+    min_train = min(train.sum() for train, _ in folds)
+    max_nx = min(x_eof_modes[1], min_train - 1, x.shape[1])
+    max_ny = min(y_eof_modes[1], min_train - 1, y.shape[1])
+    combinations = mode_combinations(x_eof_modes, y_eof_modes, cca_modes, max_nx, max_ny)
+
+    # every mode of Y, so that each fold's EOFs of Y can be found from them
+    model = CCAModel(x, y, max_nx, n)
+    y_folds = [fold_eofs(model.uy[train] * model.sy) for train, _ in folds]
+
+    def crossvalidated(nx, ny, ncca):
+        # the EOFs of X are the predictors, kept from the fit to every
+        # year, but those of Y, and CCA, are refitted for each fold
+        px = model.ux[:, :nx]
+        scores = []
+        for (train, test), (mean, u, s, vt) in zip(folds, y_folds):
+            uy = refitted_predictions(px[train], u[:, :ny], px[test], ncca)
+            scores.append((uy * s[:ny]) @ vt[:ny] + mean)
+        return (np.concatenate(scores) @ model.vy) * model.y_std + model.y_mean
+
+    goodness = [np.nanmean(kendall_tau(crossvalidated(*c), y[tested])) for c in combinations]
+    nx, ny, ncca = combinations[int(np.argmax(goodness))]
+
+    fitted, _ = model.predict(model.ux, nx, ny, ncca)
+    residual_variance = ((y - fitted) ** 2).sum(axis=0) / (n - ncca - 1)
+
+    def dataset(values, like, name, **leading):
+        da = from_matrix(on_points(values, y_points), like, name=name, **leading)
+        da.attrs = {k: Y.attrs[k] for k in ['units', 'missing'] if k in Y.attrs}
+        return da
+
+    def predictions(x_new, T):
+        mu, u = model.predict(model.x_scores(x_new), nx, ny, ncca)
+        pev = prediction_error_variance(residual_variance, u, n)
+        probabilities = tercile_probabilities(mu, pev, y, n)
+        return xr.merge([
+            dataset(mu, Y, 'deterministic', T=T),
+            dataset(probabilities.transpose(1, 0, 2), Y, 'probabilistic', C=['1', '2', '3'], T=T),
+            dataset(pev, Y, 'prediction_error_variance', T=T),
+        ])
+
+    def crossvalidated_hindcasts(r):
+        return dataset(crossvalidated(nx, ny, ncca), Y, 'deterministic', T=Y['T'].isel(T=tested))
+
+    def hindcasts(r):
+        hcsts = xr.merge([r.crossvalidated_hindcasts])
+        if 'S' in X.coords:
+            hcsts = hcsts.assign_coords(S=('T', X['S'].data[tested]))
+        if in_sample_forecasts:
+            in_sample = predictions(x, Y['T'])
+            in_sample = in_sample.isel(T=tested)
+            hcsts = xr.merge([hcsts, in_sample.probabilistic, in_sample.prediction_error_variance])
+        return hcsts
+
+    def forecasts(r):
+        if F is None:
+            return None
+        f = to_matrix(F)[:, x_points]
+        f = np.where(np.isnan(f), model.x_mean, f)
+        return predictions(f, F['T'])
+
+    def skill(r):
+        return deterministic_skill(r.crossvalidated_hindcasts, Y)
+
+    def patterns(like, points, u, s, v, weights, prefix):
+        eof_modes = np.arange(1, len(s) + 1)
+        cca_modes = np.arange(1, ncca + 1)
+        weights = weights[:, :ncca]
+        return xr.merge([
+            xr.DataArray(u @ weights * np.sqrt(n - 1), dims=('T', 'Mode'), coords={'T': like['T'].values, 'Mode': cca_modes}, name=f'{prefix}_cca_scores'),
+            xr.DataArray(u * s, dims=('T', 'Mode'), coords={'T': like['T'].values, 'Mode': eof_modes}, name=f'{prefix}_eof_scores'),
+            # the correlations of the canonical variates with each point
+            from_matrix(on_points(((v.T * s) @ weights).T / np.sqrt(n - 1), points), like, name=f'{prefix}_cca_loadings', Mode=cca_modes),
+            from_matrix(on_points(v, points), like, name=f'{prefix}_eof_loadings', Mode=eof_modes),
+            # standardized data have a total variance of one per point
+            xr.DataArray(100 * s ** 2 / (n - 1) / points.sum(), dims='Mode', coords={'Mode': eof_modes}, name=f'{prefix}_explained_variance'),
+        ])
+
+    def x_patterns(r):
+        a, _, _ = model.canonical(nx, ny)
+        return patterns(X, x_points, model.ux[:, :nx], model.sx[:nx], model.vx[:nx], a, 'x')
+
+    def y_patterns(r):
+        _, _, b = model.canonical(nx, ny)
+        return patterns(Y, y_points, model.uy[:, :ny], model.sy[:ny], model.vy[:ny], b, 'y')
+
+    loaders = {
+        'crossvalidated_hindcasts': crossvalidated_hindcasts,
+        'hindcasts': hindcasts,
+        'forecasts': forecasts,
+        'skill': skill,
+        'x_patterns': x_patterns,
+        'y_patterns': y_patterns,
+    }
+    shared = ['crossvalidated_hindcasts']
+    return CPTResults(None, RESULTS, {name: loaders[name] for name in [*outputs, *shared]})
@@ -0,0 +1,80 @@
+import numpy as np
+from scipy.stats import rankdata
+import xarray as xr
+
+from .utilities import BLOCK_SIZE, align_years, from_matrix, screen_missing, tercile_categories, to_matrix
+
+METRICS = ['pearson', 'spearman', 'two_alternative_forced_choice', 'roc_area_below_normal', 'roc_area_above_normal', 'root_mean_squared_error']
+
+
+def correlation(x, y):
+    '''Pearson's correlation of each column of x with the same column of y.'''
+    xa = x - x.mean(axis=0)
+    ya = y - y.mean(axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (xa * ya).sum(axis=0) / np.sqrt((xa ** 2).sum(axis=0) * (ya ** 2).sum(axis=0))
+
+
+def two_afc(x, y):
+    '''The 2AFC score, as a percentage, of continuous forecasts x of
+    continuous observations y: the proportion of pairs of years with
+    different observations in which the forecasts pick out the larger
+    one, counting tied forecasts as a coin toss.'''
+    result = np.empty(x.shape[1])
+    for start in range(0, x.shape[1], BLOCK_SIZE):
+        block = slice(start, start + BLOCK_SIZE)
+        dx = np.sign(x[:, None, block] - x[None, :, block])
+        dy = np.sign(y[:, None, block] - y[None, :, block])
+        pairs = (dy != 0).sum(axis=(0, 1))
+        hits = ((dx * dy) > 0).sum(axis=(0, 1)) + 0.5 * ((dx == 0) & (dy != 0)).sum(axis=(0, 1))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            result[block] = 100 * hits / pairs
+    return result
+
+
+def kendall_tau(x, y):
+    '''Kendall's tau (tau-b) of each column of x with the same column of y.'''
+    result = np.empty(x.shape[1])
+    for start in range(0, x.shape[1], BLOCK_SIZE):
+        block = slice(start, start + BLOCK_SIZE)
+        dx = np.sign(x[:, None, block] - x[None, :, block])
+        dy = np.sign(y[:, None, block] - y[None, :, block])
+        with np.errstate(invalid='ignore', divide='ignore'):
+            result[block] = (dx * dy).sum(axis=(0, 1)) / np.sqrt((dx ** 2).sum(axis=(0, 1)) * (dy ** 2).sum(axis=(0, 1)))
+    return result
+
+
+def roc_area(ranks, events):
+    '''The area under the ROC curve of forecasts with the given ranks
+    (ties averaged) for the given events, i.e. the probability that the
+    forecast for a year with an event ranks above that for one without.'''
+    n_events = events.sum(axis=0)
+    n_others = events.shape[0] - n_events
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return ((ranks * events).sum(axis=0) - n_events * (n_events + 1) / 2) / (n_events * n_others)
+
+
+def deterministic_skill(X, Y, **_):
+    '''The skill of deterministic forecasts X of Y, without correction, as
+    CPT's GCM validation computes it, vectorized over every point at once.
+    X must be on Y's grid, or at its stations. Only the years they share
+    are used.'''
+    X, Y = align_years(X, Y)
+    (x, y), _ = screen_missing(to_matrix(X), to_matrix(Y))
+    assert x.shape == y.shape, f'X and Y must have the same points, not {x.shape[1]} and {y.shape[1]}'
+
+    x_ranks = rankdata(x, axis=0)
+    categories = tercile_categories(y)
+    values = {
+        'pearson': correlation(x, y),
+        'spearman': correlation(x_ranks, rankdata(y, axis=0)),
+        'two_alternative_forced_choice': two_afc(x, y),
+        'roc_area_below_normal': roc_area(x.shape[0] + 1 - x_ranks, categories == 0),
+        'roc_area_above_normal': roc_area(x_ranks, categories == 2),
+        'root_mean_squared_error': np.sqrt(((x - y) ** 2).mean(axis=0)),
+    }
+    # points that were left out, in either X or Y, have no skill
+    left_out = np.isnan(x).any(axis=0) | np.isnan(y).any(axis=0)
+    for v in values.values():
+        v[left_out] = np.nan
+    return xr.merge([from_matrix(values[m], Y, name=m) for m in METRICS])
@@ -0,0 +1,169 @@
+import numpy as np
+import xarray as xr
+
+from ..results import CPTResults
+from ..utilities import requested_outputs
+from .deterministic_skill import deterministic_skill, kendall_tau
+from .utilities import (
+    align_years,
+    eofs,
+    from_matrix,
+    leave_out_predictions,
+    on_points,
+    prediction_error_variance,
+    screen_missing,
+    tercile_probabilities,
+    to_matrix,
+    validation_folds,
+)
+
+RESULTS = ['hindcasts', 'forecasts', 'skill', 'x_patterns']
+
+
+class PCRModel:
+    '''Regressions of every point of (T, points) training data y on the
+    leading principal components of x, standardized, for any number of
+    modes up to max_nx.
+
+    The principal components are uncorrelated, so one least-squares solve
+    for all max_nx of them, and all points, gives the coefficients for
+    fewer modes too: they're the leading ones.'''
+
+    def __init__(self, x, y, max_nx):
+        self.n = x.shape[0]
+        self.x_mean, self.x_std, self.ux, self.sx, self.vx = eofs(x, max_nx)
+        design = np.column_stack([np.ones(self.n), self.ux])
+        self.coefficients, *_ = np.linalg.lstsq(design, y, rcond=None)
+
+    def x_scores(self, x):
+        '''The principal components of rows x, in the units of ux.'''
+        return ((x - self.x_mean) / self.x_std) @ self.vx.T / self.sx
+
+    def predict(self, px, nx):
+        '''Predictions of y for rows with principal components px.'''
+        return self.coefficients[0] + px[:, :nx] @ self.coefficients[1:nx + 1]
+
+
+def principal_components_regression(
+        X,
+        Y,
+        F=None,
+        crossvalidation_window=5,
+        retroactive_initial_training_period=45,
+        retroactive_step=10,
+        transform_predictand=None,
+        tailoring=None,
+        x_eof_modes=(1, 5),
+        validation='crossvalidation',
+        in_sample_forecasts=False,
+        outputs=None,
+        drymask_threshold=None,
+        skillmask_threshold=None,
+        **_
+    ):
+    '''PCR as CPT does it, but in this process: every point of Y is
+    regressed on the leading EOFs of X, standardized, with the number of
+    modes chosen by the goodness index (Kendall's tau averaged over Y) of
+    cross-validated or retroactive hindcasts. Those are regressions on the
+    EOFs of every year of X, computed in closed form rather than refitted
+    for each fold. Forecast probabilities come from the prediction error
+    variance. Returns the same results as
+    cptcore.principal_components_regression, so the hindcasts are only
+    deterministic, for crossvalidation and retroactive validation alike,
+    unless in_sample_forecasts adds probabilities and prediction error
+    variances from the fit to every year.'''
+    assert validation.upper() in ['CROSSVALIDATION', 'RETROACTIVE'], "the numpy engine only supports validation='crossvalidation' or 'retroactive'"
+    for name, value in [
+        ('transform_predictand', transform_predictand),
+        ('tailoring', tailoring),
+        ('drymask_threshold', drymask_threshold),
+        ('skillmask_threshold', skillmask_threshold),
+    ]:
+        assert value is None, f'the numpy engine does not support {name}'
+    outputs = requested_outputs(outputs, RESULTS)
+
+    X, Y = align_years(X, Y)
+    (x, y), keep = screen_missing(to_matrix(X), to_matrix(Y))
+    X, Y = X.isel(T=keep), Y.isel(T=keep)
+    n = x.shape[0]
+    x_points = ~np.isnan(x).any(axis=0)
+    y_points = ~np.isnan(y).any(axis=0)
+    x, y = x[:, x_points], y[:, y_points]
+
+    folds = validation_folds(n, validation, crossvalidation_window, retroactive_initial_training_period, retroactive_step)
+    tested = np.concatenate([test for _, test in folds])
+    # each fold's training years must determine a coefficient per mode,
+    # and an intercept
+    min_train = min(train.sum() for train, _ in folds)
+    max_nx = min(x_eof_modes[1], min_train - 1, x.shape[1])
+    assert x_eof_modes[0] <= max_nx, 'no number of modes is possible with this much data'
+
+    model = PCRModel(x, y, max_nx)
+    design = np.column_stack([np.ones(n), model.ux])
+
+    def crossvalidated(nx):
+        return leave_out_predictions(design[:, :nx + 1], y, folds)[tested]
+
+    modes = range(x_eof_modes[0], max_nx + 1)
+    goodness = [np.nanmean(kendall_tau(crossvalidated(nx), y[tested])) for nx in modes]
+    nx = modes[int(np.argmax(goodness))]
+
+    residual_variance = ((y - model.predict(model.ux, nx)) ** 2).sum(axis=0) / (n - nx - 1)
+
+    def dataset(values, name, **leading):
+        da = from_matrix(on_points(values, y_points), Y, name=name, **leading)
+        da.attrs = {k: Y.attrs[k] for k in ['units', 'missing'] if k in Y.attrs}
+        return da
+
+    def predictions(x_new, T):
+        px = model.x_scores(x_new)
+        mu = model.predict(px, nx)
+        pev = prediction_error_variance(residual_variance, px[:, :nx], n)
+        probabilities = tercile_probabilities(mu, pev, y, n)
+        return xr.merge([
+            dataset(mu, 'deterministic', T=T),
+            dataset(probabilities.transpose(1, 0, 2), 'probabilistic', C=['1', '2', '3'], T=T),
+            dataset(pev, 'prediction_error_variance', T=T),
+        ])
+
+    def crossvalidated_hindcasts(r):
+        return dataset(crossvalidated(nx), 'deterministic', T=Y['T'].isel(T=tested))
+
+    def hindcasts(r):
+        hcsts = xr.merge([r.crossvalidated_hindcasts])
+        if 'S' in X.coords:
+            hcsts = hcsts.assign_coords(S=('T', X['S'].data[tested]))
+        if in_sample_forecasts:
+            in_sample = predictions(x, Y['T'])
+            in_sample = in_sample.isel(T=tested)
+            hcsts = xr.merge([hcsts, in_sample.probabilistic, in_sample.prediction_error_variance])
+        return hcsts
+
+    def forecasts(r):
+        if F is None:
+            return None
+        f = to_matrix(F)[:, x_points]
+        f = np.where(np.isnan(f), model.x_mean, f)
+        return predictions(f, F['T'])
+
+    def skill(r):
+        return deterministic_skill(r.crossvalidated_hindcasts, Y)
+
+    def x_patterns(r):
+        modes = np.arange(1, nx + 1)
+        return xr.merge([
+            xr.DataArray(model.ux[:, :nx] * model.sx[:nx], dims=('T', 'Mode'), coords={'T': X['T'].values, 'Mode': modes}, name='x_eof_scores'),
+            from_matrix(on_points(model.vx[:nx], x_points), X, name='x_eof_loadings', Mode=modes),
+            # standardized data have a total variance of one per point
+            xr.DataArray(100 * model.sx[:nx] ** 2 / (n - 1) / x_points.sum(), dims='Mode', coords={'Mode': modes}, name='x_explained_variance'),
+        ])
+
+    loaders = {
+        'crossvalidated_hindcasts': crossvalidated_hindcasts,
+        'hindcasts': hindcasts,
+        'forecasts': forecasts,
+        'skill': skill,
+        'x_patterns': x_patterns,
+    }
+    shared = ['crossvalidated_hindcasts']
+    return CPTResults(None, RESULTS, {name: loaders[name] for name in [*outputs, *shared]})
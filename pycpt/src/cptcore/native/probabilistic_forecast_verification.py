@@ -0,0 +1,82 @@
+import numpy as np
+import xarray as xr
+
+from .utilities import BLOCK_SIZE, align_years, from_matrix, screen_missing, tercile_categories, to_matrix
+
+METRICS = ['generalized_roc', 'ignorance', 'rank_probability_skill_score']
+
+
+def rank_probability_skill_score(p, categories):
+    '''The RPSS, as a percentage, of (T, C, points) probabilities p for
+    the observed categories, against climatological forecasts.'''
+    ncat = p.shape[1]
+    observed = categories[:, None, :] == np.arange(ncat)[None, :, None]
+    cumulative_error = np.cumsum(p - observed, axis=1)[:, :-1]
+    climatology = np.arange(1, ncat)[None, :, None] / ncat
+    climatological_error = climatology - np.cumsum(observed, axis=1)[:, :-1]
+    rps = (cumulative_error ** 2).sum(axis=(0, 1))
+    rps_climatology = (climatological_error ** 2).sum(axis=(0, 1))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return 100 * (1 - rps / rps_climatology)
+
+
+def ignorance(p, categories):
+    '''The mean ignorance, in bits, of (T, C, points) probabilities p for
+    the observed categories.'''
+    observed = np.take_along_axis(p, categories[:, None, :], axis=1)[:, 0]
+    with np.errstate(divide='ignore'):
+        return -np.log2(observed).mean(axis=0)
+
+
+def generalized_roc(p, categories):
+    '''The generalized ROC score (Mason and Weigel, 2009), as a
+    percentage, of (T, C, points) probabilities p: the proportion of pairs
+    of years in different observed categories for which the forecasts
+    correctly say which observation was in the higher category, counting
+    forecasts that can't tell as a coin toss.'''
+    # probability of a category below each category
+    below = np.cumsum(p, axis=1) - p
+    result = np.empty(p.shape[2])
+    for start in range(0, p.shape[2], BLOCK_SIZE):
+        block = slice(start, start + BLOCK_SIZE)
+        pb, belowb, cb = p[..., block], below[..., block], categories[:, block]
+        # for year i observed in a higher category than year j, the
+        # probability, according to the forecasts, that the outcome for i
+        # is higher, given that the two outcomes are different
+        higher = np.einsum('icn,jcn->ijn', pb, belowb)
+        same = np.einsum('icn,jcn->ijn', pb, pb)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            f = higher / (1 - same)
+        pairs = cb[:, None, :] > cb[None, :, :]
+        tied = np.isclose(f, 0.5)
+        hits = ((f > 0.5) & ~tied & pairs).sum(axis=(0, 1)) + 0.5 * (tied & pairs).sum(axis=(0, 1))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            result[block] = 100 * hits / pairs.sum(axis=(0, 1))
+    return result
+
+
+def probabilistic_forecast_verification(X, Y, **_):
+    '''The skill of tercile probability forecasts X (on C, T and space
+    dims, in percent or as fractions) of Y, as CPT's probabilistic forecast
+    verification computes it, vectorized over every point at once. Y is
+    categorized by the terciles of its observations at each point. X must
+    be on Y's grid, or at its stations. Only the years they share are
+    used.'''
+    assert X.sizes['C'] == 3, 'probabilistic forecasts must be for three categories'
+    X, Y = align_years(X, Y)
+    (p, y), _ = screen_missing(to_matrix(X, dims=('T', 'C')), to_matrix(Y))
+    assert p.shape[2] == y.shape[1], f'X and Y must have the same points, not {p.shape[2]} and {y.shape[1]}'
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        p = p / p.sum(axis=1, keepdims=True)
+    categories = tercile_categories(y)
+    values = {
+        'generalized_roc': generalized_roc(p, categories),
+        'ignorance': ignorance(p, categories),
+        'rank_probability_skill_score': rank_probability_skill_score(p, categories),
+    }
+    # points that were left out, in either X or Y, have no skill
+    left_out = np.isnan(p).any(axis=(0, 1)) | np.isnan(y).any(axis=0)
+    for v in values.values():
+        v[left_out] = np.nan
+    return xr.merge([from_matrix(values[m], Y, name=m) for m in METRICS])
@@ -0,0 +1,177 @@
+import numpy as np
+from scipy.stats import t
+import warnings
+import xarray as xr
+
+# CPT's maximum percentage of missing values at a point, and of missing
+# points in a year, as set with 544 by the cptcore functions.
+MAX_PERCENT_MISSING = 10
+
+# Pairwise comparisons are made this many points at a time, which bounds
+# the (T, T, points) arrays they need.
+BLOCK_SIZE = 2048
+
+
+def align_years(X, Y):
+    '''X and Y cut down to the years they share, as CPT does.'''
+    X, Y = xr.align(X, Y, join='inner', exclude=[d for d in set(X.dims) | set(Y.dims) if d != 'T'])
+    assert X.sizes['T'] > 0, 'X and Y have no years in common'
+    return X, Y
+
+
+def to_matrix(da, dims=('T',)):
+    '''The values of da as a (*dims, points) array of floats, with the
+    values equal to da.attrs['missing'], if it has one, replaced by NaN.'''
+    space = [d for d in da.dims if d not in dims]
+    values = da.transpose(*dims, *space).values.astype(float)
+    values = values.reshape(*values.shape[:len(dims)], -1)
+    if da.attrs.get('missing') is not None:
+        values[values == float(da.attrs['missing'])] = np.nan
+    return values
+
+
+def from_matrix(values, like, name=None, **leading):
+    '''A DataArray of the (*leading, points) values, on the dims and
+    coords of like other than T and C, after the leading dims, whose
+    coords are given as keyword arguments. A leading coord that's a
+    DataArray brings all its coords along that dim, e.g. T=Y['T'] brings
+    Ti, Tf and S.'''
+    space = [d for d in like.dims if d not in ('T', 'C')]
+    coords = {k: v for k, v in like.coords.items() if not set(v.dims) & {'T', 'C'}}
+    for dim, c in leading.items():
+        if isinstance(c, xr.DataArray):
+            coords.update({k: v for k, v in c.coords.items() if v.dims == (dim,)})
+        else:
+            coords[dim] = c
+    shape = [len(c) for c in leading.values()] + [like.sizes[d] for d in space]
+    return xr.DataArray(values.reshape(shape), dims=[*leading, *space], coords=coords, name=name)
+
+
+def screen_missing(*arrays, max_percent=MAX_PERCENT_MISSING):
+    '''Treats the missing values in (T, ..., points) arrays the way CPT
+    does. Points missing more than max_percent of their years are left
+    out, i.e. set all NaN, then years missing more than max_percent of the
+    points that are left, in any of the arrays, are dropped from all of
+    them. Values still missing are replaced by their point's mean. A year
+    is missing at a point if any of its values there, e.g. the
+    probability of any category, are missing.
+
+    Returns the screened arrays, and which years were kept.'''
+    arrays = [a.copy() for a in arrays]
+    keep = np.ones(arrays[0].shape[0], dtype=bool)
+    for a in arrays:
+        missing = np.isnan(a).reshape(a.shape[0], -1, a.shape[-1]).any(axis=1)
+        bad_points = missing.mean(axis=0) * 100 > max_percent
+        a[..., bad_points] = np.nan
+        good = ~bad_points
+        if good.any():
+            keep &= missing[:, good].mean(axis=1) * 100 <= max_percent
+    arrays = [a[keep] for a in arrays]
+    for a in arrays:
+        with warnings.catch_warnings():
+            # points left out are all NaN, and so have no mean
+            warnings.simplefilter('ignore', RuntimeWarning)
+            means = np.nanmean(a, axis=0)
+        missing = np.isnan(a)
+        a[missing] = np.broadcast_to(means, a.shape)[missing]
+    return arrays, keep
+
+
+def tercile_categories(y):
+    '''The category of each of the (T, points) observations y: 0 below
+    normal, 1 normal and 2 above normal, with the normal category bounded
+    by the terciles of each point's observations.'''
+    lower, upper = np.quantile(y, [1 / 3, 2 / 3], axis=0)
+    return (y >= lower).astype(int) + (y > upper)
+
+
+def tercile_probabilities(mu, pev, y, dof):
+    '''The probabilities, in percent, of each tercile category of the
+    (T, points) training observations y, as a (T', C, points) array, for
+    forecasts mu with prediction error variances pev. Errors are taken to
+    have a t distribution with dof degrees of freedom and variance pev, as
+    for flexible forecasts.'''
+    lower, upper = np.quantile(y, [1 / 3, 2 / 3], axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        scale = np.sqrt((dof - 2) / dof * pev)
+        below = t.cdf((lower - mu) / scale, dof)
+        above = t.sf((upper - mu) / scale, dof)
+    return 100 * np.stack([below, 1 - below - above, above], axis=1)
+
+
+def crossvalidation_folds(n, window):
+    '''For each of n years, which years to train on when it's predicted:
+    all but the window years centred on it, fewer at either end.'''
+    half = window // 2
+    for i in range(n):
+        train = np.ones(n, dtype=bool)
+        train[max(0, i - half):i + half + 1] = False
+        yield train, np.array([i])
+
+
+def retroactive_folds(n, initial, step):
+    '''Which years to train on, and which to predict, for retroactive
+    validation of n years: the first initial years predict the next step,
+    and so on, with step more years to train on each time.'''
+    for start in range(initial, n, step):
+        yield np.arange(n) < start, np.arange(start, min(start + step, n))
+
+
+def validation_folds(n, validation, crossvalidation_window, retroactive_initial_training_period, retroactive_step):
+    '''The (train, test) folds of n years for validation, with the
+    retroactive periods as percentages of n, as CPT takes them.'''
+    if validation.upper() == 'RETROACTIVE':
+        initial = int(retroactive_initial_training_period / 100 * n)
+        step = max(1, int(retroactive_step / 100 * n))
+        return list(retroactive_folds(n, initial, step))
+    return list(crossvalidation_folds(n, crossvalidation_window))
+
+
+def leave_out_predictions(design, y, folds):
+    '''Least-squares predictions of the (T, points) y from the (T, p)
+    design, for the test years of each (train, test) fold, fitted to its
+    train years alone, and missing for years no fold tests.
+
+    Nothing is refitted: for the held-out years S of a fold, the residuals
+    of that fit are (I - H_SS)^-1 e_S, where e and H are the residuals and
+    hat matrix of the fit to every year, so each fold costs one solve the
+    size of S, whatever the number of points.'''
+    q, _ = np.linalg.qr(design)
+    residuals = y - q @ (q.T @ y)
+    predictions = np.full(y.shape, np.nan)
+    for train, test in folds:
+        held_out = np.flatnonzero(~train)
+        hat = q[held_out] @ q[held_out].T
+        e = np.linalg.solve(np.eye(len(held_out)) - hat, residuals[held_out])
+        predictions[test] = y[test] - e[np.searchsorted(held_out, test)]
+    return predictions
+
+
+def eofs(a, nmodes):
+    '''The means and standard deviations of the (T, points) a, and the
+    first nmodes left and right singular vectors, and singular values, of
+    a standardized.'''
+    mean = a.mean(axis=0)
+    std = a.std(axis=0, ddof=1)
+    # constant points have no anomalies to explain
+    std[std == 0] = 1
+    u, s, vt = np.linalg.svd((a - mean) / std, full_matrices=False)
+    return mean, std, u[:, :nmodes], s[:nmodes], vt[:nmodes]
+
+
+def on_points(values, points):
+    '''values, whose last axis is over the points where the boolean mask
+    points is true, spread out over all of them, missing elsewhere.'''
+    result = np.full(values.shape[:-1] + points.shape, np.nan)
+    result[..., points] = values
+    return result
+
+
+def prediction_error_variance(residual_variance, u, n):
+    '''The prediction error variances of predictions by a regression
+    fitted to n years, with residual_variance at each point, for rows with
+    the given values of its predictors, which are uncorrelated, with zero
+    mean and unit norm over the training years, so that the sum of their
+    squares is each row's leverage.'''
+    leverage = 1 / n + (u ** 2).sum(axis=1)
+    return residual_variance * (1 + leverage[:, None])
@@ -0,0 +1,112 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+import threading
+
+from .base import CPT
+from .bash import rmrf
+
+
+def start_session(pool=None, **cpt_kwargs):
+    '''A CPT session for one of the cptcore functions: checked out of pool
+    if there is one, and a new CPT otherwise. A pool's processes were all
+    started with the pool's own kwargs, so none can be given with it.'''
+    if pool is None:
+        return CPT(**cpt_kwargs)
+    assert not cpt_kwargs, f'cpt_kwargs {sorted(cpt_kwargs)} can\'t be used with a pool; pass them to CPTPool instead'
+    return pool.checkout()
+
+
+class CPTPool:
+    '''Keeps size CPT processes started, with their workspaces created, so
+    that a session can check one out instead of waiting for CPT to start,
+    and starts a replacement in the background whenever one is checked
+    out. Pass it to the cptcore functions as cpt_kwargs={'pool': pool}.
+
+    A process goes back into the pool when its session checks it in, if
+    it's still alive and waiting at CPT's menu, until it has been used
+    max_uses times, after which it's stopped and replaced. CPT can't be
+    reset to its default settings, and options like 541 (transform the
+    predictand) and 545 (synchronous predictors) toggle rather than set,
+    so only raise max_uses when every session sets the same options.
+
+    Any other keyword arguments are passed to CPT for every process.'''
+
+    def __init__(self, size=2, max_uses=1, **cpt_kwargs):
+        assert size > 0, 'size must be positive'
+        assert max_uses > 0, 'max_uses must be positive'
+        self.size = size
+        self.max_uses = max_uses
+        self.cpt_kwargs = cpt_kwargs
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=size)
+        self.idle = [self.executor.submit(self.start) for _ in range(size)]
+        self.closed = False
+
+    def start(self):
+        cpt = CPT(**self.cpt_kwargs)
+        cpt.uses = 0
+        return cpt
+
+    def healthy(self, cpt):
+        return cpt.idle()
+
+    def replace(self):
+        with self.lock:
+            if not self.closed:
+                self.idle.append(self.executor.submit(self.start))
+
+    def checkout(self):
+        '''A CPT process, waiting at its main menu, for one session.'''
+        assert not self.closed, 'CPTPool is closed'
+        while True:
+            with self.lock:
+                started = self.idle.pop(0) if self.idle else self.executor.submit(self.start)
+            cpt = started.result()
+            if self.healthy(cpt):
+                break
+            cpt.clean()
+            self.replace()
+        cpt.uses += 1
+        cpt.pool = self
+        if cpt.uses >= self.max_uses:
+            # it won't be coming back, so start its replacement now
+            self.replace()
+        return cpt
+
+    def checkin(self, cpt):
+        '''Returns a process checked out with checkout to the pool, or stops
+        it if it's been used max_uses times or is no longer healthy.'''
+        cpt.pool = None
+        cpt.output_format = cpt.default_output_format
+        if cpt.uses < self.max_uses and self.healthy(cpt):
+            if not cpt.set_outputdir:
+                # Delete the last session's workspace and give the next
+                # session a new one. Its outputs may still be in use, e.g.
+                # memory-mapped GrADS files. Deleting them leaves an open
+                # mapping's data as it is, but CPT writing over them
+                # would change it.
+                rmrf(cpt.outputdir)
+                cpt.new_workspace()
+            with self.lock:
+                if not self.closed:
+                    done = Future()
+                    done.set_result(cpt)
+                    self.idle.insert(0, done)
+                    return
+        cpt.clean()
+        if cpt.uses < self.max_uses:
+            self.replace()
+
+    def close(self):
+        '''Stops every process in the pool.'''
+        with self.lock:
+            self.closed = True
+            idle, self.idle = self.idle, []
+        self.executor.shutdown(wait=True)
+        for started in idle:
+            started.result().clean()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
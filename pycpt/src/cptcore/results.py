@@ -0,0 +1,66 @@
+class CPTResults:
+    '''The results of one CPT session, each of which is only read from
+    CPT's output files the first time it's used, and kept from then on.
+
+    Results are attributes, named in names, and unpack, index and iterate
+    in that order, like the tuples the cptcore functions used to return:
+
+        hcsts, fcsts, skill, x_patterns, y_patterns = canonical_correlation_analysis(...)
+        hcsts = canonical_correlation_analysis(...).hindcasts
+
+    loaders maps each name, and any intermediate results they share, to a
+    function that takes this CPTResults and returns that result. Names
+    with no loader, because CPT wasn't asked for them, are None. The
+    session is released, e.g. back to its CPTPool, once every result in
+    names that has a loader has been read.'''
+
+    def __init__(self, cpt, names, loaders):
+        self._cpt = cpt
+        self._names = tuple(names)
+        self._loaders = loaders
+        self._values = {}
+
+    def __getattr__(self, name):
+        loaders = self.__dict__.get('_loaders', {})
+        if name not in loaders:
+            if name in self.__dict__.get('_names', ()):
+                return None
+            raise AttributeError(name)
+        if name not in self._values:
+            self._values[name] = loaders[name](self)
+            if all(n in self._values for n in self._names if n in loaders):
+                self.close()
+        return self._values[name]
+
+    def __iter__(self):
+        return (getattr(self, name) for name in self._names)
+
+    def __len__(self):
+        return len(self._names)
+
+    def __getitem__(self, i):
+        return tuple(self)[i] if isinstance(i, slice) else getattr(self, self._names[i])
+
+    def __repr__(self):
+        def state(name):
+            if name not in self._loaders:
+                return ' (not written)'
+            return '' if name in self._values else ' (not read yet)'
+        loaded = ', '.join(name + state(name) for name in self._names)
+        return f'CPTResults({loaded})'
+
+    def load(self):
+        '''Reads every result now.'''
+        for _ in self:
+            pass
+        return self
+
+    def close(self):
+        '''Releases the CPT session. Results that haven't been read yet
+        can't be read after this.'''
+        cpt, self._cpt = self.__dict__.get('_cpt'), None
+        if cpt is not None:
+            cpt.release()
+
+    def __del__(self):
+        self.close()
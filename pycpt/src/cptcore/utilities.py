@@ -8,6 +8,8 @@ import time
 import warnings
 import xarray as xr
 
+from cptextras.redate import redate
+
 CPT_SECRET  = 'C\bP\bT\b \b'
 
 
@@ -100,7 +102,39 @@ CPT_OUTPUT_NEW = {
     'cca_x_loadings': 411,
     'cca_y_loadings': 421,
     'eof_y_explained_variance': 311, 
-    'eof_x_explained_variance': 301
+    'eof_x_explained_variance': 301,
+    'forecast_values': 511,
+    'forecast_prediction_error_variance': 514,
+    'forecast_probabilities': 501,
+}
+
+# Output menu (111) options for the hindcasts made by each kind of validation
+CPT_HINDCAST_OUTPUT = {
+    'CROSSVALIDATION': {
+        'hindcast_values': 201,
+    },
+    'DOUBLE-CROSSVALIDATION': {
+        'hindcast_values': 221,
+        'hindcast_prediction_error_variance': 226,
+        'hindcast_probabilities': 224,
+    },
+    'RETROACTIVE': {
+        'hindcast_values': 211,
+        'hindcast_prediction_error_variance': 216,
+        'hindcast_probabilities': 214,
+    },
+}
+
+# The files CPT writes for the pattern results of each MOS, in the order
+# they're written.
+CPT_PATTERN_OUTPUT = {
+    'CCA': {
+        'x_patterns': ['cca_x_timeseries', 'cca_canonical_correlation', 'eof_x_timeseries', 'eof_x_loadings', 'cca_x_loadings', 'eof_x_explained_variance'],
+        'y_patterns': ['cca_y_timeseries', 'eof_y_timeseries', 'eof_y_loadings', 'cca_y_loadings', 'eof_y_explained_variance'],
+    },
+    'PCR': {
+        'x_patterns': ['eof_x_timeseries', 'eof_x_loadings', 'eof_x_explained_variance'],
+    },
 }
 
 
@@ -242,15 +276,19 @@ def check_configuration(config):
     assert config['ABOVE_NORMAL_THRESHOLD'] > config['BELOW_NORMAL_THRESHOLD'], 'ABOVE NORMAL THRESHOLD MUST BE GREAATER THAN BELOW NORMAL THRESHOLD'
 
 def detect_changes(outputdir, wait=0.2):
+    '''Wait until no file in outputdir has been created or changed size
+        since the last check, checking after 10 ms at first and backing off
+        to every `wait` seconds. Returns the time spent waiting.'''
+    start = time.perf_counter()
     cur_sizes = {}    
     cur_files = [ f for f in Path(outputdir).glob('*') ]
     for f in cur_files:
         cur_sizes[f] = os.stat(str(f)).st_size
 
-    detected_changes, i = True, 0
+    detected_changes, delay = True, min(0.01, wait)
     while detected_changes:
-        time.sleep(wait)
-        i += 1
+        time.sleep(delay)
+        delay = min(2 * delay, wait)
         new_sizes = {}
         new_files = [ f for f in Path(outputdir).glob('*') ]
         for f in new_files:
@@ -261,7 +299,7 @@ def detect_changes(outputdir, wait=0.2):
             if key not in cur_sizes.keys() or cur_sizes[key] != new_sizes[key]:
                 detected_changes = True 
         cur_sizes = copy.deepcopy(new_sizes )
-    return dt.timedelta(seconds=i*wait)
+    return dt.timedelta(seconds=time.perf_counter() - start)
 
 CPT_DEFAULT_VERSION = '17.7.8'
 CPT_VALID_VERSIONS = ['17.7.0','17.7.4','17.7.8']
@@ -302,3 +340,46 @@ def snap_to(reference, other):
         result['Name'] = reference['Name']
 
     return result
+
+
+def requested_outputs(outputs, names):
+    '''The set of results, out of names, that CPT should write the files
+    for: all of them if outputs is None.'''
+    if outputs is None:
+        return set(names)
+    outputs = {outputs} if isinstance(outputs, str) else set(outputs)
+    assert outputs <= set(names), f'outputs must be some of {list(names)}, not {sorted(outputs - set(names))}'
+    return outputs
+
+
+def in_sample_years(X, F):
+    '''How many years to move `X` forward for in-sample forecasts. CPT won't
+        make forecasts for the years it was trained on, so X is moved past
+        both its own years and those of `F` (which may be None), by a
+        multiple of 4 years so that leap days mostly stay leap days.'''
+    first, last = int(X['T'].dt.year.min()), int(X['T'].dt.year.max())
+    if F is not None:
+        last = max(last, int(F['T'].dt.year.max()))
+    return -(-(last - first + 1) // 4) * 4
+
+def with_in_sample_predictor(X, F):
+    '''Return the forecast predictor to give CPT for forecasts for both the
+        years of `F` and, in sample, those of `X`: `F` (which may be None)
+        followed by `X` moved in_sample_years into the future.'''
+    shifted = redate(X, yeardelta=in_sample_years(X, F))
+    if F is None:
+        return shifted
+    return xr.concat([F, shifted], 'T')
+
+def split_in_sample(fcsts, F, X):
+    '''Split the forecasts made for the predictor from
+        `with_in_sample_predictor` back into those for `F` (None if `F` was),
+        and the in-sample forecasts for the years of `X`, which are given
+        X's own time coordinates back.'''
+    n = 0 if F is None else len(F['T'])
+    real = fcsts.isel(T=slice(0, n)) if F is not None else None
+    in_sample = fcsts.isel(T=slice(n, None))
+    assert len(in_sample['T']) == len(X['T']), f"{len(in_sample['T'])} in-sample forecasts, expected {len(X['T'])}"
+    tcoords = {k: X[k].variable for k in ['T', 'Ti', 'Tf', 'S'] if k in X.coords}
+    in_sample = in_sample.drop_vars([k for k in ['Ti', 'Tf', 'S'] if k in in_sample.coords])
+    return real, in_sample.assign_coords(tcoords)
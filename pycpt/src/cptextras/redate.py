@@ -1,9 +1,20 @@
 import cptio as cio
 import datetime as dt 
 
+def redate_one(t, yeardelta):
+    """moves one time yeardelta years, from Feb 29 to Feb 28 if the new year isn't a leap year"""
+    t = cio.convert_np64_datetime(t)
+    day = t.day
+    if (t.month, t.day) == (2, 29) and not is_leap_year(t.year + yeardelta):
+        day = 28
+    return dt.datetime(t.year + yeardelta, t.month, day, t.hour, t.minute, t.second)
+
+def is_leap_year(year):
+    return year % 4 == 0 and (year % 100 != 0 or year % 400 == 0)
+
 def redate(x, yeardelta=100):
     """adds 100 years to the time-coordinate of a model dataarray"""
     for coord in ['Ti', 'Tf', 'T', 'S']:
         if coord in x.coords.keys(): 
-            x = x.assign_coords({coord: ('T', [ dt.datetime(cio.convert_np64_datetime(i).year + yeardelta, cio.convert_np64_datetime(i).month, cio.convert_np64_datetime(i).day, cio.convert_np64_datetime(i).hour, cio.convert_np64_datetime(i).minute, cio.convert_np64_datetime(i).second) for i in x.coords[coord].values])})
-    return x 
\ No newline at end of file
+            x = x.assign_coords({coord: ('T', [ redate_one(i, yeardelta) for i in x.coords[coord].values])})
+    return x
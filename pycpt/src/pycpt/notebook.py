@@ -5,6 +5,7 @@ import cptcore as cc
 import cptdl as dl
 import cptextras as ce
 import cptio as cio
+import concurrent.futures
 from IPython.core.interactiveshell import InteractiveShell
 import IPython.display
 from IPython.display import HTML
@@ -13,6 +14,7 @@ import matplotlib.gridspec as gridspec
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
+from pathlib import Path
 from PIL import Image
 import requests
 from scipy.stats import norm, t
@@ -370,8 +372,17 @@ def evaluate_models(
         interactive=False,
         log=None,
         project_file=None,
-        outputdir=None
+        outputdir=None,
+        max_workers=None,
+        skill_engine='cpt',
 ):
+    """Fits MOS between each model's hindcasts and Y, and makes its
+    forecasts. With max_workers > 1, that many models are evaluated at once,
+    each in its own process, and each writes to its own log, project file
+    and output directory, named after the model; a CPTPool can't be used
+    then. The results are in predictor_names order either way. skill_engine is the engine that
+    verifies the probabilistic hindcasts: 'cpt', or 'numpy' to verify
+    them without starting CPT."""
     cpt_args = dict(cpt_args)
     outputDir = domain_dir / "output"
     hcsts, fcsts, skill, pxs, pys = [], [], [], [], []
@@ -384,78 +395,115 @@ def evaluate_models(
             "outputdir": outputdir,
         }
 
-    for i, model_hcst in enumerate(hindcast_data):
+    if max_workers is None or max_workers <= 1:
+        results = [
+            evaluate_model(model_hcst, forecast_data[i], MOS, Y, cpt_args, outputDir, predictor_names[i], skill_engine)
+            for i, model_hcst in enumerate(hindcast_data)
+        ]
+    else:
+        # each model is evaluated in its own process, and a CPTPool's CPT
+        # processes can't be sent there
+        assert 'pool' not in (cpt_args['cpt_kwargs'] or {}), 'a CPTPool in cpt_kwargs can only be used with max_workers of None or 1, since with more the models are evaluated in other processes'
+        results = [None] * len(hindcast_data)
+        errors = {}
+        with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                executor.submit(
+                    evaluate_model, model_hcst, forecast_data[i], MOS, Y,
+                    separate_cpt_files(cpt_args, predictor_names[i]),
+                    outputDir, predictor_names[i], skill_engine
+                ): i
+                for i, model_hcst in enumerate(hindcast_data)
+            }
+            for future in concurrent.futures.as_completed(futures):
+                i = futures[future]
+                try:
+                    results[i] = future.result()
+                except Exception as e:
+                    errors[predictor_names[i]] = e
+        if errors:
+            msg = "\n".join(f"  {name}: {e!r}" for name, e in errors.items())
+            raise RuntimeError(
+                f"{len(errors)} of {len(hindcast_data)} models failed:\n{msg}"
+            ) from next(iter(errors.values()))
+
+    for h, f, s, px, py in results:
+        if str(MOS).upper() in ['CCA', 'PCR']:
+            hcsts.append(h)
+            fcsts.append(f)
+            pxs.append(px)
+            pys.append(py)
+        skill.append(s)
+    return hcsts, fcsts, skill, pxs, pys
 
 
-        if str(MOS).upper() == 'CCA':
+def separate_cpt_files(cpt_args, name):
+    """A copy of cpt_args whose log, project file and output directory, if
+    set, are suffixed with name, so that CPT sessions running at the same
+    time don't write to the same files."""
+    cpt_args = dict(cpt_args)
+    cpt_kwargs = dict(cpt_args.get('cpt_kwargs') or {})
+    for key in ['log', 'project_file']:
+        if cpt_kwargs.get(key) is not None:
+            path = Path(cpt_kwargs[key])
+            cpt_kwargs[key] = path.with_name(f"{path.stem}_{name}{path.suffix}")
+    if cpt_kwargs.get('outputdir') is not None:
+        cpt_kwargs['outputdir'] = Path(cpt_kwargs['outputdir']) / name
+    cpt_args['cpt_kwargs'] = cpt_kwargs
+    return cpt_args
+
+
+def evaluate_model(model_hcst, model_fcst, MOS, Y, cpt_args, outputDir, predictor_name, skill_engine='cpt'):
+    """Evaluates one model for evaluate_models, saving its results in
+    outputDir and returning (hindcasts, forecasts, skill, x patterns,
+    y patterns). Only skill is set when MOS is neither CCA nor PCR."""
+    if str(MOS).upper() == 'CCA':
+
+        # fit CCA model between X & Y and produce real-time forecasts for F,
+        # and in-sample probabilistic hindcasts, from the same fit
+        cca_h, cca_rtf, cca_s, cca_px, cca_py = cc.canonical_correlation_analysis(
+            model_hcst, Y, F=model_fcst, in_sample_forecasts=True, **cpt_args
+        )
 
-            # fit CCA model between X & Y and produce real-time forecasts for F
-            cca_h, cca_rtf, cca_s, cca_px, cca_py = cc.canonical_correlation_analysis(
-                model_hcst, Y, F=forecast_data[i], **cpt_args
-            )
+        # use the in-sample probabilistic hindcasts to perform probabilistic forecast verification
+        # warning - this produces unrealistically optimistic values
+        cca_pfv = cc.probabilistic_forecast_verification(cca_h.probabilistic, Y, **dict(cpt_args, engine=skill_engine))
+        cca_s = xr.merge([cca_s, cca_pfv])
 
-            # fit CCA model again between X & Y, and produce in-sample probabilistic hindcasts
-            # this is using X in place of F, with the year coordinates changed to n+100 years
-            # because CPT does not allow you to make forecasts for in-sample data
-            cca_h, cca_f, cca_s, cca_px, cca_py = cc.canonical_correlation_analysis(
-                model_hcst, Y, \
-                F=ce.redate(model_hcst, yeardelta=48), **cpt_args
-            )
-            cca_h = xr.merge([cca_h, ce.redate(cca_f.probabilistic, yeardelta=-48), ce.redate(cca_f.prediction_error_variance, yeardelta=-48)])
-
-            # use the in-sample probabilistic hindcasts to perform probabilistic forecast verification
-            # warning - this produces unrealistically optimistic values
-            cca_pfv = cc.probabilistic_forecast_verification(cca_h.probabilistic, Y, **cpt_args)
-            cca_s = xr.merge([cca_s, cca_pfv])
-
-            hcsts.append(cca_h)
-            fcsts.append(cca_rtf)
-            skill.append(cca_s.where(cca_s > -999, other=np.nan))
-            pxs.append(cca_px)
-            pys.append(cca_py)
-
-        elif str(MOS).upper() == 'PCR':
-
-            # fit PCR model between X & Y and produce real-time forecasts for F
-            pcr_h, pcr_rtf, pcr_s, pcr_px = cc.principal_components_regression(model_hcst, Y, F=forecast_data[i], **cpt_args)
-
-            # fit PCR model again between X & Y, and produce in-sample probabilistic hindcasts
-            # this is using X in place of F, with the year coordinates changed to n+100 years
-            # because CPT does not allow you to make forecasts for in-sample data
-            pcr_h, pcr_f, pcr_s, pcr_px = cc.principal_components_regression(model_hcst, Y, F=ce.redate(model_hcst, yeardelta=48), **cpt_args)
-            pcr_h = xr.merge([pcr_h, ce.redate(pcr_f.probabilistic, yeardelta=-48), ce.redate(pcr_f.prediction_error_variance, yeardelta=-48)])
-
-            # use the in-sample probabilistic hindcasts to perform probabilistic forecast verification
-            # warning - this produces unrealistically optimistic values
-            pcr_pfv = cc.probabilistic_forecast_verification(pcr_h.probabilistic, Y, **cpt_args)
-            pcr_s = xr.merge([pcr_s, pcr_pfv])
-            hcsts.append(pcr_h)
-            fcsts.append(pcr_rtf)
-            skill.append(pcr_s.where(pcr_s > -999, other=np.nan))
-            pxs.append(pcr_px)
-            pys.append(pcr_px)	# dummy assignment since there are no Y PCs in PCR
-        else:
-            # simply compute deterministic skill scores of non-corrected ensemble means
-            nomos_skill = cc.deterministic_skill(model_hcst, Y, **cpt_args)
-            skill.append(nomos_skill.where(nomos_skill > -999, other=np.nan))
-
-        # choose what data to export here (any of the above results data arrays can be saved to netcdf)
-        if str(MOS).upper() == 'CCA':
-            cca_h.to_netcdf(outputDir /  (predictor_names[i] + '_crossvalidated_cca_hindcasts.nc'))
-            if cca_rtf is not None:
-                cca_rtf.to_netcdf(outputDir / (predictor_names[i] + '_realtime_cca_forecasts.nc'))
-            cca_s.to_netcdf(outputDir / (predictor_names[i] + '_skillscores_cca.nc'))
-            cca_px.to_netcdf(outputDir / (predictor_names[i] + '_cca_x_spatial_loadings.nc'))
-            cca_py.to_netcdf(outputDir / (predictor_names[i] + '_cca_y_spatial_loadings.nc'))
-        elif str(MOS).upper() == 'PCR':
-            pcr_h.to_netcdf(outputDir /  (predictor_names[i] + '_crossvalidated_pcr_hindcasts.nc'))
-            if pcr_rtf is not None:
-                pcr_rtf.to_netcdf(outputDir / (predictor_names[i] + '_realtime_pcr_forecasts.nc'))
-            pcr_s.to_netcdf(outputDir / (predictor_names[i] + '_skillscores_pcr.nc'))
-            pcr_px.to_netcdf(outputDir / (predictor_names[i] + '_pcr_x_spatial_loadings.nc'))
-        else:
-            nomos_skill.to_netcdf(outputDir / (predictor_names[i] + '_nomos_skillscores.nc'))
-    return hcsts, fcsts, skill, pxs, pys
+    elif str(MOS).upper() == 'PCR':
+
+        # fit PCR model between X & Y and produce real-time forecasts for F,
+        # and in-sample probabilistic hindcasts, from the same fit
+        pcr_h, pcr_rtf, pcr_s, pcr_px = cc.principal_components_regression(model_hcst, Y, F=model_fcst, in_sample_forecasts=True, **cpt_args)
+
+        # use the in-sample probabilistic hindcasts to perform probabilistic forecast verification
+        # warning - this produces unrealistically optimistic values
+        pcr_pfv = cc.probabilistic_forecast_verification(pcr_h.probabilistic, Y, **dict(cpt_args, engine=skill_engine))
+        pcr_s = xr.merge([pcr_s, pcr_pfv])
+    else:
+        # simply compute deterministic skill scores of non-corrected ensemble means
+        nomos_skill = cc.deterministic_skill(model_hcst, Y, **cpt_args)
+
+    # choose what data to export here (any of the above results data arrays can be saved to netcdf)
+    if str(MOS).upper() == 'CCA':
+        cca_h.to_netcdf(outputDir /  (predictor_name + '_crossvalidated_cca_hindcasts.nc'))
+        if cca_rtf is not None:
+            cca_rtf.to_netcdf(outputDir / (predictor_name + '_realtime_cca_forecasts.nc'))
+        cca_s.to_netcdf(outputDir / (predictor_name + '_skillscores_cca.nc'))
+        cca_px.to_netcdf(outputDir / (predictor_name + '_cca_x_spatial_loadings.nc'))
+        cca_py.to_netcdf(outputDir / (predictor_name + '_cca_y_spatial_loadings.nc'))
+        return cca_h, cca_rtf, cca_s.where(cca_s > -999, other=np.nan), cca_px, cca_py
+    elif str(MOS).upper() == 'PCR':
+        pcr_h.to_netcdf(outputDir /  (predictor_name + '_crossvalidated_pcr_hindcasts.nc'))
+        if pcr_rtf is not None:
+            pcr_rtf.to_netcdf(outputDir / (predictor_name + '_realtime_pcr_forecasts.nc'))
+        pcr_s.to_netcdf(outputDir / (predictor_name + '_skillscores_pcr.nc'))
+        pcr_px.to_netcdf(outputDir / (predictor_name + '_pcr_x_spatial_loadings.nc'))
+        # pcr_px is repeated since there are no Y PCs in PCR
+        return pcr_h, pcr_rtf, pcr_s.where(pcr_s > -999, other=np.nan), pcr_px, pcr_px
+    else:
+        nomos_skill.to_netcdf(outputDir / (predictor_name + '_nomos_skillscores.nc'))
+        return None, None, nomos_skill.where(nomos_skill > -999, other=np.nan), None, None
 
 
 SKILL_METRICS: dict[str, tuple[LinearSegmentedColormap, int, int]] = {
@@ -1651,10 +1699,12 @@ def construct_mme_new(fcsts, hcsts, Y, ensemble, predictor_names, domain_dir):
     return mme_hcst, mme_fcst
 
 
-def evaluate_mme(mme_hcst, Y, cpt_args, domain_dir):
-    # Skill scores
-    nextgen_skill_deterministic = cc.deterministic_skill(mme_hcst['deterministic'], Y, **cpt_args)
-    nextgen_skill_probabilistic = cc.probabilistic_forecast_verification(mme_hcst['probabilistic'], Y, **cpt_args)
+def evaluate_mme(mme_hcst, Y, cpt_args, domain_dir, skill_engine='cpt'):
+    # Skill scores. The MME hindcasts are already on Y's grid, so with
+    # skill_engine='numpy' they can be verified without a CPT session.
+    skill_args = dict(cpt_args, engine=skill_engine)
+    nextgen_skill_deterministic = cc.deterministic_skill(mme_hcst['deterministic'], Y, **skill_args)
+    nextgen_skill_probabilistic = cc.probabilistic_forecast_verification(mme_hcst['probabilistic'], Y, **skill_args)
     nextgen_skill = xr.merge([nextgen_skill_deterministic, nextgen_skill_probabilistic])
     outputDir = domain_dir / "output"
     nextgen_skill.to_netcdf(outputDir / ('MME_skill_scores.nc'))
@@ -1,6 +1,7 @@
 import cartopy
 import cartopy.crs as ccrs
 import cartopy.mpl.gridliner as gridliner
+import concurrent.futures
 import datetime
 import cptcore as cc
 import cptdl as dl
@@ -15,6 +16,8 @@ from pathlib import Path
 import scipy.stats
 import xarray as xr
 
+from .notebook import separate_cpt_files
+
 missing_value_flag = -999
 
 hindcasts = {
@@ -190,79 +193,108 @@ def download_forecasts(predictor_names, download_args, files_root, force_downloa
     F = xr.concat(model_slices, 'model')
     return F
 
-def evaluate_models(hindcast_data, forecast_data, Y, MOS, cpt_args, domain_dir, interactive=False):
+def evaluate_models(hindcast_data, forecast_data, Y, MOS, cpt_args, domain_dir, interactive=False, max_workers=None):
+    """Fits MOS for every model and lead. With max_workers > 1, that many
+    (model, lead) pairs are evaluated at once, each in its own process, and
+    each with its own CPT log, project file and output directory; a CPTPool
+    can't be used then."""
     outputDir = domain_dir / "output"
-    hcst_model_slices, fcst_model_slices, skill_model_slices, px_model_slices, py_model_slices = [], [], [], [], []
-
-    for model in hindcast_data['model'].values:
-        hcst_lead_slices, fcst_lead_slices, skill_lead_slices, px_lead_slices, py_lead_slices = [], [], [], [], []
-        for lead_name in hindcast_data['lead_name'].values:
-            if str(MOS).upper() == 'CCA':
-                hindcast1 = hindcast_data.sel(model=model, lead_name=lead_name, drop=True)
-                forecast1 = forecast_data.sel(model=model, lead_name=lead_name, drop=True)
-                Y1 = Y.sel(lead_name=lead_name, drop=True)
-                
-                # fit CCA model between X & Y and produce real-time forecasts for F
-                cca_h, cca_rtf, cca_s, cca_px, cca_py = cc.canonical_correlation_analysis(
-                    hindcast1, Y1,  F=forecast1, **cpt_args,
-                )
-
-                hcst_lead_slices.append(cca_h.assign_coords(lead_name=lead_name))
-                fcst_lead_slices.append(cca_rtf.assign_coords(lead_name=lead_name))
-                skill_lead_slices.append(cca_s.where(cca_s > -999, other=np.nan).assign_coords(lead_name=lead_name))
-                px_lead_slices.append(cca_px.assign_coords(lead_name=lead_name))
-                py_lead_slices.append(cca_py.assign_coords(lead_name=lead_name))
-
-            elif str(MOS).upper() == 'PCR':
-                raise Exception('PCR not yet implemented for subseasonal')
-            else:
-                # simply compute deterministic skill scores of non-corrected ensemble means
-                nomos_skill = cc.deterministic_skill(hindcast1, Y1, **cpt_args)
-                skill_lead_slices.append(nomos_skill.where(nomos_skill > -999, other=np.nan).assign_coords(lead_name=lead_name))
-
-            # choose what data to export here (any of the above results data arrays can be saved to netcdf)
-            # TODO include forecast date in the filenames?
-            basename = f"{model}-{lead_name}"
-            if str(MOS).upper() == 'CCA':
-                cca_h.to_netcdf(outputDir /  (basename + '_crossvalidated_cca_hindcasts.nc'))
-                cca_rtf.to_netcdf(outputDir / (basename + '_realtime_cca_forecasts.nc'))
-                cca_s.to_netcdf(outputDir / (basename + '_skillscores_cca.nc'))
-                cca_px.to_netcdf(outputDir / (basename + '_cca_x_spatial_loadings.nc'))
-                cca_py.to_netcdf(outputDir / (basename + '_cca_y_spatial_loadings.nc'))
-            elif str(MOS).upper() == 'PCR':
-                raise Exception('PCR not yet implemented for subseasonal')
-            else:
-                nomos_skill.to_netcdf(outputDir / (basename + '_nomos_skillscores.nc'))
-            
-        hcst_model_slices.append(
-            xr.concat(hcst_lead_slices, 'lead_name')
-            .assign_coords(model=model)
-        )
-        fcst_model_slices.append(
-            xr.concat(fcst_lead_slices, 'lead_name')
-            .assign_coords(model=model)
-        )
-        skill_model_slices.append(
-            xr.concat(skill_lead_slices, 'lead_name')
-            .assign_coords(model=model)
-        )
-        px_model_slices.append(
-            xr.concat(px_lead_slices, 'lead_name')
-            .assign_coords(model=model)
+    models = hindcast_data['model'].values
+    lead_names = hindcast_data['lead_name'].values
+
+    # one cell per (model, lead), each holding that pair's
+    # (hcst, fcst, skill, px, py)
+    cells = np.empty((len(models), len(lead_names)), dtype=object)
+    jobs = {
+        (i, j): (
+            hindcast_data.sel(model=model, lead_name=lead_name, drop=True),
+            forecast_data.sel(model=model, lead_name=lead_name, drop=True),
+            Y.sel(lead_name=lead_name, drop=True),
+            MOS,
+            cpt_args,
+            outputDir,
+            f"{model}-{lead_name}",
         )
-        py_model_slices.append(
-            xr.concat(py_lead_slices, 'lead_name')
-            .assign_coords(model=model)
+        for i, model in enumerate(models)
+        for j, lead_name in enumerate(lead_names)
+    }
+    if max_workers is None or max_workers <= 1:
+        for (i, j), args in jobs.items():
+            cells[i, j] = evaluate_model_lead(*args)
+    else:
+        # each (model, lead) pair is evaluated in its own process, and a
+        # CPTPool's CPT processes can't be sent there
+        assert 'pool' not in (cpt_args.get('cpt_kwargs') or {}), 'a CPTPool in cpt_kwargs can only be used with max_workers of None or 1, since with more the models are evaluated in other processes'
+        errors = {}
+        with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = {}
+            for (i, j), args in jobs.items():
+                args = list(args)
+                args[4] = separate_cpt_files(cpt_args, args[6])
+                futures[executor.submit(evaluate_model_lead, *args)] = (i, j)
+            for future in concurrent.futures.as_completed(futures):
+                i, j = futures[future]
+                try:
+                    cells[i, j] = future.result()
+                except Exception as e:
+                    errors[f"{models[i]}-{lead_names[j]}"] = e
+        if errors:
+            msg = "\n".join(f"  {name}: {e!r}" for name, e in errors.items())
+            raise RuntimeError(
+                f"{len(errors)} of {cells.size} model-leads failed:\n{msg}"
+            ) from next(iter(errors.values()))
+
+    # combine each output of all the cells at once, rather than one lead
+    # and then one model at a time
+    results = []
+    for k in range(5):
+        if cells[0, 0][k] is None:
+            results.append(None)
+            continue
+        grid = [
+            [
+                cells[i, j][k].assign_coords(model=model, lead_name=lead_name)
+                for j, lead_name in enumerate(lead_names)
+            ]
+            for i, model in enumerate(models)
+        ]
+        results.append(
+            xr.combine_nested(grid, concat_dim=['model', 'lead_name'], compat='equals')
+            .transpose('model', 'lead_name', ...)
         )
-
-    hcsts = xr.concat(hcst_model_slices, 'model')
-    fcsts = xr.concat(fcst_model_slices, 'model')
-    skill = xr.concat(skill_model_slices, 'model')
-    pxs = xr.concat(px_model_slices, 'model')
-    pys = xr.concat(py_model_slices, 'model')
+    hcsts, fcsts, skill, pxs, pys = results
     return hcsts, fcsts, skill, pxs, pys
 
 
+def evaluate_model_lead(hindcast1, forecast1, Y1, MOS, cpt_args, outputDir, basename):
+    """Evaluates one model at one lead for evaluate_models, saving the
+    results in outputDir and returning (hindcasts, forecasts, skill, x
+    patterns, y patterns). Only skill is set when MOS isn't CCA."""
+    if str(MOS).upper() == 'CCA':
+        # fit CCA model between X & Y and produce real-time forecasts for F
+        cca_h, cca_rtf, cca_s, cca_px, cca_py = cc.canonical_correlation_analysis(
+            hindcast1, Y1,  F=forecast1, **cpt_args,
+        )
+    elif str(MOS).upper() == 'PCR':
+        raise Exception('PCR not yet implemented for subseasonal')
+    else:
+        # simply compute deterministic skill scores of non-corrected ensemble means
+        nomos_skill = cc.deterministic_skill(hindcast1, Y1, **cpt_args)
+
+    # choose what data to export here (any of the above results data arrays can be saved to netcdf)
+    # TODO include forecast date in the filenames?
+    if str(MOS).upper() == 'CCA':
+        cca_h.to_netcdf(outputDir /  (basename + '_crossvalidated_cca_hindcasts.nc'))
+        cca_rtf.to_netcdf(outputDir / (basename + '_realtime_cca_forecasts.nc'))
+        cca_s.to_netcdf(outputDir / (basename + '_skillscores_cca.nc'))
+        cca_px.to_netcdf(outputDir / (basename + '_cca_x_spatial_loadings.nc'))
+        cca_py.to_netcdf(outputDir / (basename + '_cca_y_spatial_loadings.nc'))
+        return cca_h, cca_rtf, cca_s.where(cca_s > -999, other=np.nan), cca_px, cca_py
+    else:
+        nomos_skill.to_netcdf(outputDir / (basename + '_nomos_skillscores.nc'))
+        return None, None, nomos_skill.where(nomos_skill > -999, other=np.nan), None, None
+
+
 def plot_skill(skill, MOS, files_root, skill_metrics):
     nblocks = len(skill_metrics)
     nrows_per_block = len(skill['model'])
@@ -1,9 +1,17 @@
 import numpy as np
+import os
 from pathlib import Path
+import platform
+import pytest
 
-from cptcore import canonical_correlation_analysis, deterministic_skill, probabilistic_forecast_verification, principal_components_regression, multiple_regression
+from cptcore import CPTPool, canonical_correlation_analysis, deterministic_skill, probabilistic_forecast_verification, principal_components_regression, multiple_regression
 import cptio
 
+requires_cpt = pytest.mark.skipif(
+    not (Path(os.getenv('CPT_BIN_DIR', '')) / ('CPT_batch.exe' if platform.system() == 'Windows' else 'CPT.x')).is_file(),
+    reason='CPT is not installed',
+)
+
 def load_southasia_nmme():
     x = cptio.open_cptdataset(str(Path( __file__ ).absolute().parents[0] / 'data/seasonal-core/SEASONAL_CANCM4I_PRCP_HCST_JUN-SEP_None_2021-05.tsv').replace('.egg', '')).prec
     y = cptio.open_cptdataset(str( Path( __file__).absolute().parents[0] / 'data/seasonal-core/SEASONAL_CPCCMAPURD_PRCP_OBS_JUN-SEP_None_2021-05.tsv').replace('.egg', '')).prate
@@ -24,11 +32,133 @@ def test_cca(**kwargs):
 
     # TODO more assertions
 
+def test_cca_in_sample_forecasts():
+    x, y = load_southasia_nmme()
+    f = x.isel(T=slice(-1, None))
+    x = x.isel(T=slice(None,-1))
+    hcsts, fcsts, skill_values, x_pattern_values, y_pattern_values = canonical_correlation_analysis(x, y, F=f, in_sample_forecasts=True)
+
+    assert set(hcsts.data_vars) == set(['deterministic', 'probabilistic', 'prediction_error_variance'])
+    assert hcsts['probabilistic'].dims == ('C', 'T', 'Y', 'X')
+    assert hcsts['probabilistic'].shape == (3, 41, 33, 30)
+    assert fcsts.sizes['T'] == 1
+
+def test_cca_in_sample_forecasts_without_f():
+    x, y = load_southasia_nmme()
+    x = x.isel(T=slice(None,-1))
+    results = canonical_correlation_analysis(x, y, in_sample_forecasts=True, outputs=['hindcasts'])
+
+    assert results.forecasts is None
+    hcsts = results.hindcasts
+    assert set(hcsts.data_vars) == set(['deterministic', 'probabilistic', 'prediction_error_variance'])
+    assert hcsts['probabilistic'].shape == (3, 41, 33, 30)
+
+def test_cca_results_read_lazily():
+    x, y = load_southasia_nmme()
+    results = canonical_correlation_analysis(x, y)
+    assert 'not read yet' in repr(results)
+    assert results.skill.sizes == {'Y': 33, 'X': 30}
+    hcsts, fcsts, skill_values, x_pattern_values, y_pattern_values = results
+    assert skill_values is results.skill
+    assert fcsts is None
+
+def test_cca_results_release_session():
+    x, y = load_southasia_nmme()
+    results = canonical_correlation_analysis(x, y)
+    cpt = results._cpt
+    results.load()
+    # once every output is read, CPT is stopped and its workspace removed
+    assert cpt.cpt_process.poll() is not None
+    assert not cpt.outputdir.exists()
+
+def test_cca_outputs():
+    x, y = load_southasia_nmme()
+    f = x.isel(T=slice(-1, None))
+    x = x.isel(T=slice(None,-1))
+    results = canonical_correlation_analysis(x, y, F=f, outputs={'hindcasts', 'skill'})
+    assert results.forecasts is None
+    assert results.x_patterns is None
+    assert set(results.hindcasts.data_vars) == set(['deterministic'])
+    assert 'pearson' in results.skill.data_vars
+
+@requires_cpt
+def test_cca_grads_outputs():
+    x, y = load_southasia_nmme()
+    f = x.isel(T=slice(-1, None))
+    x = x.isel(T=slice(None,-1))
+    text = canonical_correlation_analysis(x, y, F=f).load()
+    grads = canonical_correlation_analysis(x, y, F=f, cpt_kwargs={'output_format': 'GRADS'}).load()
+    # the text outputs have six significant digits
+    for name in ['hindcasts', 'forecasts', 'skill']:
+        for v in getattr(text, name).data_vars:
+            np.testing.assert_allclose(getattr(grads, name)[v], getattr(text, name)[v], rtol=1e-5, atol=1e-5)
+
+def test_cca_numpy():
+    x, y = load_southasia_nmme()
+    f = x.isel(T=slice(-1, None))
+    x = x.isel(T=slice(None,-1))
+    hcsts, fcsts, skill_values, x_pattern_values, y_pattern_values = canonical_correlation_analysis(x, y, F=f, in_sample_forecasts=True, engine='numpy')
+
+    assert set(hcsts.data_vars) == set(['deterministic', 'probabilistic', 'prediction_error_variance'])
+    assert hcsts['deterministic'].dims == ('T', 'Y', 'X')
+    assert hcsts['deterministic'].shape == (41, 33, 30)
+    assert hcsts['probabilistic'].dims == ('C', 'T', 'Y', 'X')
+    assert fcsts['probabilistic'].shape == (3, 1, 33, 30)
+    np.testing.assert_allclose(fcsts['probabilistic'].sum('C'), 100)
+    assert 'pearson' in skill_values.data_vars
+    assert x_pattern_values['x_cca_loadings'].sizes['Mode'] == y_pattern_values['y_cca_loadings'].sizes['Mode']
+
+@requires_cpt
+def test_cca_numpy_matches_cpt():
+    x, y = load_southasia_nmme()
+    f = x.isel(T=slice(-1, None))
+    x = x.isel(T=slice(None,-1))
+    cpt_hcsts, _, cpt_skill, cpt_px, cpt_py = canonical_correlation_analysis(x, y, F=f)
+    hcsts, _, skill, px, py = canonical_correlation_analysis(x, y, F=f, engine='numpy')
+    # CPT refits the EOFs for each year left out, the numpy engine doesn't
+    scale = y.std('T')
+    np.testing.assert_allclose(hcsts['deterministic'] / scale, cpt_hcsts['deterministic'] / scale, atol=0.5)
+    np.testing.assert_allclose(skill['pearson'], cpt_skill['pearson'], atol=0.15)
+    # the loadings of the leading mode have the same pattern, up to sign
+    for ours, theirs in [(px['x_cca_loadings'], cpt_px['x_cca_loadings']), (py['y_cca_loadings'], cpt_py['y_cca_loadings'])]:
+        a, b = ours.isel(Mode=0).values.ravel(), theirs.isel(Mode=0).values.ravel()
+        both = np.isfinite(a) & np.isfinite(b)
+        assert abs(np.corrcoef(a[both], b[both])[0, 1]) > 0.9
+
 def test_deterministic_skill(**kwargs):
     x, y = load_southasia_nmme()
     skill = deterministic_skill(x, y, **kwargs)
     # TODO make assertions
 
+def test_deterministic_skill_numpy():
+    x, y = load_southasia_nmme()
+    cpt_skill = deterministic_skill(x, y)
+    skill = deterministic_skill(x, y, engine='numpy')
+    assert set(skill.data_vars) == set(cpt_skill.data_vars)
+    for m, atol in [
+        ('pearson', 0.01),
+        ('spearman', 0.01),
+        ('two_alternative_forced_choice', 1),
+        ('roc_area_below_normal', 0.05),
+        ('roc_area_above_normal', 0.05),
+    ]:
+        np.testing.assert_allclose(skill[m], cpt_skill[m], atol=atol)
+    np.testing.assert_allclose(skill['root_mean_squared_error'], cpt_skill['root_mean_squared_error'], rtol=0.01)
+
+def test_deterministic_skill_numpy_missing():
+    _, y = load_southasia_nmme()
+    x = y.copy()
+    # one point missing too many years is left out, one missing a
+    # single year still has skill
+    x[:5, 0, 0] = np.nan
+    x[:1, 0, 1] = np.nan
+    skill = deterministic_skill(x, y, engine='numpy')
+    assert skill['pearson'][0, 0].isnull()
+    assert skill['pearson'][0, 1] > 0.9
+    np.testing.assert_allclose(skill['pearson'][1:], 1)
+    np.testing.assert_allclose(skill['two_alternative_forced_choice'][1:], 100)
+    np.testing.assert_allclose(skill['root_mean_squared_error'][1:], 0)
+
 def test_pfv(**kwargs):
     y = cptio.open_cptdataset(str(Path( __file__ ).absolute().parents[0] / 'data/seasonal-core/SEASONAL_CANCM4I_PRCP_HCST_JUN-SEP_None_2021-05.tsv')).prec
     x = cptio.open_cptdataset( str(Path( __file__).absolute().parents[0] / 'data/seasonal-core/prob_rfcsts.tsv')).probabilistic
@@ -41,6 +171,17 @@ def test_pfv(**kwargs):
     for m in skill.data_vars:
         assert skill[m].notnull().all()
 
+def test_pfv_numpy():
+    y = cptio.open_cptdataset(str(Path( __file__ ).absolute().parents[0] / 'data/seasonal-core/SEASONAL_CANCM4I_PRCP_HCST_JUN-SEP_None_2021-05.tsv')).prec
+    x = cptio.open_cptdataset( str(Path( __file__).absolute().parents[0] / 'data/seasonal-core/prob_rfcsts.tsv')).probabilistic
+    cpt_skill = probabilistic_forecast_verification(x, y)
+    skill = probabilistic_forecast_verification(x, y, engine='numpy')
+    assert set(skill.data_vars) == set(cpt_skill.data_vars)
+    assert list(skill.coords) == ['Y', 'X']
+    np.testing.assert_allclose(skill['generalized_roc'], cpt_skill['generalized_roc'], atol=2)
+    np.testing.assert_allclose(skill['rank_probability_skill_score'], cpt_skill['rank_probability_skill_score'], atol=2)
+    np.testing.assert_allclose(skill['ignorance'], cpt_skill['ignorance'], atol=0.05)
+
 def test_pcr(**kwargs):
     x, y = load_southasia_nmme()
     f = x.isel(T=slice(-1, None))
@@ -48,9 +189,78 @@ def test_pcr(**kwargs):
     hcsts,  fcst,  skill, loadings = principal_components_regression(x, y, F=f, **kwargs)
     # TODO make assertions
 
+def test_pcr_numpy():
+    x, y = load_southasia_nmme()
+    f = x.isel(T=slice(-1, None))
+    x = x.isel(T=slice(None,-1))
+    hcsts, fcst, skill, loadings = principal_components_regression(x, y, F=f, engine='numpy')
+
+    assert set(hcsts.data_vars) == set(['deterministic'])
+    assert hcsts['deterministic'].shape == (41, 33, 30)
+    assert fcst['probabilistic'].dims == ('C', 'T', 'Y', 'X')
+    np.testing.assert_allclose(fcst['probabilistic'].sum('C'), 100)
+    assert 'pearson' in skill.data_vars
+    assert set(loadings.data_vars) == set(['x_eof_scores', 'x_eof_loadings', 'x_explained_variance'])
+
+@requires_cpt
+def test_pcr_numpy_matches_cpt():
+    x, y = load_southasia_nmme()
+    f = x.isel(T=slice(-1, None))
+    x = x.isel(T=slice(None,-1))
+    cpt_hcsts, _, cpt_skill, _ = principal_components_regression(x, y, F=f)
+    hcsts, _, skill, _ = principal_components_regression(x, y, F=f, engine='numpy')
+    # CPT refits the EOFs for each year left out, the numpy engine doesn't
+    scale = y.std('T')
+    np.testing.assert_allclose(hcsts['deterministic'] / scale, cpt_hcsts['deterministic'] / scale, atol=0.5)
+    np.testing.assert_allclose(skill['pearson'], cpt_skill['pearson'], atol=0.15)
+
+def test_pcr_numpy_retroactive():
+    x, y = load_southasia_nmme()
+    hcsts, fcst, skill, loadings = principal_components_regression(x, y, validation='retroactive', engine='numpy')
+
+    # the years of the initial training period have no hindcasts, and
+    # like CPT's, the retroactive hindcasts are only deterministic
+    assert set(hcsts.data_vars) == set(['deterministic'])
+    assert hcsts['deterministic'].shape == (23, 33, 30)
+    assert hcsts['T'][0].dt.year == 1998
+    assert fcst is None
+    assert 'pearson' in skill.data_vars
+
+@requires_cpt
+def test_pcr_numpy_retroactive_matches_cpt():
+    x, y = load_southasia_nmme()
+    _, _, cpt_skill, _ = principal_components_regression(x, y, validation='retroactive')
+    _, _, skill, _ = principal_components_regression(x, y, validation='retroactive', engine='numpy')
+    np.testing.assert_allclose(skill['pearson'], cpt_skill['pearson'], atol=0.15)
+
 def test_mlr(**kwargs):
     x, y = load_southasia_nmme()
     f = x.isel(T=slice(-1, None))
     x = x.isel(T=slice(None,-1))
     hcsts, fcst, skill = multiple_regression(x, y, F=f, **kwargs)
     # TODO assertions
+
+def test_pool():
+    x, y = load_southasia_nmme()
+    with CPTPool(size=1, max_uses=2) as pool:
+        first = deterministic_skill(x, y, cpt_kwargs={'pool': pool})
+        second = deterministic_skill(x, y, cpt_kwargs={'pool': pool})
+    assert first.equals(second)
+
+def test_in_sample_predictor_after_late_forecasts():
+    from cptcore.utilities import with_in_sample_predictor, split_in_sample
+    x, _ = load_southasia_nmme()
+    f = x.isel(T=slice(-1, None)).assign_coords(T=('T', np.array(['2035-07-31T12'], dtype='datetime64[ns]')))
+    x = x.isel(T=slice(None, -1)).assign_coords(Tf=x['Tf'][:-1].copy(data=np.where(np.arange(41) == 24, np.datetime64('2004-02-29', 'ns'), x['Tf'].values[:-1])))
+    predictor = with_in_sample_predictor(x, f)
+    # moved past the forecast year, and a leap day into a leap year
+    assert predictor['T'].values[1] > f['T'].values[-1]
+    _, in_sample = split_in_sample(predictor, f, x)
+    np.testing.assert_array_equal(in_sample['T'].values, x['T'].values)
+    np.testing.assert_array_equal(in_sample['Tf'].values, x['Tf'].values)
+
+def test_redate_leap_day():
+    from cptextras import redate
+    x, _ = load_southasia_nmme()
+    x = x.isel(T=slice(0, 1)).assign_coords(Tf=('T', np.array(['2052-02-29'], dtype='datetime64[ns]')))
+    assert redate(x, yeardelta=48)['Tf'].values[0] == np.datetime64('2100-02-28')
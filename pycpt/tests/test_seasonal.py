@@ -183,6 +183,23 @@ def test_evaluate_models_nomos():
     print(skill)
     check_model_skills(Y, skill, DETERMINISTIC_SKILL_METRICS)
 
+def test_evaluate_models_max_workers():
+    MOS = 'CCA'
+    cpt_args = DEFAULT_CPT_ARGS
+    Y, original_hcsts, original_fcsts = get_test_data(PREDICTOR_NAMES, DEFAULT_PREDICTAND_NAME)
+    serial = call_evaluate_models(original_hcsts, original_fcsts, Y, MOS, cpt_args)
+    fake_predictor_extent = dict(west=0, east=0, south=0, north=0)
+    with tempfile.TemporaryDirectory() as case_dir_name:
+        domain_dir = pycpt.setup(Path(case_dir_name), fake_predictor_extent)
+        parallel = pycpt.evaluate_models(
+            original_hcsts, MOS, Y, original_fcsts, cpt_args, domain_dir, PREDICTOR_NAMES,
+            max_workers=2
+        )
+    for serial_results, parallel_results in zip(serial, parallel):
+        assert len(serial_results) == len(parallel_results) == len(PREDICTOR_NAMES)
+        for s, p in zip(serial_results, parallel_results):
+            assert s.equals(p)
+
 def test_evaluate_models_gamma():
     MOS = 'CCA'
     cpt_args = {'transform_predictand': 'Gamma'}
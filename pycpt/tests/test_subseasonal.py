@@ -98,6 +98,21 @@ def test_subseasonal():
         assert fcsts['probabilistic'].shape == (1, 2, 3, 1, 5, 5)
 
 
+def test_subseasonal_max_workers():
+    MOS = 'CCA'
+    fake_predictor_extent = dict(west=0, east=0, south=0, north=0)
+    Y, original_hcsts, original_fcsts = read_test_data()
+    with tempfile.TemporaryDirectory() as case_dir_name:
+        domain_dir = pycpt.setup(Path(case_dir_name), fake_predictor_extent)
+        serial = subseasonal.evaluate_models(
+            original_hcsts, original_fcsts, Y, MOS, cpt_args, domain_dir
+        )
+        parallel = subseasonal.evaluate_models(
+            original_hcsts, original_fcsts, Y, MOS, cpt_args, domain_dir, max_workers=2
+        )
+    for s, p in zip(serial, parallel):
+        assert s.identical(p)
+
 
 if __name__ == '__main__':
     download_test_data()
\ No newline at end of file